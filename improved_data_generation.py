@@ -1,17 +1,22 @@
 import json
 import random
 import os
+import sys
 import string
+import argparse
+import functools
+import multiprocessing as mp
 
 # ----------------------------------------------------
-# CONFIG
+# CONFIG (defaults, override on the command line)
 # ----------------------------------------------------
 TRAIN_SIZE = 1000
 DEV_SIZE = 200
-TEST_SIZE = 150       # you can change this freely
+TEST_SIZE = 150
 OUTPUT_DIR = "./data_advanced"
-
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+SHARD_SIZE = 20000
+WRITE_BUFFER = 16 * 1024 * 1024
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pii_ner_assignment", "src")
 
 # ----------------------------------------------------
 # STATIC DICTIONARIES
@@ -60,130 +65,184 @@ DIGIT_WORDS = {
     "9": ["nine"],
 }
 
+# ----------------------------------------------------
+# ALIGNED TOKENS
+# ----------------------------------------------------
+# An utterance is a list of (word, entity_index) pairs; entity_index is None for
+# template words. Every noise function rewrites this list instead of the raw string,
+# so entity offsets are derived from the final text and can never drift.
+
+def tokens_to_example(tokens, labels, idx):
+    words, spans = [], {}
+    pos = 0
+    for word, ent in tokens:
+        if words:
+            pos += 1
+        if ent is not None:
+            start, _ = spans.get(ent, (pos, pos))
+            spans[ent] = (start, pos + len(word))
+        words.append(word)
+        pos += len(word)
+
+    entities = [{"start": s, "end": e, "label": labels[ent]} for ent, (s, e) in spans.items()]
+    entities.sort(key=lambda x: x["start"])
+    return {"id": f"utt_{idx:04d}", "text": " ".join(words), "entities": entities}
+
+
+def replace_phrase(tokens, src, tgt, rng=None, choices=None):
+    """Replaces whole-word occurrences of `src` that lie inside a single entity (or none)."""
+    src_words = src.split()
+    n = len(src_words)
+    out = []
+    i = 0
+    while i < len(tokens):
+        window = tokens[i:i + n]
+        if [w for w, _ in window] == src_words and len({e for _, e in window}) == 1:
+            ent = window[0][1]
+            target = tgt if choices is None else rng.choice(choices)
+            out.extend((w, ent) for w in target.split())
+            i += n
+        else:
+            out.append(tokens[i])
+            i += 1
+    return out
+
+
+def contains_phrase(tokens, phrase):
+    words = phrase.split()
+    n = len(words)
+    if not any(w == words[0] for w, _ in tokens):
+        return False
+    return any([w for w, _ in tokens[i:i + n]] == words for i in range(len(tokens) - n + 1))
+
 # ----------------------------------------------------
 # ADVANCED NOISE FUNCTIONS
 # ----------------------------------------------------
 
-def random_letter_noise(word):
+def random_letter_noise(word, rng):
     """Randomly delete/insert/substitute characters."""
     if len(word) <= 3:
         return word
 
-    if random.random() < 0.1:  # deletion
-        idx = random.randint(0, len(word) - 1)
+    if rng.random() < 0.1:  # deletion
+        idx = rng.randint(0, len(word) - 1)
         return word[:idx] + word[idx+1:]
 
-    if random.random() < 0.1:  # substitution
-        idx = random.randint(0, len(word) - 1)
-        return word[:idx] + random.choice(string.ascii_lowercase) + word[idx+1:]
+    if rng.random() < 0.1:  # substitution
+        idx = rng.randint(0, len(word) - 1)
+        return word[:idx] + rng.choice(string.ascii_lowercase) + word[idx+1:]
 
-    if random.random() < 0.05:  # insertion
-        idx = random.randint(0, len(word) - 1)
-        return word[:idx] + random.choice(string.ascii_lowercase) + word[idx:]
+    if rng.random() < 0.05:  # insertion
+        idx = rng.randint(0, len(word) - 1)
+        return word[:idx] + rng.choice(string.ascii_lowercase) + word[idx:]
 
     return word
 
 
-def apply_homophones(text):
-    words = text.split()
+def apply_homophones(tokens, rng):
     out = []
-    for w in words:
-        if w in HOMOPHONES and random.random() < 0.3:
-            out.append(random.choice(HOMOPHONES[w]))
+    for w, ent in tokens:
+        if w in HOMOPHONES and rng.random() < 0.3:
+            out.append((rng.choice(HOMOPHONES[w]), ent))
         else:
-            out.append(w)
-    return " ".join(out)
+            out.append((w, ent))
+    return out
 
 
-def apply_merge_split_noise(text):
-    if random.random() < 0.2:
-        src, tgt = random.choice(ASR_MERGE_SPLIT)
-        return text.replace(src, tgt)
-    return text
+def apply_merge_split_noise(tokens, rng):
+    if rng.random() < 0.2:
+        src, tgt = rng.choice(ASR_MERGE_SPLIT)
+        return replace_phrase(tokens, src, tgt)
+    return tokens
 
 
-def apply_misspellings(text):
+def apply_misspellings(tokens, rng):
     for k, vlist in MISSPELLINGS.items():
-        if k in text and random.random() < 0.2:
-            text = text.replace(k, random.choice(vlist))
-    return text
+        if contains_phrase(tokens, k) and rng.random() < 0.2:
+            tokens = replace_phrase(tokens, k, rng.choice(vlist))
+    return tokens
 
 
-def random_filler_noise(text):
-    if random.random() < 0.3:
-        filler = random.choice(FILLERS)
-        insert_pos = random.choice(["start", "end", "middle"])
-        words = text.split()
+def random_filler_noise(tokens, rng):
+    if rng.random() < 0.3:
+        filler = [(w, None) for w in rng.choice(FILLERS).split()]
+        insert_pos = rng.choice(["start", "end", "middle"])
 
         if insert_pos == "start":
-            return filler + " " + text
+            return filler + tokens
         elif insert_pos == "end":
-            return text + " " + filler
+            return tokens + filler
         else:
-            idx = random.randint(0, len(words) - 1)
-            words.insert(idx, filler)
-            return " ".join(words)
+            # a filler dropped inside an entity stays inside its span, as in real speech
+            idx = rng.randint(0, len(tokens) - 1)
+            return tokens[:idx] + filler + tokens[idx:]
 
-    return text
+    return tokens
 
 
-def advanced_noise_pipeline(text):
-    text = apply_homophones(text)
-    text = apply_merge_split_noise(text)
-    text = apply_misspellings(text)
+def advanced_noise_pipeline(tokens, rng):
+    tokens = apply_homophones(tokens, rng)
+    tokens = apply_merge_split_noise(tokens, rng)
+    tokens = apply_misspellings(tokens, rng)
 
-    noisy_words = []
-    for w in text.split():
-        if random.random() < 0.15:
-            noisy_words.append(random_letter_noise(w))
+    noisy = []
+    for w, ent in tokens:
+        if rng.random() < 0.15:
+            noisy.append((random_letter_noise(w, rng), ent))
         else:
-            noisy_words.append(w)
-    text = " ".join(noisy_words)
+            noisy.append((w, ent))
 
-    text = random_filler_noise(text)
-    return text
+    return random_filler_noise(noisy, rng)
 
 # ----------------------------------------------------
 # ENTITY GENERATORS
 # ----------------------------------------------------
 
-def spelled_out_digits(n_digits=16):
-    digits = [str(random.randint(0, 9)) for _ in range(n_digits)]
-    return " ".join(random.choice(DIGIT_WORDS[d]) for d in digits)
+DIGIT_CHOICES = [DIGIT_WORDS[str(d)] for d in range(10)]
+
+
+def spelled_out_digits(rng, n_digits=16):
+    return " ".join(rng.choice(rng.choice(DIGIT_CHOICES)) for _ in range(n_digits))
 
 
-def random_email():
-    name = random.choice(["john", "alex", "sarah", "deepa", "raj", "maria"])
-    lname = random.choice(["doe", "kumar", "patel", "sharma", "thomas"])
-    domain = random.choice(EMAIL_DOMAINS)
-    tld = random.choice(["com", "co", "org", "in"])
+def random_email(rng):
+    name = rng.choice(["john", "alex", "sarah", "deepa", "raj", "maria"])
+    lname = rng.choice(["doe", "kumar", "patel", "sharma", "thomas"])
+    domain = rng.choice(EMAIL_DOMAINS)
+    tld = rng.choice(["com", "co", "org", "in"])
     return f"{name} dot {lname} at {domain} dot {tld}"
 
 
-def random_date():
-    day = random.randint(1, 28)
-    day_map = {
-        1:"first",2:"second",3:"third",4:"fourth",5:"fifth",6:"sixth",7:"seventh",8:"eighth",9:"ninth",
-        10:"tenth",11:"eleventh",12:"twelfth",13:"thirteenth",14:"fourteenth",15:"fifteenth",
-        16:"sixteenth",17:"seventeenth",18:"eighteenth",19:"nineteenth",20:"twentieth",
-        21:"twenty first",22:"twenty second",23:"twenty third",24:"twenty fourth",
-        25:"twenty fifth",26:"twenty sixth",27:"twenty seventh",28:"twenty eighth"
-    }
-    month = random.choice(MONTHS)
-    year = random.choice(["twenty nineteen", "twenty twenty", "twenty twenty one"])
-    return f"{day_map[day]} {month} {year}"
+DAY_WORDS = {
+    1:"first",2:"second",3:"third",4:"fourth",5:"fifth",6:"sixth",7:"seventh",8:"eighth",9:"ninth",
+    10:"tenth",11:"eleventh",12:"twelfth",13:"thirteenth",14:"fourteenth",15:"fifteenth",
+    16:"sixteenth",17:"seventeenth",18:"eighteenth",19:"nineteenth",20:"twentieth",
+    21:"twenty first",22:"twenty second",23:"twenty third",24:"twenty fourth",
+    25:"twenty fifth",26:"twenty sixth",27:"twenty seventh",28:"twenty eighth"
+}
 
 
-def generate_entities():
-    return {
-        "CREDIT_CARD": spelled_out_digits(random.choice([14, 15, 16])),
-        "PHONE": spelled_out_digits(10),
-        "EMAIL": random_email(),
-        "PERSON_NAME": random.choice(NAMES),
-        "DATE": random_date(),
-        "CITY": random.choice(CITY_LIST),
-        "LOCATION": random.choice(LOCATION_LIST)
-    }
+def random_date(rng):
+    day = rng.randint(1, 28)
+    month = rng.choice(MONTHS)
+    year = rng.choice(["twenty nineteen", "twenty twenty", "twenty twenty one"])
+    return f"{DAY_WORDS[day]} {month} {year}"
+
+
+ENTITY_GENERATORS = {
+    "CREDIT_CARD": lambda rng: spelled_out_digits(rng, rng.choice([14, 15, 16])),
+    "PHONE": lambda rng: spelled_out_digits(rng, 10),
+    "EMAIL": random_email,
+    "PERSON_NAME": lambda rng: rng.choice(NAMES),
+    "DATE": random_date,
+    "CITY": lambda rng: rng.choice(CITY_LIST),
+    "LOCATION": lambda rng: rng.choice(LOCATION_LIST),
+}
+
+
+def generate_entities(rng, needed=None):
+    needed = ENTITY_GENERATORS if needed is None else needed
+    return {label: ENTITY_GENERATORS[label](rng) for label in needed}
 
 # ----------------------------------------------------
 # TEMPLATES
@@ -204,40 +263,32 @@ TEMPLATES = [
     "reach me at {PHONE} or email me at {EMAIL}",
     "i need to update my card it is {CREDIT_CARD}",
 ]
+TEMPLATE_WORDS = [t.split() for t in TEMPLATES]
 
 # ----------------------------------------------------
 # EXAMPLE GENERATORS (LABELED + UNLABELED)
 # ----------------------------------------------------
 
-def make_labeled_example(idx):
-    template = random.choice(TEMPLATES)
-    ent_vals = generate_entities()
+def make_labeled_example(idx, rng):
+    words = rng.choice(TEMPLATE_WORDS)
+    ent_vals = generate_entities(rng, [w[1:-1] for w in words if w[0] == "{"])
 
-    # Insert entities & compute offsets BEFORE noise
-    text = template
-    entities = []
-
-    for ent_type, ent in ent_vals.items():
-        placeholder = "{" + ent_type + "}"
-        if placeholder in text:
-            start = text.index(placeholder)
-            text = text.replace(placeholder, ent, 1)
-            end = start + len(ent)
-            entities.append({"start": start, "end": end, "label": ent_type})
-
-    # Apply noise AFTER offsets
-    noisy_text = advanced_noise_pipeline(text).lower().strip()
+    tokens, labels = [], []
+    for word in words:
+        if word[0] == "{":
+            labels.append(word[1:-1])
+            tokens.extend((w, len(labels) - 1) for w in ent_vals[word[1:-1]].split())
+        else:
+            tokens.append((word, None))
 
-    return {
-        "id": f"utt_{idx:04d}",
-        "text": noisy_text,
-        "entities": entities
-    }
+    tokens = advanced_noise_pipeline(tokens, rng)
+    tokens = [(w.lower(), ent) for w, ent in tokens if w]
+    return tokens_to_example(tokens, labels, idx)
 
 
-def make_unlabeled_example(idx):
+def make_unlabeled_example(idx, rng):
     """Same distribution, but remove labels."""
-    ex = make_labeled_example(idx)
+    ex = make_labeled_example(idx, rng)
     return {
         "id": ex["id"],
         "text": ex["text"],
@@ -245,21 +296,161 @@ def make_unlabeled_example(idx):
     }
 
 # ----------------------------------------------------
-# WRITE DATASETS
+# SHARDED GENERATION
 # ----------------------------------------------------
 
-def write_jsonl(size, filename, labeled=True):
-    with open(filename, "w") as f:
-        for i in range(size):
-            if labeled:
-                ex = make_labeled_example(i)
-            else:
-                ex = make_unlabeled_example(i)
-            f.write(json.dumps(ex) + "\n")
-    print(f"Generated {size} → {filename}")
-
-
-# TRAIN + DEV + TEST
-write_jsonl(TRAIN_SIZE, os.path.join(OUTPUT_DIR, "train.jsonl"), labeled=True)
-write_jsonl(DEV_SIZE, os.path.join(OUTPUT_DIR, "dev.jsonl"), labeled=True)
-write_jsonl(TEST_SIZE, os.path.join(OUTPUT_DIR, "test.jsonl"), labeled=False)
+def shard_jobs(split, size, seed, labeled, shard_size=SHARD_SIZE):
+    return [
+        (split, i, start, min(size, start + shard_size), seed, labeled)
+        for i, start in enumerate(range(0, size, shard_size))
+    ]
+
+
+def generate_shard(job):
+    split, shard_idx, start, end, seed, labeled = job
+    # one RNG per shard: the output depends on (seed, split, shard), not on worker scheduling
+    rng = random.Random(f"{seed}:{split}:{shard_idx}")
+    make = make_labeled_example if labeled else make_unlabeled_example
+    lines = [json.dumps(make(i, rng)) for i in range(start, end)]
+    return split, "\n".join(lines) + "\n" if lines else ""
+
+
+_TOKENIZERS = {}
+
+
+def _get_tokenizer(name):
+    if name not in _TOKENIZERS:
+        from transformers import AutoTokenizer
+        _TOKENIZERS[name] = AutoTokenizer.from_pretrained(name)
+    return _TOKENIZERS[name]
+
+
+def generate_token_shard(job, out_dir, tokenizer_name, max_length):
+    """Like generate_shard, but tokenizes and writes input_ids/labels .npy files directly."""
+    import numpy as np
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    from dataset import align_labels, shard_paths
+    from labels import LABEL2ID
+
+    split, shard_idx, start, end, seed, labeled = job
+    rng = random.Random(f"{seed}:{split}:{shard_idx}")
+    make = make_labeled_example if labeled else make_unlabeled_example
+    examples = [make(i, rng) for i in range(start, end)]
+
+    tokenizer = _get_tokenizer(tokenizer_name)
+    enc = tokenizer(
+        [ex["text"] for ex in examples],
+        return_offsets_mapping=True,
+        truncation=True,
+        max_length=max_length,
+    )
+    input_ids, labels, row_splits = [], [], [0]
+    for ex, ids, offsets in zip(examples, enc["input_ids"], enc["offset_mapping"]):
+        input_ids.extend(ids)
+        labels.extend(align_labels(ex["text"], ex["entities"], offsets, LABEL2ID))
+        row_splits.append(len(input_ids))
+
+    name = f"{split}-{shard_idx:05d}"
+    paths = shard_paths(os.path.join(out_dir, f"{split}_tokens"), name)
+    np.save(paths["input_ids"], np.asarray(input_ids, dtype=np.int32))
+    np.save(paths["labels"], np.asarray(labels, dtype=np.int8))
+    np.save(paths["row_splits"], np.asarray(row_splits, dtype=np.int64))
+    return split, name, len(examples), tokenizer.pad_token_id
+
+
+def write_token_splits(splits, out_dir, seed, workers, tokenizer_name, max_length=256, shard_size=SHARD_SIZE):
+    """Writes <out_dir>/<name>_tokens/ shard directories readable by ShardedTokenDataset."""
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    from dataset import SHARD_META, vocab_hash
+    from labels import LABELS
+
+    # tokenizers are created inside the workers; keep their Rust thread pools quiet after fork
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    jobs = []
+    for name, size, labeled in splits:
+        os.makedirs(os.path.join(out_dir, f"{name}_tokens"), exist_ok=True)
+        jobs.extend(shard_jobs(name, size, seed, labeled, shard_size))
+
+    meta = {name: {"tokenizer": tokenizer_name, "vocab_hash": None, "max_length": max_length, "label_list": LABELS,
+                   "pad_token_id": None, "num_rows": 0, "shards": []} for name, _, _ in splits}
+    work = functools.partial(generate_token_shard, out_dir=out_dir,
+                             tokenizer_name=tokenizer_name, max_length=max_length)
+    if workers > 1:
+        with mp.Pool(workers) as pool:
+            results = list(pool.imap(work, jobs))
+    else:
+        results = [work(job) for job in jobs]
+
+    for split, shard, n_rows, pad_id in results:
+        meta[split]["shards"].append(shard)
+        meta[split]["num_rows"] += n_rows
+        meta[split]["pad_token_id"] = pad_id
+    # lets train.py reject shards from a tokenizer whose ids differ, even if its pad id matches
+    digest = vocab_hash(_get_tokenizer(tokenizer_name))
+    for name, m in meta.items():
+        m["vocab_hash"] = digest
+        shard_dir = os.path.join(out_dir, f"{name}_tokens")
+        with open(os.path.join(shard_dir, SHARD_META), "w", encoding="utf-8") as f:
+            json.dump(m, f, indent=2)
+        print(f"Generated {m['num_rows']} tokenized ({len(m['shards'])} shards) → {shard_dir}")
+
+
+def write_splits(splits, out_dir, seed, workers, shard_size=SHARD_SIZE):
+    """splits: list of (name, size, labeled). Writes <out_dir>/<name>.jsonl for each."""
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = []
+    for name, size, labeled in splits:
+        jobs.extend(shard_jobs(name, size, seed, labeled, shard_size))
+
+    files = {name: open(os.path.join(out_dir, f"{name}.jsonl"), "w", buffering=WRITE_BUFFER)
+             for name, _, _ in splits}
+    try:
+        if workers > 1:
+            with mp.Pool(workers) as pool:
+                for name, blob in pool.imap(generate_shard, jobs):
+                    files[name].write(blob)
+        else:
+            for job in jobs:
+                name, blob = generate_shard(job)
+                files[name].write(blob)
+    finally:
+        for f in files.values():
+            f.close()
+
+    for name, size, _ in splits:
+        print(f"Generated {size} → {os.path.join(out_dir, name + '.jsonl')}")
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out_dir", default=OUTPUT_DIR)
+    ap.add_argument("--train_size", type=int, default=TRAIN_SIZE)
+    ap.add_argument("--dev_size", type=int, default=DEV_SIZE)
+    ap.add_argument("--test_size", type=int, default=TEST_SIZE)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--shard_size", type=int, default=SHARD_SIZE)
+    ap.add_argument("--tokenizer", default=None,
+                    help="write pre-tokenized .npy shards for this tokenizer instead of JSONL")
+    ap.add_argument("--max_length", type=int, default=256)
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    splits = [
+        ("train", args.train_size, True),
+        ("dev", args.dev_size, True),
+        ("test", args.test_size, False),
+    ]
+    if args.tokenizer:
+        write_token_splits(splits, args.out_dir, args.seed, args.workers, args.tokenizer,
+                           max_length=args.max_length, shard_size=args.shard_size)
+    else:
+        write_splits(splits, args.out_dir, args.seed, args.workers, args.shard_size)
+
+
+if __name__ == "__main__":
+    main()
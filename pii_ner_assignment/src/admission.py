@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from data_io import iter_records
+from instrumentation import LATENCY_BUCKETS_MS, Metrics
+
+# degradation ladder, best first; requests that fit no rung are rejected
+LEVELS = ("full", "short", "light")
+REJECTED = "rejected"  # turned away on arrival: the predicted completion misses the deadline
+EXPIRED = "expired"  # admitted, but the deadline ran out while queued
+
+
+class FastTier:
+    """Gives a FastTagger the `predict_batch` interface of PIIRecognizer."""
+
+    def __init__(self, tagger):
+        self.tagger = tagger
+
+    def predict_batch(self, texts: List[str]) -> List[List[Dict[str, Any]]]:
+        return [self.tagger.predict(t)[0] for t in texts]
+
+    def close(self):
+        pass
+
+
+def load_light(model_dir: str, **recognizer_kwargs):
+    """A fast tagger dir (fast_tagger.py) or any checkpoint PIIRecognizer can load."""
+    from fast_tagger import MODEL_FILE, FastTagger
+
+    if os.path.exists(os.path.join(model_dir, MODEL_FILE)):
+        return FastTier(FastTagger.load(model_dir))
+    from recognizer import PIIRecognizer
+
+    return PIIRecognizer(model_dir, **recognizer_kwargs)
+
+
+class AdmissionController:
+    """Per-request deadlines in front of a PIIRecognizer, degrading instead of queueing past them.
+
+    Requests run one at a time on `workers` threads. On arrival the predicted completion
+    time is the queued work ahead (the sum of the service-time estimates of admitted,
+    unfinished requests, divided by `workers`) plus the estimate for a rung. The request
+    takes the first rung of the ladder that fits its deadline: the full model, the full model
+    truncated to `short_length` tokens, then the `light` model (a smaller checkpoint or a
+    FastTier). When none fits it is rejected right away. The check is repeated after the
+    queue wait, so a request that waited longer than predicted can still step down.
+    Estimates are an EWMA of observed service times per rung (see `calibrate`).
+    """
+
+    def __init__(self, recognizer, light=None, short_length: Optional[int] = 64, workers: int = 1,
+                 default_deadline_ms: Optional[float] = None, headroom: float = 1.2, alpha: float = 0.2,
+                 metrics: Optional[Metrics] = None):
+        self.ladder = [("full", recognizer, None)]
+        if short_length and short_length < recognizer.max_length:
+            self.ladder.append(("short", recognizer, short_length))
+        if light is not None:
+            self.ladder.append(("light", light, None))
+        self.workers = workers
+        self.default_deadline_ms = default_deadline_ms
+        self.headroom = headroom
+        self.alpha = alpha
+        self.estimates_ms: Dict[str, Optional[float]] = {name: None for name, _, _ in self.ladder}
+        self._backlog_ms = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pii-admission")
+
+        m = self.metrics = metrics if metrics is not None else Metrics()
+        self.requests = m.counter("admission_requests_total", "Requests per degradation level (or rejected/expired)")
+        self.missed = m.counter("admission_deadline_missed_total", "Served requests that finished past their deadline")
+        self.queue_time = m.histogram("admission_queue_time_ms", "Time from arrival to a worker picking it up",
+                                      LATENCY_BUCKETS_MS)
+        self.service_time = m.histogram("admission_service_time_ms", "Inference time per degradation level",
+                                        LATENCY_BUCKETS_MS)
+        self.backlog = m.gauge("admission_backlog_ms", "Estimated queued work ahead of a new request")
+
+    def calibrate(self, texts: Sequence[str], runs: int = 5):
+        """Seeds every rung's estimate with the median of `runs` requests (after one warmup)."""
+        for name, model, length in self.ladder:
+            times = []
+            for i in range(runs + 1):
+                start = time.perf_counter()
+                self._infer(model, length, texts[i % len(texts)])
+                times.append((time.perf_counter() - start) * 1000.0)
+            times = sorted(times[1:])
+            self.estimates_ms[name] = times[len(times) // 2]
+
+    def _estimate(self, name: str) -> float:
+        est = self.estimates_ms[name]
+        return 0.0 if est is None else est * self.headroom
+
+    def _pick(self, remaining_ms: float, wait_ms: float, first: int = 0) -> Optional[int]:
+        for i in range(first, len(self.ladder)):
+            if wait_ms + self._estimate(self.ladder[i][0]) <= remaining_ms:
+                return i
+        return None
+
+    @staticmethod
+    def _infer(model, length, text):
+        return model.predict_batch([text], max_length=length)[0] if length else model.predict_batch([text])[0]
+
+    def submit(self, text: str, deadline_ms: Optional[float] = None) -> Future:
+        """Admits or rejects `text` now; the future resolves to an outcome dict.
+
+        The outcome has "entities" (None unless served), "level" (a rung, "rejected" or
+        "expired"), "queue_ms", "service_ms" and "latency_ms" (from arrival).
+        """
+        arrival = time.perf_counter()
+        deadline_ms = self.default_deadline_ms if deadline_ms is None else deadline_ms
+        deadline = None if deadline_ms is None else arrival + deadline_ms / 1000.0
+        with self._lock:
+            wait_ms = self._backlog_ms / self.workers
+            rung = 0 if deadline is None else self._pick(deadline_ms, wait_ms)
+            if rung is not None:
+                cost = self._estimate(self.ladder[rung][0])
+                self._backlog_ms += cost
+                self.backlog.set(self._backlog_ms)
+        if rung is None:
+            self.requests.inc(level=REJECTED)
+            fut = Future()
+            fut.set_result(self._outcome(None, REJECTED, arrival, arrival, arrival))
+            return fut
+        return self._executor.submit(self._run, text, arrival, deadline, rung, cost)
+
+    def _run(self, text, arrival, deadline, rung, cost):
+        start = time.perf_counter()
+        try:
+            if deadline is not None:
+                rung = self._pick((deadline - start) * 1000.0, 0.0, first=rung)
+            if rung is None:
+                self.requests.inc(level=EXPIRED)
+                return self._outcome(None, EXPIRED, arrival, start, start)
+            name, model, length = self.ladder[rung]
+            self.queue_time.observe((start - arrival) * 1000.0, level=name)
+            ents = self._infer(model, length, text)
+            end = time.perf_counter()
+        finally:
+            with self._lock:
+                self._backlog_ms = max(0.0, self._backlog_ms - cost)
+                self.backlog.set(self._backlog_ms)
+
+        service_ms = (end - start) * 1000.0
+        with self._lock:
+            est = self.estimates_ms[name]
+            self.estimates_ms[name] = service_ms if est is None else (1 - self.alpha) * est + self.alpha * service_ms
+        self.service_time.observe(service_ms, level=name)
+        self.requests.inc(level=name)
+        if deadline is not None and end > deadline:
+            self.missed.inc(level=name)
+        return self._outcome(ents, name, arrival, start, end)
+
+    @staticmethod
+    def _outcome(ents, level, arrival, start, end) -> Dict[str, Any]:
+        return {"entities": ents, "level": level, "queue_ms": (start - arrival) * 1000.0,
+                "service_ms": (end - start) * 1000.0, "latency_ms": (end - arrival) * 1000.0}
+
+    def predict(self, text: str, deadline_ms: Optional[float] = None) -> Dict[str, Any]:
+        return self.submit(text, deadline_ms).result()
+
+    async def predict_async(self, text: str, deadline_ms: Optional[float] = None) -> Dict[str, Any]:
+        return await asyncio.wrap_future(self.submit(text, deadline_ms))
+
+    def counts(self) -> Dict[str, int]:
+        return {level: int(self.requests.value(level=level)) for level in LEVELS + (REJECTED, EXPIRED)
+                if self.requests.value(level=level)}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _percentile(sorted_vals, q):
+    return sorted_vals[max(0, int(q * len(sorted_vals)) - 1)] if sorted_vals else 0.0
+
+
+async def run_load(controller: AdmissionController, texts: Sequence[str], arrivals: Sequence[float],
+                   deadline_ms: Optional[float]) -> Dict[str, Any]:
+    """Open-loop load (see loadgen.run_load); latency percentiles cover served requests only."""
+    loop = asyncio.get_running_loop()
+    outcomes = []
+
+    async def one(text: str):
+        outcomes.append(await controller.predict_async(text, deadline_ms))
+
+    start = loop.time()
+    tasks = []
+    for i, offset in enumerate(arrivals):
+        delay = start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(texts[i % len(texts)])))
+    await asyncio.gather(*tasks)
+
+    served = sorted(o["latency_ms"] for o in outcomes if o["entities"] is not None)
+    levels = {}
+    for o in outcomes:
+        levels[o["level"]] = levels.get(o["level"], 0) + 1
+    n = max(1, len(outcomes))
+    return {
+        "requests": len(outcomes),
+        "offered_rps": len(arrivals) / arrivals[-1] if arrivals and arrivals[-1] > 0 else float("inf"),
+        "levels": levels,
+        "served_fraction": len(served) / n,
+        "p50_ms": _percentile(served, 0.50),
+        "p95_ms": _percentile(served, 0.95),
+        "p99_ms": _percentile(served, 0.99),
+        "deadline_missed": sum(1 for o in outcomes if deadline_ms is not None and o["entities"] is not None
+                               and o["latency_ms"] > deadline_ms),
+    }
+
+
+def main():
+    from loadgen import poisson_arrivals
+    from recognizer import PIIRecognizer
+
+    ap = argparse.ArgumentParser(description="Open-loop load test with deadline-aware admission control")
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--light_dir", default=None, help="lighter checkpoint or fast-tagger dir for the 'light' rung")
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--deadline_ms", type=float, default=50.0)
+    ap.add_argument("--short_length", type=int, default=64, help="token cap of the 'short' rung (0 = no rung)")
+    ap.add_argument("--headroom", type=float, default=1.2, help="multiplier on service-time estimates")
+    ap.add_argument("--rates", default="10,20,50,100", help="offered requests/s (Poisson arrivals)")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds of traffic per rate")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--compare", action="store_true", help="also run each rate without deadlines (always full)")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json_out", default=None)
+    ap.add_argument("--metrics_out", default=None, help="write the Prometheus counters here at the end")
+    args = ap.parse_args()
+
+    texts = [obj["text"] for obj in iter_records(args.input, columns=["text"])]
+    random.Random(args.seed).shuffle(texts)
+    recognizer = PIIRecognizer(args.model_dir, device=args.device, max_length=args.max_length, max_batch_size=1)
+    light = load_light(args.light_dir, device=args.device, max_length=args.max_length,
+                       max_batch_size=1) if args.light_dir else None
+    controller = AdmissionController(recognizer, light=light, short_length=args.short_length,
+                                     workers=args.workers, headroom=args.headroom)
+    controller.calibrate(texts)
+    print("Service-time estimates (ms): " + ", ".join(f"{k}={v:.2f}" for k, v in controller.estimates_ms.items()))
+
+    modes = [("admission", args.deadline_ms)] + ([("no_deadline", None)] if args.compare else [])
+    rows = []
+    print(f"{'rate':>6s} {'mode':>11s} {'served%':>7s} {'p50_ms':>8s} {'p95_ms':>8s} {'p99_ms':>8s} "
+          f"{'missed':>6s}  levels")
+    for i, rate in enumerate(float(r) for r in args.rates.split(",") if r):
+        arrivals = poisson_arrivals(rate, max(1, int(rate * args.duration)), seed=args.seed + i)
+        for mode, deadline in modes:
+            r = asyncio.run(run_load(controller, texts, arrivals, deadline))
+            r.update(rate=rate, mode=mode)
+            rows.append(r)
+            print(f"{rate:6g} {mode:>11s} {100 * r['served_fraction']:7.1f} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} "
+                  f"{r['p99_ms']:8.2f} {r['deadline_missed']:6d}  "
+                  + " ".join(f"{k}={v}" for k, v in sorted(r["levels"].items())), flush=True)
+    controller.close()
+    recognizer.close()
+    if light is not None:
+        light.close()
+
+    if args.metrics_out:
+        controller.metrics.write_prometheus(args.metrics_out)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"model_dir": args.model_dir, "light_dir": args.light_dir, "deadline_ms": args.deadline_ms,
+                       "workers": args.workers, "estimates_ms": controller.estimates_ms, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
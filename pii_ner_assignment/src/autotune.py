@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import platform
+import argparse
+import itertools
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from data_io import iter_records
+
+PROFILE_FILE = "autotune.json"
+
+
+def host_fingerprint() -> str:
+    """Identifies the CPU generation + core count; tuning profiles are stored per fingerprint."""
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{cpu} x{os.cpu_count()}"
+
+
+def load_tuning_profile(model_dir: str, fingerprint: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    path = os.path.join(model_dir, PROFILE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        profiles = json.load(f).get("profiles", {})
+    return profiles.get(fingerprint or host_fingerprint())
+
+
+def save_tuning_profile(model_dir: str, profile: Dict[str, Any], fingerprint: Optional[str] = None):
+    path = os.path.join(model_dir, PROFILE_FILE)
+    data = {"profiles": {}}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    data["profiles"][fingerprint or host_fingerprint()] = profile
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def _percentile(sorted_vals, q):
+    return sorted_vals[max(0, int(q * len(sorted_vals)) - 1)]
+
+
+def _bench_interop(model_dir: str, texts: List[str], interop: int, threads: List[int], batch_sizes: List[int],
+                   backends: List[str], max_length: int, repeats: int, min_agreement: float):
+    # Runs in a fresh process: the inter-op pool size can only be set once per process.
+    import torch
+
+    torch.set_num_interop_threads(interop)
+
+    from backends import apply_backend
+    from loading import load_model, load_tokenizer
+
+    tokenizer = load_tokenizer(model_dir)
+    base = load_model(model_dir, device="cpu")
+    reference = None
+    results = []
+    for backend in backends:
+        model = apply_backend(base, backend, tokenizer)
+        for n_threads, bs in itertools.product(threads, batch_sizes):
+            torch.set_num_threads(n_threads)
+            batches = [texts[i:i + bs] for i in range(0, len(texts), bs)]
+            encs = [tokenizer(b, truncation=True, max_length=max_length, padding=True, return_tensors="pt")
+                    for b in batches]
+            preds = []
+            with torch.no_grad():
+                for enc in encs[:2]:
+                    model(input_ids=enc["input_ids"], attention_mask=enc["attention_mask"])
+                latencies = []
+                start = time.perf_counter()
+                for r in range(repeats):
+                    for b, enc in zip(batches, encs):
+                        t0 = time.perf_counter()
+                        out = model(input_ids=enc["input_ids"], attention_mask=enc["attention_mask"])
+                        ms = (time.perf_counter() - t0) * 1000.0
+                        latencies.extend([ms] * len(b))
+                        if r == 0:
+                            mask = enc["attention_mask"].bool()
+                            preds.append(out.logits.argmax(-1)[mask])
+                elapsed = time.perf_counter() - start
+            preds = torch.cat(preds)
+            if reference is None:
+                reference = preds
+            agreement = float((preds == reference).float().mean())
+            latencies.sort()
+            results.append({
+                "backend": backend,
+                "num_threads": n_threads,
+                "num_interop_threads": interop,
+                "batch_size": bs,
+                "throughput": len(texts) * repeats / elapsed,
+                "p50_ms": _percentile(latencies, 0.50),
+                "p95_ms": _percentile(latencies, 0.95),
+                "agreement": agreement,
+                "valid": agreement >= min_agreement,
+            })
+            r = results[-1]
+            print(f"  {backend:12s} threads={n_threads:<3d} interop={interop:<2d} bs={bs:<3d} "
+                  f"{r['throughput']:8.1f} utt/s  p95={r['p95_ms']:7.2f} ms  agree={agreement:.4f}", flush=True)
+    return results
+
+
+def pick_best(results: List[Dict[str, Any]], p95_ms: float) -> Dict[str, Any]:
+    valid = [r for r in results if r["valid"]]
+    within = [r for r in valid if r["p95_ms"] <= p95_ms]
+    if within:
+        return max(within, key=lambda r: r["throughput"])
+    return min(valid or results, key=lambda r: r["p95_ms"])
+
+
+def autotune(model_dir: str, texts: List[str], threads: List[int], interops: List[int], batch_sizes: List[int],
+             backends: List[str], p95_ms: float = 20.0, max_length: int = 256, repeats: int = 2,
+             min_agreement: float = 0.995) -> Dict[str, Any]:
+    results = []
+    ctx = mp.get_context("spawn")
+    for interop in interops:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as ex:
+            results.extend(ex.submit(_bench_interop, model_dir, texts, interop, threads, batch_sizes,
+                                     backends, max_length, repeats, min_agreement).result())
+    best = pick_best(results, p95_ms)
+    return {
+        "num_threads": best["num_threads"],
+        "num_interop_threads": best["num_interop_threads"],
+        "batch_size": best["batch_size"],
+        "backend": best["backend"],
+        "throughput": best["throughput"],
+        "p95_ms": best["p95_ms"],
+        "p95_constraint_ms": p95_ms,
+        "met_constraint": best["p95_ms"] <= p95_ms,
+        "measured_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "candidates": results,
+    }
+
+
+def _int_list(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x]
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    default_threads = sorted({t for t in (1, 2, 4, 8, 16, 32) if t <= cpus} | {cpus})
+
+    ap = argparse.ArgumentParser(description="Sweep threads / batch size / backend and save the best per host")
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--sample", type=int, default=200)
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--threads", type=_int_list, default=default_threads)
+    ap.add_argument("--interop_threads", type=_int_list, default=[1, 2])
+    ap.add_argument("--batch_sizes", type=_int_list, default=[1, 4, 8, 16, 32])
+    ap.add_argument("--backends", default="eager,torchscript,dynamic_int8")
+    ap.add_argument("--p95_ms", type=float, default=20.0, help="p95 per-request latency budget")
+    ap.add_argument("--repeats", type=int, default=2)
+    ap.add_argument("--min_agreement", type=float, default=0.995,
+                    help="minimum token agreement with eager for a backend to be eligible")
+    args = ap.parse_args()
+
+    texts = []
+    for obj in iter_records(args.input, columns=["text"]):
+        texts.append(obj["text"])
+        if len(texts) >= args.sample:
+            break
+
+    backends = [b for b in args.backends.split(",") if b]
+    if "eager" in backends:
+        backends.remove("eager")
+        backends.insert(0, "eager")  # eager runs first and is the agreement reference
+
+    fingerprint = host_fingerprint()
+    print(f"Autotuning {args.model_dir} on {fingerprint} with {len(texts)} utterances")
+    profile = autotune(args.model_dir, texts, args.threads, args.interop_threads, args.batch_sizes, backends,
+                       p95_ms=args.p95_ms, max_length=args.max_length, repeats=args.repeats,
+                       min_agreement=args.min_agreement)
+    save_tuning_profile(args.model_dir, profile, fingerprint)
+
+    print(f"\nBest: backend={profile['backend']} threads={profile['num_threads']} "
+          f"interop={profile['num_interop_threads']} batch_size={profile['batch_size']} "
+          f"-> {profile['throughput']:.1f} utt/s, p95={profile['p95_ms']:.2f} ms"
+          + ("" if profile["met_constraint"] else f" (no config met p95 <= {args.p95_ms} ms)"))
+    print(f"Saved profile to {os.path.join(args.model_dir, PROFILE_FILE)}")
+
+
+if __name__ == "__main__":
+    main()
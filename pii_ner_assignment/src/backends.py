@@ -0,0 +1,19 @@
+from loading import SnapshotModel, trace_model
+
+BACKENDS = ("eager", "torchscript", "dynamic_int8")
+
+
+def apply_backend(model, backend: str, tokenizer=None):
+    """Returns `model` converted for the given inference backend (CPU only for non-eager)."""
+    if backend == "eager" or isinstance(model, SnapshotModel):
+        return model
+    if backend == "dynamic_int8":
+        import torch
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        model.eval()
+        return model
+    if backend == "torchscript":
+        if tokenizer is None:
+            raise ValueError("the torchscript backend needs a tokenizer to build example inputs")
+        return SnapshotModel(module=trace_model(model, tokenizer), device="cpu")
+    raise ValueError(f"unknown backend {backend!r}; expected one of {BACKENDS}")
@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+from typing import Iterable, Sequence
+
+from loading import SnapshotModel
+
+DEFAULT_BUCKETS = (16, 32, 64, 128, 256)
+BUCKET_MODES = ("trace", "compile", "pad")
+
+
+def parse_buckets(spec: str) -> tuple:
+    return tuple(sorted(int(x) for x in spec.split(",") if x))
+
+
+def pick_bucket(length: int, buckets: Sequence[int]):
+    for b in buckets:
+        if length <= b:
+            return b
+    return None
+
+
+class BucketedModel:
+    """Pads every batch to the tightest of a few fixed lengths and runs a graph prepared per length.
+
+    mode="trace" freezes one TorchScript graph per bucket, "compile" uses torch.compile with
+    static shapes, and "pad" only pads (useful on top of a snapshot or quantized model).
+    Sequences longer than the largest bucket fall back to the unbucketed model.
+    """
+
+    def __init__(self, model, buckets: Sequence[int] = DEFAULT_BUCKETS, pad_token_id: int = 0,
+                 mode: str = "trace", device: str = "cpu"):
+        import torch
+
+        if mode not in BUCKET_MODES:
+            raise ValueError(f"unknown bucket mode {mode!r}; expected one of {BUCKET_MODES}")
+        self.base = model
+        self.buckets = tuple(sorted(buckets))
+        self.pad_token_id = pad_token_id
+        self.device = device
+        self.mode = mode
+        self.runners = {}
+
+        if isinstance(model, SnapshotModel) or mode == "pad":
+            for b in self.buckets:
+                self.runners[b] = self._call_base
+        elif mode == "compile":
+            compiled = torch.compile(model, dynamic=False)
+            for b in self.buckets:
+                self.runners[b] = compiled
+        else:
+            return_dict = model.config.return_dict
+            model.config.return_dict = False
+            try:
+                for b in self.buckets:
+                    ids = torch.full((1, b), pad_token_id, dtype=torch.long, device=device)
+                    mask = torch.ones((1, b), dtype=torch.long, device=device)
+                    mask[:, b // 2:] = 0  # trace with padding present so the mask path is kept
+                    with torch.no_grad():
+                        traced = torch.jit.trace(model, (ids, mask), strict=False)
+                    self.runners[b] = torch.jit.freeze(traced.eval())
+            finally:
+                model.config.return_dict = return_dict
+
+    def _call_base(self, input_ids, attention_mask):
+        return self.base(input_ids=input_ids, attention_mask=attention_mask)
+
+    def to(self, device):
+        self.device = device
+        return self
+
+    def eval(self):
+        return self
+
+    def warmup(self, batch_sizes: Iterable[int] = (1,), iters: int = 3):
+        import torch
+
+        with torch.no_grad():
+            for bs in batch_sizes:
+                for b in self.buckets:
+                    ids = torch.full((bs, b), self.pad_token_id, dtype=torch.long, device=self.device)
+                    mask = torch.ones((bs, b), dtype=torch.long, device=self.device)
+                    for _ in range(iters):
+                        self(input_ids=ids, attention_mask=mask)
+
+    def __call__(self, input_ids, attention_mask):
+        import torch.nn.functional as F
+
+        length = input_ids.shape[1]
+        bucket = pick_bucket(length, self.buckets)
+        if bucket is None:
+            return self._call_base(input_ids, attention_mask)
+        if bucket != length:
+            input_ids = F.pad(input_ids, (0, bucket - length), value=self.pad_token_id)
+            attention_mask = F.pad(attention_mask, (0, bucket - length), value=0)
+        out = self.runners[bucket](input_ids, attention_mask)
+        logits = out[0] if isinstance(out, (tuple, list)) else out.logits
+        return SimpleNamespace(logits=logits[:, :length])
@@ -0,0 +1,126 @@
+import json
+import time
+import argparse
+from typing import Any, Dict, List, Tuple
+
+from data_io import iter_records
+from fast_tagger import FastTagger
+
+
+class Cascade:
+    """Answers confident utterances with the fast tagger and sends the rest to the transformer.
+
+    `threshold` is the lowest per-word confidence the fast tier may answer with: 0 sends
+    everything to the fast tier, anything above 1 sends everything to the transformer.
+    """
+
+    def __init__(self, fast: FastTagger, recognizer, threshold: float = 0.5, metrics=None):
+        self.fast = fast
+        self.recognizer = recognizer
+        self.threshold = threshold
+        self.requests = metrics.counter("cascade_requests_total", "Requests answered per cascade tier") \
+            if metrics is not None else None
+
+    def predict(self, text: str) -> Tuple[List[Dict[str, Any]], str]:
+        ents, confidence = self.fast.predict(text)
+        tier = "fast"
+        if confidence < self.threshold:
+            ents, tier = self.recognizer.predict(text), "model"
+        if self.requests is not None:
+            self.requests.inc(tier=tier)
+        return ents, tier
+
+
+def _percentile(sorted_vals, q):
+    return sorted_vals[max(0, int(q * len(sorted_vals)) - 1)]
+
+
+def sweep(records, fast_out, model_out, thresholds) -> List[Dict[str, Any]]:
+    """Blends per-utterance results of both tiers for each threshold.
+
+    The cascade always pays for the fast tier, plus the transformer on fallback, so the
+    blended latency of an utterance is fast_ms (+ model_ms when it falls back).
+    """
+    from eval_span_f1 import SpanCounter, summarize
+
+    rows = []
+    for thr in thresholds:
+        counter = SpanCounter()
+        latencies = []
+        n_fast = 0
+        for (_, gold), (f_spans, conf, f_ms), (m_spans, m_ms) in zip(records, fast_out, model_out):
+            if conf >= thr:
+                n_fast += 1
+                counter.add(gold, f_spans)
+                latencies.append(f_ms)
+            else:
+                counter.add(gold, m_spans)
+                latencies.append(f_ms + m_ms)
+        report = summarize(counter.finish())
+        latencies.sort()
+        n = max(1, len(records))
+        rows.append({
+            "threshold": thr,
+            "fast_fraction": n_fast / n,
+            "model_fraction": 1 - n_fast / n,
+            "mean_ms": sum(latencies) / n,
+            "p50_ms": _percentile(latencies, 0.50),
+            "p95_ms": _percentile(latencies, 0.95),
+            "pii_precision": report["pii"]["precision"],
+            "pii_recall": report["pii"]["recall"],
+            "pii_f1": report["pii"]["f1"],
+            "macro_f1": report["macro_f1"],
+        })
+    return rows
+
+
+def main():
+    from recognizer import PIIRecognizer
+
+    ap = argparse.ArgumentParser(description="Evaluate the fast-tagger -> transformer cascade")
+    ap.add_argument("--fast_dir", default="out_fast")
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--thresholds", default="0,0.3,0.4,0.5,0.6,0.7,1.01",
+                    help="fast-tier confidence thresholds; 0 = fast tier only, >1 = transformer only")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--json_out", default=None)
+    args = ap.parse_args()
+
+    records = [(obj["text"], [(e["start"], e["end"], e["label"]) for e in obj.get("entities") or []])
+               for obj in iter_records(args.input)]
+
+    fast = FastTagger.load(args.fast_dir)
+    recognizer = PIIRecognizer(args.model_dir, device=args.device, max_length=args.max_length, max_batch_size=1)
+    for text, _ in records[:5]:
+        fast.predict(text)
+        recognizer.predict(text)
+
+    fast_out, model_out = [], []
+    for text, _ in records:
+        start = time.perf_counter()
+        ents, conf = fast.predict(text)
+        fast_out.append(([(e["start"], e["end"], e["label"]) for e in ents], conf,
+                         (time.perf_counter() - start) * 1000.0))
+        start = time.perf_counter()
+        ents = recognizer.predict(text)
+        model_out.append(([(e["start"], e["end"], e["label"]) for e in ents], (time.perf_counter() - start) * 1000.0))
+    recognizer.close()
+
+    thresholds = [float(x) for x in args.thresholds.split(",") if x]
+    rows = sweep(records, fast_out, model_out, thresholds)
+    print(f"{'threshold':>9s} {'fast%':>6s} {'model%':>6s} {'mean_ms':>8s} {'p50_ms':>7s} {'p95_ms':>7s} "
+          f"{'PII_P':>6s} {'PII_R':>6s} {'PII_F1':>6s}")
+    for r in rows:
+        print(f"{r['threshold']:9.3f} {100 * r['fast_fraction']:6.1f} {100 * r['model_fraction']:6.1f} "
+              f"{r['mean_ms']:8.3f} {r['p50_ms']:7.3f} {r['p95_ms']:7.3f} "
+              f"{r['pii_precision']:6.3f} {r['pii_recall']:6.3f} {r['pii_f1']:6.3f}")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"fast_dir": args.fast_dir, "model_dir": args.model_dir, "input": args.input,
+                       "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
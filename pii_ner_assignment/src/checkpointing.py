@@ -0,0 +1,145 @@
+import os
+import re
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+CHECKPOINT_DIR = "checkpoints"
+_NAME = re.compile(r"^step_(\d+)\.pt$")
+
+
+def checkpoint_path(ckpt_dir: str, step: int) -> str:
+    return os.path.join(ckpt_dir, f"step_{step:08d}.pt")
+
+
+def list_checkpoints(ckpt_dir: str) -> List[str]:
+    """Complete checkpoints, oldest first (partial writes only ever exist as .tmp files)."""
+    if not os.path.isdir(ckpt_dir):
+        return []
+    names = sorted((int(m.group(1)), name) for name in os.listdir(ckpt_dir) if (m := _NAME.match(name)))
+    return [os.path.join(ckpt_dir, name) for _, name in names]
+
+
+def latest_checkpoint(ckpt_dir: str) -> Optional[str]:
+    found = list_checkpoints(ckpt_dir)
+    return found[-1] if found else None
+
+
+def rng_state() -> Dict[str, Any]:
+    import numpy as np
+    import torch
+
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state: Dict[str, Any]):
+    import numpy as np
+    import torch
+
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def cpu_copy(obj):
+    """Deep copy with every tensor cloned to CPU, so training can keep mutating the originals."""
+    import torch
+
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: cpu_copy(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cpu_copy(v) for v in obj)
+    return obj
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    import torch
+
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+class AsyncCheckpointer:
+    """Writes training checkpoints from a background thread and keeps the newest `keep`.
+
+    `save` only copies the state to CPU memory on the caller's thread; serialization,
+    fsync and the atomic rename happen in the writer thread. At most one checkpoint waits
+    behind the one being written, so a slow disk makes `save` block rather than pile up
+    copies in memory. A failed write is re-raised from the next `save` or `close`.
+    """
+
+    def __init__(self, ckpt_dir: str, keep: int = 3):
+        self.ckpt_dir = ckpt_dir
+        self.keep = keep
+        self.written = 0
+        self.snapshot_s = 0.0
+        self.write_s = 0.0
+        self._error: Optional[BaseException] = None
+        self._queue: "queue.Queue" = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._writer, name="pii-checkpoint", daemon=True)
+        self._thread.start()
+        os.makedirs(ckpt_dir, exist_ok=True)
+
+    def save(self, step: int, state: Dict[str, Any]):
+        self._raise()
+        start = time.perf_counter()
+        snapshot = cpu_copy(state)
+        self.snapshot_s += time.perf_counter() - start
+        self._queue.put((step, snapshot))
+
+    def _writer(self):
+        import torch
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            step, snapshot = item
+            try:
+                start = time.perf_counter()
+                path = checkpoint_path(self.ckpt_dir, step)
+                tmp = path + ".tmp"
+                with open(tmp, "wb") as f:
+                    torch.save(snapshot, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, path)
+                for old in list_checkpoints(self.ckpt_dir)[:-self.keep] if self.keep else []:
+                    os.remove(old)
+                self.write_s += time.perf_counter() - start
+                self.written += 1
+            except BaseException as e:  # surfaced on the training thread
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise(self):
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise RuntimeError(f"writing a checkpoint to {self.ckpt_dir} failed") from err
+
+    def wait(self):
+        """Blocks until every queued checkpoint is on disk."""
+        self._queue.join()
+        self._raise()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,244 @@
+import os
+import json
+import argparse
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from labels import label_is_pii
+
+# Utterances: id, text, entities (list<struct<start, end, label>>).
+# Predictions: id, entities (list<struct<start, end, label, pii>>), like predict.py's JSON.
+# Columnar files are picked by extension.
+COLUMNAR_EXTS = (".parquet", ".arrow")
+BATCH_ROWS = 8192
+
+
+def is_columnar(path: str) -> bool:
+    return path.endswith(COLUMNAR_EXTS)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as e:
+        raise ImportError("Reading/writing .parquet or .arrow files requires pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+
+def schema(with_text: bool = True):
+    """Utterance schema, or with `with_text=False` the prediction schema (spans carry `pii`)."""
+    pa = _pyarrow()
+    span_fields = [("start", pa.int32()), ("end", pa.int32()), ("label", pa.string())]
+    if not with_text:
+        span_fields.append(("pii", pa.bool_()))
+    span = pa.struct(span_fields)
+    fields = [("id", pa.string())]
+    if with_text:
+        fields.append(("text", pa.string()))
+    fields.append(("entities", pa.list_(span)))
+    return pa.schema(fields)
+
+
+def iter_batches(path: str, columns: Optional[Sequence[str]] = None, batch_size: int = BATCH_ROWS):
+    """Record batches of a .parquet or .arrow file.
+
+    Arrow IPC files are memory-mapped, so their batches reference the file pages directly.
+    """
+    pa = _pyarrow()
+    if path.endswith(".parquet"):
+        pf = pa.parquet.ParquetFile(path, memory_map=True)
+        yield from pf.iter_batches(batch_size=batch_size, columns=list(columns) if columns else None)
+        return
+    reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        yield batch.select(list(columns)) if columns else batch
+
+
+def count_rows(path: str) -> int:
+    if is_columnar(path):
+        pa = _pyarrow()
+        if path.endswith(".parquet"):
+            return pa.parquet.ParquetFile(path).metadata.num_rows
+        return sum(b.num_rows for b in iter_batches(path, columns=["id"]))
+    with open(path, "r", encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def iter_records(path: str, columns: Optional[Sequence[str]] = None) -> Iterator[Dict[str, Any]]:
+    """Dict per utterance from JSONL, a columnar file, or predict.py's single JSON object."""
+    if is_columnar(path):
+        for batch in iter_batches(path, columns):
+            yield from batch.to_pylist()
+        return
+    if not path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            obj = json.load(f)
+        if isinstance(obj, dict):
+            for uid, ents in obj.items():
+                yield {"id": uid, "entities": ents}
+            return
+        yield from obj
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_text_batches(path: str, batch_size: int = 64) -> Iterator[Tuple[List[str], List[str]]]:
+    """(ids, texts) chunks, read column-wise from columnar files without building row dicts."""
+    if is_columnar(path):
+        for batch in iter_batches(path, columns=["id", "text"], batch_size=batch_size):
+            yield batch.column(0).to_pylist(), batch.column(1).to_pylist()
+        return
+    ids, texts = [], []
+    for obj in iter_records(path):
+        ids.append(obj["id"])
+        texts.append(obj["text"])
+        if len(ids) >= batch_size:
+            yield ids, texts
+            ids, texts = [], []
+    if ids:
+        yield ids, texts
+
+
+def iter_spans(path: str, start: int = 0, end: Optional[int] = None):
+    """(id, [(start, end, label), ...]) for rows [start, end) of a columnar file.
+
+    Span offsets come straight from the Arrow buffers as NumPy views; only ids and
+    labels are materialized as Python strings.
+    """
+    row = 0
+    for batch in iter_batches(path, columns=["id", "entities"]):
+        n = batch.num_rows
+        if end is not None and row >= end:
+            break
+        if row + n <= start:
+            row += n
+            continue
+        ids = batch.column(0).to_pylist()
+        ents = batch.column(1)
+        offsets = ents.offsets.to_numpy()
+        values = ents.values
+        starts = values.field("start").to_numpy(zero_copy_only=False)
+        ends = values.field("end").to_numpy(zero_copy_only=False)
+        labels = values.field("label").to_pylist()
+        for i in range(max(0, start - row), n if end is None else min(n, end - row)):
+            a, b = offsets[i], offsets[i + 1]
+            yield ids[i], [(int(starts[k]), int(ends[k]), labels[k]) for k in range(a, b)]
+        row += n
+
+
+def row_ranges(path: str, n: int) -> List[Tuple[int, Optional[int]]]:
+    rows = count_rows(path)
+    bounds = [rows * i // n for i in range(n + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(n)]
+
+
+class RecordWriter:
+    """Streams records to JSONL, .parquet or .arrow; .json keeps predict.py's single {id: entities} object."""
+
+    def __init__(self, path: str, with_text: bool = True, batch_size: int = BATCH_ROWS):
+        self.path = path
+        self.with_text = with_text
+        self.batch_size = batch_size
+        self.rows = []
+        self.count = 0
+        self._writer = None
+        self._file = None
+        self._legacy = None
+        if is_columnar(path):
+            pa = _pyarrow()
+            self.schema = schema(with_text)
+            if path.endswith(".parquet"):
+                self._writer = pa.parquet.ParquetWriter(path, self.schema)
+            else:
+                self._file = pa.OSFile(path, "wb")
+                self._writer = pa.ipc.new_file(self._file, self.schema)
+        elif path.endswith(".jsonl"):
+            self._file = open(path, "w", encoding="utf-8")
+        else:
+            self._legacy = {}
+
+    def write(self, record: Dict[str, Any]):
+        self.count += 1
+        if self._legacy is not None:
+            self._legacy[record["id"]] = record.get("entities", [])
+        elif self._writer is None:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            self.rows.append(record)
+            if len(self.rows) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self.rows:
+            return
+        pa = _pyarrow()
+        cols = {"id": [r["id"] for r in self.rows]}
+        if self.with_text:
+            cols["text"] = [r["text"] for r in self.rows]
+        if self.with_text:
+            cols["entities"] = [[{"start": e["start"], "end": e["end"], "label": e["label"]}
+                                 for e in r.get("entities", [])] for r in self.rows]
+        else:
+            # predict.py always sets pii; spans from elsewhere get it from their label
+            cols["entities"] = [[{"start": e["start"], "end": e["end"], "label": e["label"],
+                                  "pii": bool(e["pii"]) if "pii" in e else label_is_pii(e["label"])}
+                                 for e in r.get("entities", [])] for r in self.rows]
+        self._writer.write_batch(pa.RecordBatch.from_pydict(cols, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        if self._legacy is not None:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self._legacy, f, ensure_ascii=False, indent=2)
+            self._legacy = None
+        elif self._writer is not None:
+            self._flush()
+            self._writer.close()
+            if self._file is not None:
+                self._file.close()
+            self._writer = None
+        elif self._file is not None:
+            self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_predictions(path: str, predictions: Iterable[Tuple[str, List[Dict[str, Any]]]]) -> int:
+    with RecordWriter(path, with_text=False) as w:
+        for uid, ents in predictions:
+            w.write({"id": uid, "entities": ents})
+    return w.count
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert utterance or prediction files between JSON(L), Parquet and Arrow")
+    ap.add_argument("input")
+    ap.add_argument("output")
+    args = ap.parse_args()
+
+    records = iter_records(args.input)
+    first = next(records, None)
+    with_text = first is not None and "text" in first
+    out_dir = os.path.dirname(args.output)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with RecordWriter(args.output, with_text=with_text) as w:
+        if first is not None:
+            w.write(first)
+        for rec in records:
+            w.write(rec)
+    print(f"Wrote {w.count} {'utterances' if with_text else 'predictions'} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
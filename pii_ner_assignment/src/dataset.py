@@ -1,71 +1,94 @@
+import os
 import json
-from typing import List, Dict, Any
-from torch.utils.data import Dataset
+import math
+import random
+import itertools
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from torch.utils.data import Dataset, IterableDataset, Sampler, get_worker_info
+
+from data_io import iter_records
+from normalizer import normalize as normalize_text, normalize_entities
+
+
+def align_labels(text: str, entities, offsets, label2id: Dict[str, int]) -> List[int]:
+    char_tags = ["O"] * len(text)
+    for e in entities:
+        s, e_idx, lab = e["start"], e["end"], e["label"]
+        if s < 0 or e_idx > len(text) or s >= e_idx:
+            continue
+        char_tags[s] = f"B-{lab}"
+        for i in range(s + 1, e_idx):
+            char_tags[i] = f"I-{lab}"
+
+    bio_tags = []
+    for (start, end) in offsets:
+        if start == end:
+            bio_tags.append("O")
+        else:
+            if start < len(char_tags):
+                bio_tags.append(char_tags[start])
+            else:
+                bio_tags.append("O")
+
+    return [label2id.get(t, label2id["O"]) for t in bio_tags]
+
+
+def encode_example(text: str, entities, tokenizer, label2id: Dict[str, int], max_length: int = 256) -> Dict[str, Any]:
+    enc = tokenizer(
+        text,
+        return_offsets_mapping=True,
+        truncation=True,
+        max_length=max_length,
+        add_special_tokens=True,
+    )
+    offsets = enc["offset_mapping"]
+    input_ids = enc["input_ids"]
+    label_ids = align_labels(text, entities, offsets, label2id)
+    if len(label_ids) != len(input_ids):
+        label_ids = [label2id["O"]] * len(input_ids)
+    return {
+        "input_ids": input_ids,
+        "attention_mask": enc["attention_mask"],
+        "labels": label_ids,
+        "offset_mapping": offsets,
+    }
 
 
 class PIIDataset(Dataset):
-    def __init__(self, path: str, tokenizer, label_list: List[str], max_length: int = 256, is_train: bool = True):
+    def __init__(self, path: str, tokenizer, label_list: List[str], max_length: int = 256, is_train: bool = True,
+                 normalize: bool = False):
         self.items = []
         self.tokenizer = tokenizer
         self.label_list = label_list
         self.label2id = {l: i for i, l in enumerate(label_list)}
         self.max_length = max_length
         self.is_train = is_train
+        self.normalize = normalize
+
+        for obj in iter_records(path):
+            text = obj["text"]
+            entities = obj.get("entities") or []
+            if normalize:
+                # train on exactly what PIIRecognizer feeds the model for this checkpoint
+                norm = normalize_text(text)
+                text, entities = norm.text, normalize_entities(norm, entities)
 
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                obj = json.loads(line)
-                text = obj["text"]
-                entities = obj.get("entities", [])
-
-                char_tags = ["O"] * len(text)
-                for e in entities:
-                    s, e_idx, lab = e["start"], e["end"], e["label"]
-                    if s < 0 or e_idx > len(text) or s >= e_idx:
-                        continue
-                    char_tags[s] = f"B-{lab}"
-                    for i in range(s + 1, e_idx):
-                        char_tags[i] = f"I-{lab}"
-
-                enc = tokenizer(
-                    text,
-                    return_offsets_mapping=True,
-                    truncation=True,
-                    max_length=self.max_length,
-                    add_special_tokens=True,
-                )
-                offsets = enc["offset_mapping"]
-                input_ids = enc["input_ids"]
-                attention_mask = enc["attention_mask"]
-
-                bio_tags = []
-                for (start, end) in offsets:
-                    if start == end:
-                        bio_tags.append("O")
-                    else:
-                        if start < len(char_tags):
-                            bio_tags.append(char_tags[start])
-                        else:
-                            bio_tags.append("O")
-
-                if len(bio_tags) != len(input_ids):
-                    bio_tags = ["O"] * len(input_ids)
-
-                label_ids = [self.label2id.get(t, self.label2id["O"]) for t in bio_tags]
-
-                self.items.append(
-                    {
-                        "id": obj["id"],
-                        "text": text,
-                        "input_ids": input_ids,
-                        "attention_mask": attention_mask,
-                        "labels": label_ids,
-                        "offset_mapping": offsets,
-                    }
-                )
+            enc = encode_example(text, entities, tokenizer, self.label2id, self.max_length)
+            input_ids = enc["input_ids"]
+            attention_mask = enc["attention_mask"]
+            label_ids = enc["labels"]
+            offsets = enc["offset_mapping"]
+
+            self.items.append(
+                {
+                    "id": obj["id"],
+                    "text": text,
+                    "input_ids": input_ids,
+                    "attention_mask": attention_mask,
+                    "labels": label_ids,
+                    "offset_mapping": offsets,
+                }
+            )
 
     def __len__(self) -> int:
         return len(self.items)
@@ -74,6 +97,191 @@ class PIIDataset(Dataset):
         return self.items[idx]
 
 
+def write_sample_weights(path: str, weights: Iterable[Tuple[str, float]]):
+    """One {"id", "weight"} line per training utterance; read back by `train.py --sample_weights`."""
+    with open(path, "w", encoding="utf-8") as f:
+        for uid, w in weights:
+            f.write(json.dumps({"id": uid, "weight": w}) + "\n")
+
+
+def load_sample_weights(path: str) -> Dict[str, float]:
+    with open(path, "r", encoding="utf-8") as f:
+        return {obj["id"]: float(obj["weight"]) for obj in (json.loads(line) for line in f if line.strip())}
+
+
+class ResumableSampler(Sampler):
+    """Wraps a sampler so every epoch's order is fixed by (seed, epoch) and can start mid-epoch.
+
+    `generator` is the torch.Generator the wrapped sampler draws from (RandomSampler,
+    WeightedRandomSampler); it is reseeded per epoch. DistributedSampler seeds itself from
+    set_epoch. `start` skips that many indices, so a resumed run sees the rest of the epoch.
+    """
+
+    def __init__(self, base: Sampler, generator=None, seed: int = 0):
+        self.base = base
+        self.generator = generator
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch: int, start: int = 0):
+        self.epoch, self.start = epoch, start
+        if hasattr(self.base, "set_epoch"):
+            self.base.set_epoch(epoch)
+        if self.generator is not None:
+            self.generator.manual_seed(self.seed * 100003 + epoch)
+
+    def __iter__(self):
+        return itertools.islice(iter(self.base), self.start, None)
+
+    def __len__(self) -> int:
+        return max(0, len(self.base) - self.start)
+
+
+SHARD_META = "meta.json"
+
+
+def shard_paths(shard_dir: str, name: str) -> Dict[str, str]:
+    prefix = os.path.join(shard_dir, name)
+    return {k: f"{prefix}.{k}.npy" for k in ("input_ids", "labels", "row_splits")}
+
+
+def vocab_hash(tokenizer) -> str:
+    """Hash of a tokenizer's token -> id map; shards and model must agree on it, not just on the pad id."""
+    import hashlib
+
+    items = sorted(tokenizer.get_vocab().items())
+    return hashlib.sha256(json.dumps(items, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ShardedTokenDataset(IterableDataset):
+    """Streams pre-tokenized shards written by `improved_data_generation.py --tokenizer`.
+
+    Shards are memory-mapped and read in a per-epoch shuffled order, then rows pass
+    through a bounded shuffle buffer, so RAM use does not grow with the corpus.
+    Under distributed training each rank reads a disjoint slice of the shards.
+    `set_epoch(epoch, skip_batches, batch_size)` replays an epoch's order up to a resume point.
+    """
+
+    def __init__(self, shard_dir: str, shuffle_buffer: int = 10000, seed: int = 0, rank: int = 0,
+                 world_size: int = 1):
+        with open(os.path.join(shard_dir, SHARD_META), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.shard_dir = shard_dir
+        self.shards = self.meta["shards"]
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+        self.skip_batches = 0
+        self.batch_size = 1
+        self.rank = rank
+        self.world_size = world_size
+        self._row_counts = {}
+
+    def set_epoch(self, epoch: int, skip_batches: int = 0, batch_size: int = 1):
+        self.epoch = epoch
+        self.skip_batches = skip_batches
+        self.batch_size = batch_size
+
+    def __len__(self) -> int:
+        return self.meta["num_rows"]
+
+    def _epoch_shards(self, epoch: Optional[int] = None):
+        rng = random.Random(self.seed * 100003 + (self.epoch if epoch is None else epoch))
+        shards = list(self.shards)
+        rng.shuffle(shards)
+        return shards[self.rank::self.world_size], rng
+
+    def _count_rows(self, shards) -> int:
+        import numpy as np
+
+        for name in shards:
+            if name not in self._row_counts:
+                path = shard_paths(self.shard_dir, name)["row_splits"]
+                self._row_counts[name] = len(np.load(path, mmap_mode="r")) - 1
+        return sum(self._row_counts[name] for name in shards)
+
+    def _worker_batches(self, shards, batch_size: int, num_workers: int) -> List[int]:
+        n = max(1, num_workers)
+        return [math.ceil(self._count_rows(shards[w::n]) / batch_size) for w in range(n)]
+
+    def local_batches(self, epoch: int, batch_size: int, num_workers: int = 0) -> int:
+        """Batches this rank yields in `epoch`.
+
+        Every DataLoader worker batches its own shards, so each one ends the epoch with its
+        own partial batch; the count differs between epochs as the shards are reshuffled.
+        """
+        shards, _ = self._epoch_shards(epoch)
+        return sum(self._worker_batches(shards, batch_size, num_workers))
+
+    def _rows(self, shards):
+        import numpy as np
+
+        for name in shards:
+            paths = shard_paths(self.shard_dir, name)
+            input_ids = np.load(paths["input_ids"], mmap_mode="r")
+            labels = np.load(paths["labels"], mmap_mode="r")
+            splits = np.load(paths["row_splits"])
+            for r in range(len(splits) - 1):
+                a, b = splits[r], splits[r + 1]
+                yield {
+                    "id": f"{name}:{r}",
+                    "text": "",
+                    "input_ids": input_ids[a:b].tolist(),
+                    "attention_mask": [1] * int(b - a),
+                    "labels": labels[a:b].tolist(),
+                    "offset_mapping": [],
+                }
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker = None if info is None else info.id
+        skip = self.skip_batches
+        if info is not None and skip:
+            shards, _ = self._epoch_shards()
+            n = info.num_workers
+            taken, due = _round_robin_share(skip, self._worker_batches(shards, self.batch_size, n))
+            # a fresh DataLoader asks worker 0 first: give it the stream that was due next
+            worker = (due + info.id) % n
+            skip = taken[worker]
+        return itertools.islice(self._iter_rows(worker), skip * self.batch_size, None)
+
+    def _iter_rows(self, worker: Optional[int] = None):
+        shards, rng = self._epoch_shards()
+        if worker is not None:
+            shards = shards[worker::get_worker_info().num_workers]
+            rng = random.Random(self.seed * 100003 + self.epoch * 1009 + worker)
+
+        if self.shuffle_buffer <= 1:
+            yield from self._rows(shards)
+            return
+        buffer = []
+        for item in self._rows(shards):
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(item)
+                continue
+            j = rng.randrange(len(buffer))
+            yield buffer[j]
+            buffer[j] = item
+        rng.shuffle(buffer)
+        yield from buffer
+
+
+def _round_robin_share(total: int, available: List[int]) -> Tuple[List[int], int]:
+    """How many of the first `total` batches each worker produced, and whose turn is next.
+
+    DataLoader takes batches from its workers in turn, skipping workers that ran out.
+    """
+    taken = [0] * len(available)
+    w = 0
+    while total > 0 and any(t < a for t, a in zip(taken, available)):
+        if taken[w] < available[w]:
+            taken[w] += 1
+            total -= 1
+        w = (w + 1) % len(available)
+    return taken, w
+
+
 def collate_batch(batch, pad_token_id: int, label_pad_id: int = -100):
     input_ids_list = [x["input_ids"] for x in batch]
     attention_list = [x["attention_mask"] for x in batch]
@@ -0,0 +1,212 @@
+import os
+import json
+import zlib
+import argparse
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from data_io import RecordWriter, iter_records
+from dataset import write_sample_weights
+
+INDEX_FILE = "minhash_index.npz"
+_PRIME = np.uint64(4294967291)  # largest prime below 2**32: a * x + b stays inside uint64
+
+
+def shingles(text: str, ngram: int = 3) -> List[int]:
+    """crc32 of every lowercased word n-gram (the whole utterance if it is shorter)."""
+    words = text.lower().split()
+    if len(words) <= ngram:
+        return [zlib.crc32(" ".join(words).encode("utf-8"))]
+    return [zlib.crc32(" ".join(words[i:i + ngram]).encode("utf-8")) for i in range(len(words) - ngram + 1)]
+
+
+class MinHashIndex:
+    """MinHash signatures bucketed by LSH bands; one representative per near-duplicate cluster.
+
+    Two utterances are near-duplicates when the estimated Jaccard similarity of their word
+    n-gram sets reaches `threshold`. Only cluster representatives are kept in the band
+    buckets, so memory grows with the number of distinct utterances, not the corpus size.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.8, ngram: int = 3, seed: int = 0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.ngram = ngram
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, int(_PRIME), size=(num_perm, 1), dtype=np.uint64)
+        self.b = rng.integers(0, int(_PRIME), size=(num_perm, 1), dtype=np.uint64)
+        self.keys: List[str] = []
+        self.sigs: List[np.ndarray] = []
+        self.sizes: List[int] = []
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        """(len(texts), num_perm) uint32 signatures, hashed in one vectorized pass."""
+        hashes, starts = [], []
+        for text in texts:
+            starts.append(len(hashes))
+            hashes.extend(shingles(text, self.ngram))
+        x = np.asarray(hashes, dtype=np.uint64)[None, :]
+        perm = (self.a * x + self.b) % _PRIME
+        return np.minimum.reduceat(perm, starts, axis=1).T.astype(np.uint32)
+
+    def _band_keys(self, sig: np.ndarray):
+        for band in range(self.bands):
+            yield band, sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def query(self, sig: np.ndarray) -> Tuple[Optional[int], float]:
+        """Best-matching cluster at or above the threshold, and its estimated similarity."""
+        seen = set()
+        best, best_sim = None, 0.0
+        for band, key in self._band_keys(sig):
+            for c in self.buckets[band].get(key, ()):
+                if c in seen:
+                    continue
+                seen.add(c)
+                sim = float(np.mean(self.sigs[c] == sig))
+                if sim > best_sim:
+                    best, best_sim = c, sim
+        if best_sim < self.threshold:
+            return None, best_sim
+        return best, best_sim
+
+    def add(self, key: str, sig: np.ndarray) -> int:
+        """Starts a new cluster with `key` as its representative."""
+        c = len(self.keys)
+        self.keys.append(key)
+        self.sigs.append(sig)
+        self.sizes.append(1)
+        for band, bkey in self._band_keys(sig):
+            self.buckets[band].setdefault(bkey, []).append(c)
+        return c
+
+    def cluster(self, records: Iterable[dict], batch_size: int = 4096):
+        """Yields (record, cluster, is_duplicate), adding unseen utterances as new clusters."""
+        batch = []
+        for rec in records:
+            batch.append(rec)
+            if len(batch) >= batch_size:
+                yield from self._cluster_batch(batch)
+                batch = []
+        if batch:
+            yield from self._cluster_batch(batch)
+
+    def _cluster_batch(self, batch):
+        for rec, sig in zip(batch, self.signatures([r["text"] for r in batch])):
+            c, _ = self.query(sig)
+            if c is None:
+                yield rec, self.add(rec["id"], sig), False
+            else:
+                self.sizes[c] += 1
+                yield rec, c, True
+
+    def match(self, records: Iterable[dict], batch_size: int = 4096):
+        """Yields (record, cluster or None, similarity) without modifying the index."""
+        batch = []
+        for rec in records:
+            batch.append(rec)
+            if len(batch) >= batch_size:
+                for r, sig in zip(batch, self.signatures([x["text"] for x in batch])):
+                    yield (r,) + self.query(sig)
+                batch = []
+        if batch:
+            for r, sig in zip(batch, self.signatures([x["text"] for x in batch])):
+                yield (r,) + self.query(sig)
+
+    def save(self, path: str):
+        np.savez(path, sigs=np.stack(self.sigs) if self.sigs else np.zeros((0, self.num_perm), np.uint32),
+                 sizes=np.asarray(self.sizes, dtype=np.int64), keys=np.asarray(self.keys),
+                 config=json.dumps({"num_perm": self.num_perm, "bands": self.bands, "threshold": self.threshold,
+                                    "ngram": self.ngram, "seed": self.seed}))
+
+    @classmethod
+    def load(cls, path: str) -> "MinHashIndex":
+        with np.load(path) as z:
+            index = cls(**json.loads(str(z["config"])))
+            for key, sig, size in zip(z["keys"].tolist(), z["sigs"], z["sizes"].tolist()):
+                index.sizes[index.add(key, sig)] = size
+        return index
+
+
+def overlap(index: MinHashIndex, path: str) -> Dict[str, object]:
+    """How many utterances of `path` are near-duplicates of something in the index."""
+    n, hits, examples = 0, 0, []
+    for rec, c, sim in index.match(iter_records(path, columns=["id", "text"])):
+        n += 1
+        if c is not None:
+            hits += 1
+            if len(examples) < 10:
+                examples.append({"id": rec["id"], "match": index.keys[c], "similarity": sim})
+    return {"n": n, "near_duplicates": hits, "fraction": hits / max(1, n), "examples": examples}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="MinHash/LSH near-duplicate removal and split-overlap report")
+    ap.add_argument("--train", default="data/train.jsonl")
+    ap.add_argument("--check", nargs="*", default=["data/dev.jsonl", "data/test.jsonl"],
+                    help="splits to test for overlap with --train (and with each other)")
+    ap.add_argument("--mode", choices=["drop", "weight", "report"], default="report",
+                    help="drop: keep one utterance per cluster; weight: keep all, weight 1/cluster size")
+    ap.add_argument("--out", default=None, help="deduplicated training file (--mode drop)")
+    ap.add_argument("--weights_out", default=None, help="per-id sampling weights for train.py (--mode weight)")
+    ap.add_argument("--index_out", default=None, help=f"save the train index (e.g. out/{INDEX_FILE})")
+    ap.add_argument("--threshold", type=float, default=0.8, help="estimated Jaccard similarity of word 3-grams")
+    ap.add_argument("--num_perm", type=int, default=64)
+    ap.add_argument("--bands", type=int, default=16)
+    ap.add_argument("--ngram", type=int, default=3)
+    ap.add_argument("--report", default=None, help="write the overlap report as JSON")
+    args = ap.parse_args()
+
+    def new_index():
+        return MinHashIndex(args.num_perm, args.bands, args.threshold, args.ngram)
+
+    index = new_index()
+    writer = RecordWriter(args.out) if args.mode == "drop" and args.out else None
+    clusters, n = [], 0
+    for rec, c, dup in index.cluster(iter_records(args.train)):
+        n += 1
+        clusters.append((rec["id"], c))
+        if writer is not None and not dup:
+            writer.write(rec)
+    if writer is not None:
+        writer.close()
+        print(f"Wrote {writer.count} utterances to {args.out}")
+    print(f"{args.train}: {n} utterances, {len(index)} clusters ({1 - len(index) / max(1, n):.1%} near-duplicates)")
+    if args.mode == "weight":
+        if not args.weights_out:
+            raise ValueError("--mode weight needs --weights_out")
+        write_sample_weights(args.weights_out, ((uid, 1.0 / index.sizes[c]) for uid, c in clusters))
+        print(f"Wrote weights to {args.weights_out} (an epoch draws ~{len(index)} examples)")
+    if args.index_out:
+        index.save(args.index_out)
+
+    report = {"train": {"path": args.train, "n": n, "clusters": len(index), "threshold": args.threshold},
+              "overlap": {}}
+    split_indexes = {args.train: index}
+    for path in args.check:
+        if not os.path.exists(path):
+            continue
+        for other, other_index in split_indexes.items():
+            r = overlap(other_index, path)
+            report["overlap"][f"{os.path.basename(other)} <- {os.path.basename(path)}"] = r
+            print(f"{path} vs {other}: {r['near_duplicates']}/{r['n']} near-duplicates ({r['fraction']:.1%})")
+        split_indexes[path] = new_index()
+        for _ in split_indexes[path].cluster(iter_records(path, columns=["id", "text"])):
+            pass
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import argparse
+import threading
+from types import SimpleNamespace
+from typing import List, Optional, Sequence
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from data_io import iter_records
+
+HEADS_FILE = "early_exit_heads.pt"
+CONFIG_FILE = "early_exit.json"
+
+
+def encoder_layers(base) -> nn.ModuleList:
+    for path in ("encoder.layer", "transformer.layer"):
+        mod = base
+        try:
+            for attr in path.split("."):
+                mod = getattr(mod, attr)
+        except AttributeError:
+            continue
+        return mod
+    raise ValueError(f"don't know where the transformer layers of {type(base).__name__} live")
+
+
+class EarlyExitTokenClassifier(nn.Module):
+    """A token classifier with extra linear heads on intermediate layers.
+
+    Training returns the final-layer loss plus a weighted loss for every exit head (hard
+    labels mixed with self-distillation from the final head). At inference, with
+    `threshold < 1`, each utterance leaves the encoder at the first exit layer whose per-token
+    max probability is at least `threshold` for every one of its real tokens; the remaining
+    rows go on alone, so an utterance's labels don't depend on what it is batched with.
+    `exit_layer` is the per-row exit layer and the stats count utterances. The early path
+    runs the encoder layer by layer inside the call, so concurrent calls don't interact.
+    """
+
+    def __init__(self, model, exit_layers: Optional[Sequence[int]] = None, threshold: float = 1.0,
+                 distill_alpha: float = 0.5, temperature: float = 2.0):
+        super().__init__()
+        self.model = model
+        self.config = model.config
+        self.layers = encoder_layers(model.base_model)
+        n_layers = len(self.layers)
+        self.exit_layers = sorted(exit_layers) if exit_layers else list(range(1, n_layers))
+        if any(not 1 <= l < n_layers for l in self.exit_layers):
+            raise ValueError(f"exit layers must be in [1, {n_layers - 1}]")
+        hidden, num_labels = model.classifier.in_features, model.classifier.out_features
+        self.heads = nn.ModuleDict({str(l): nn.Linear(hidden, num_labels) for l in self.exit_layers})
+        self.threshold = threshold
+        self.distill_alpha = distill_alpha
+        self.temperature = temperature
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.rows = 0
+            self.layers_executed = 0
+
+    def _record(self, exit_layer: torch.Tensor):
+        with self._stats_lock:
+            self.rows += exit_layer.numel()
+            self.layers_executed += int(exit_layer.sum())
+
+    @property
+    def num_layers(self) -> int:
+        return len(self.layers)
+
+    def avg_layers(self) -> float:
+        """Encoder layers run per utterance since the last `reset_stats`."""
+        return self.layers_executed / max(1, self.rows)
+
+    def forward(self, input_ids, attention_mask=None, labels=None):
+        if self.training or labels is not None:
+            return self._forward_all(input_ids, attention_mask, labels)
+        if self.threshold >= 1.0:
+            logits = self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+            exit_layer = torch.full((input_ids.shape[0],), self.num_layers, dtype=torch.long)
+            self._record(exit_layer)
+            return SimpleNamespace(logits=logits, exit_layer=exit_layer)
+        return self._forward_early(input_ids, attention_mask)
+
+    def _forward_all(self, input_ids, attention_mask, labels):
+        out = self.model.base_model(input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=True)
+        hidden_states = out.hidden_states
+        final = self.model.classifier(self.model.dropout(hidden_states[-1]))
+        exits = [self.heads[str(l)](self.model.dropout(hidden_states[l])) for l in self.exit_layers]
+        if labels is None:
+            return SimpleNamespace(logits=final, exit_logits=exits)
+
+        n_labels = final.shape[-1]
+        loss = F.cross_entropy(final.view(-1, n_labels), labels.view(-1), ignore_index=-100)
+        valid = labels.view(-1) != -100
+        teacher = F.softmax(final.detach().view(-1, n_labels)[valid] / self.temperature, dim=-1)
+        for l, logits in zip(self.exit_layers, exits):
+            flat = logits.view(-1, n_labels)
+            hard = F.cross_entropy(flat, labels.view(-1), ignore_index=-100)
+            soft = F.kl_div(F.log_softmax(flat[valid] / self.temperature, dim=-1), teacher,
+                            reduction="batchmean") * self.temperature ** 2
+            loss = loss + (l / self.num_layers) * ((1 - self.distill_alpha) * hard + self.distill_alpha * soft)
+        return SimpleNamespace(loss=loss, logits=final, exit_logits=exits)
+
+    def _forward_early(self, input_ids, attention_mask):
+        from transformers.masking_utils import create_bidirectional_mask
+
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        mask = attention_mask.bool()
+        base = self.model.base_model
+        hidden = base.embeddings(input_ids)
+        layer_mask = create_bidirectional_mask(config=self.config, inputs_embeds=hidden, attention_mask=attention_mask)
+        exits = set(self.exit_layers)
+        logits = None
+        exit_layer = torch.full((input_ids.shape[0],), self.num_layers, dtype=torch.long)
+        rows = torch.arange(input_ids.shape[0], device=input_ids.device)  # rows still in the encoder
+        for i, block in enumerate(self.layers, start=1):
+            hidden = block(hidden, layer_mask)
+            if isinstance(hidden, (tuple, list)):
+                hidden = hidden[0]
+            if i not in exits:
+                continue
+            head_logits = self.heads[str(i)](hidden)
+            if logits is None:
+                logits = head_logits.new_empty((input_ids.shape[0],) + head_logits.shape[1:])
+            conf = F.softmax(head_logits, dim=-1).amax(dim=-1)
+            done = ((conf >= self.threshold) | ~mask).all(dim=-1)
+            if not bool(done.any()):
+                continue
+            logits[rows[done]] = head_logits[done]
+            exit_layer[rows[done].cpu()] = i
+            keep = ~done
+            rows, hidden, mask = rows[keep], hidden[keep], mask[keep]
+            if layer_mask is not None:
+                layer_mask = layer_mask[keep]
+            if rows.numel() == 0:
+                break
+        if rows.numel():
+            final = self.model.classifier(self.model.dropout(hidden))
+            if logits is None:
+                logits = final
+            else:
+                logits[rows] = final
+        self._record(exit_layer)
+        return SimpleNamespace(logits=logits, exit_layer=exit_layer)
+
+    def save_pretrained(self, out_dir: str):
+        self.model.save_pretrained(out_dir)
+        torch.save(self.heads.state_dict(), os.path.join(out_dir, HEADS_FILE))
+        with open(os.path.join(out_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+            json.dump({"exit_layers": self.exit_layers, "num_layers": self.num_layers}, f, indent=2)
+
+
+def has_early_exit(model_dir: str) -> bool:
+    return os.path.exists(os.path.join(model_dir, CONFIG_FILE))
+
+
+def load_early_exit(model_dir: str, model, threshold: float = 1.0) -> EarlyExitTokenClassifier:
+    """Attaches the exit heads saved in `model_dir` to an already loaded token classifier."""
+    with open(os.path.join(model_dir, CONFIG_FILE), "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    ee = EarlyExitTokenClassifier(model, cfg["exit_layers"], threshold=threshold)
+    state = torch.load(os.path.join(model_dir, HEADS_FILE), map_location="cpu")
+    ee.heads.load_state_dict(state)
+    ee.to(next(model.parameters()).device)
+    return ee.eval()
+
+
+def main():
+    from eval_span_f1 import SpanCounter, summarize
+    from recognizer import PIIRecognizer
+
+    ap = argparse.ArgumentParser(description="Sweep the early-exit threshold: accuracy vs layers vs latency")
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--thresholds", default="0.8,0.9,0.95,0.99,1.0")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--device", default=None)
+    args = ap.parse_args()
+
+    records = [(obj["text"], [(e["start"], e["end"], e["label"]) for e in obj.get("entities") or []])
+               for obj in iter_records(args.input)]
+
+    recognizer = PIIRecognizer(args.model_dir, device=args.device, max_length=args.max_length,
+                               max_batch_size=1, early_exit_threshold=1.0)
+    print(f"{'threshold':>9s} {'avg_layers':>10s} {'p50_ms':>8s} {'p95_ms':>8s} {'PII_F1':>7s} {'macro_F1':>8s}")
+    for thr in (float(x) for x in args.thresholds.split(",")):
+        recognizer.model.threshold = thr
+        recognizer.model.reset_stats()
+        counter = SpanCounter()
+        times: List[float] = []
+        for text, gold in records:
+            start = time.perf_counter()
+            ents = recognizer.predict(text)
+            times.append((time.perf_counter() - start) * 1000.0)
+            counter.add(gold, [(e["start"], e["end"], e["label"]) for e in ents])
+        report = summarize(counter.finish())
+        times.sort()
+        print(f"{thr:9.3f} {recognizer.model.avg_layers():10.2f} {times[len(times) // 2]:8.2f} "
+              f"{times[max(0, int(0.95 * len(times)) - 1)]:8.2f} {report['pii']['f1']:7.3f} {report['macro_f1']:8.3f}")
+    recognizer.close()
+
+
+if __name__ == "__main__":
+    main()
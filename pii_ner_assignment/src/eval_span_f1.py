@@ -1,32 +1,89 @@
+import os
 import json
 import argparse
+import multiprocessing as mp
 from collections import defaultdict
-from labels import label_is_pii
+from data_io import is_columnar, iter_spans, row_ranges
+from labels import LABELS, label_is_pii
+
+# Fixed count columns so per-utterance rows can be stacked for the bootstrap.
+ENTITY_TYPES = sorted({lab.split("-", 1)[1] for lab in LABELS if lab != "O"})
+CATEGORIES = ENTITY_TYPES + ["PII", "NON_PII"]
+CAT_INDEX = {c: i for i, c in enumerate(CATEGORIES)}
+BOOTSTRAP_CHUNK = 4096
+
+_PRED_DICT = None
+
+
+def _spans(ents):
+    return [(e["start"], e["end"], e["label"]) for e in ents]
 
 
 def load_gold(path):
     gold = {}
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            obj = json.loads(line)
-            uid = obj["id"]
-            spans = []
-            for e in obj.get("entities", []):
-                spans.append((e["start"], e["end"], e["label"]))
-            gold[uid] = spans
+    for uid, spans in iter_gold(path):
+        gold[uid] = spans
     return gold
 
 
 def load_pred(path):
-    with open(path, "r", encoding="utf-8") as f:
-        obj = json.load(f)
-    pred = {}
-    for uid, ents in obj.items():
-        spans = []
-        for e in ents:
-            spans.append((e["start"], e["end"], e["label"]))
-        pred[uid] = spans
-    return pred
+    return dict(iter_pred(path))
+
+
+def iter_gold(path, start=0, end=None):
+    if is_columnar(path):
+        yield from iter_spans(path, start, end)
+        return
+    for line in _iter_lines(path, start, end):
+        obj = json.loads(line)
+        yield obj["id"], _spans(obj.get("entities", []))
+
+
+def iter_pred(path, start=0, end=None):
+    """Yields (id, spans) from a JSONL/Parquet/Arrow prediction file, or predict.py's single JSON object."""
+    if is_columnar(path):
+        yield from iter_spans(path, start, end)
+        return
+    if not path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            obj = json.load(f)
+        for uid, ents in obj.items():
+            yield uid, _spans(ents)
+        return
+    for line in _iter_lines(path, start, end):
+        obj = json.loads(line)
+        yield obj["id"], _spans(obj.get("entities", []))
+
+
+def _iter_lines(path, start=0, end=None):
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        for line in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            if line.strip():
+                yield line
+
+
+def line_ranges(path, n):
+    """Splits a file into n byte ranges that start on line boundaries."""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, n):
+            f.seek(max(bounds[-1], size * i // n))
+            if f.tell() > 0:
+                f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(n)]
+
+
+def _ranges(path, n):
+    """Byte ranges of a JSONL file, or row ranges of a columnar one."""
+    return row_ranges(path, n) if is_columnar(path) else line_ranges(path, n)
 
 
 def compute_prf(tp, fp, fn):
@@ -36,84 +93,228 @@ def compute_prf(tp, fp, fn):
     return prec, rec, f1
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--gold", required=True)
-    ap.add_argument("--pred", required=True)
-    args = ap.parse_args()
+def count_utterance(g_spans, p_spans):
+    """Per-label, PII and non-PII (tp, fp, fn) for one utterance, from a single set build."""
+    counts = defaultdict(lambda: [0, 0, 0])
+    g = set(g_spans)
+    p = set(p_spans)
+    for span in p:
+        counts[span[2]][0 if span in g else 1] += 1
+    for span in g - p:
+        counts[span[2]][2] += 1
+
+    g_kind = {(s, e, label_is_pii(lab)) for s, e, lab in g}
+    p_kind = {(s, e, label_is_pii(lab)) for s, e, lab in p}
+    for span in p_kind:
+        counts["PII" if span[2] else "NON_PII"][0 if span in g_kind else 1] += 1
+    for span in g_kind - p_kind:
+        counts["PII" if span[2] else "NON_PII"][2] += 1
+    return counts
+
+
+class SpanCounter:
+    def __init__(self, bootstrap=0, seed=0):
+        self.tp = defaultdict(int)
+        self.fp = defaultdict(int)
+        self.fn = defaultdict(int)
+        self.gold_labels = set()
+        self.n = 0
+        self.bootstrap = bootstrap
+        self.rows = []
+        self.boot_totals = None
+        self.rng = None
+        if bootstrap:
+            import numpy as np
+            self.rng = np.random.default_rng(seed)
+            self.boot_totals = np.zeros((bootstrap, len(CATEGORIES), 3), dtype=np.float64)
+
+    def add(self, g_spans, p_spans):
+        self.n += 1
+        for _, _, lab in g_spans:
+            self.gold_labels.add(lab)
+        counts = count_utterance(g_spans, p_spans)
+        row = [0] * (3 * len(CATEGORIES)) if self.bootstrap else None
+        for cat, (tp, fp, fn) in counts.items():
+            self.tp[cat] += tp
+            self.fp[cat] += fp
+            self.fn[cat] += fn
+            if row is not None and cat in CAT_INDEX:
+                j = 3 * CAT_INDEX[cat]
+                row[j:j + 3] = (tp, fp, fn)
+        if row is not None:
+            self.rows.append(row)
+            if len(self.rows) >= BOOTSTRAP_CHUNK:
+                self._flush_bootstrap()
 
-    gold = load_gold(args.gold)
-    pred = load_pred(args.pred)
+    def _flush_bootstrap(self):
+        # Poisson(1) weights per utterance and replicate: a streaming bootstrap that
+        # never needs the full per-utterance matrix in memory.
+        import numpy as np
+        if not self.rows:
+            return
+        rows = np.asarray(self.rows, dtype=np.float64)
+        weights = self.rng.poisson(1.0, size=(self.bootstrap, rows.shape[0]))
+        self.boot_totals += (weights @ rows).reshape(self.bootstrap, len(CATEGORIES), 3)
+        self.rows = []
 
-    labels = set()
-    for spans in gold.values():
-        for _, _, lab in spans:
-            labels.add(lab)
+    def merge(self, other: "SpanCounter"):
+        for d, od in ((self.tp, other.tp), (self.fp, other.fp), (self.fn, other.fn)):
+            for k, v in od.items():
+                d[k] += v
+        self.gold_labels |= other.gold_labels
+        self.n += other.n
+        if self.bootstrap:
+            self.boot_totals += other.boot_totals
 
-    tp = defaultdict(int)
-    fp = defaultdict(int)
-    fn = defaultdict(int)
+    def finish(self):
+        if self.bootstrap:
+            self._flush_bootstrap()
+        return self
 
-    for uid in gold.keys():
-        g_spans = set(gold.get(uid, []))
-        p_spans = set(pred.get(uid, []))
 
-        for span in p_spans:
-            if span in g_spans:
-                tp[span[2]] += 1
+def _count_shard(job):
+    gold_path, g_range, pred_path, p_range, bootstrap, seed = job
+    counter = SpanCounter(bootstrap=bootstrap, seed=seed)
+    gold_left, pred_left = {}, {}
+
+    gold_it = iter_gold(gold_path, *g_range)
+    if _PRED_DICT is not None:
+        for uid, g_spans in gold_it:
+            counter.add(g_spans, _PRED_DICT.get(uid, []))
+        return counter.finish(), gold_left, pred_left
+
+    # Both files are normally in the same order, so this join holds almost nothing.
+    pred_it = iter_pred(pred_path, *p_range)
+    for uid, g_spans in gold_it:
+        if uid in pred_left:
+            counter.add(g_spans, pred_left.pop(uid))
+            continue
+        gold_left[uid] = g_spans
+        for puid, p_spans in pred_it:
+            if puid in gold_left:
+                counter.add(gold_left.pop(puid), p_spans)
+                if puid == uid:
+                    break
             else:
-                fp[span[2]] += 1
-        for span in g_spans:
-            if span not in p_spans:
-                fn[span[2]] += 1
+                pred_left[puid] = p_spans
+    for puid, p_spans in pred_it:
+        if puid in gold_left:
+            counter.add(gold_left.pop(puid), p_spans)
+        else:
+            pred_left[puid] = p_spans
+    return counter.finish(), gold_left, pred_left
 
-    print("Per-entity metrics:")
-    macro_f1_sum = 0.0
-    macro_count = 0
 
-    for lab in sorted(labels):
-        p, r, f1 = compute_prf(tp[lab], fp[lab], fn[lab])
-        print(f"{lab:15s} P={p:.3f} R={r:.3f} F1={f1:.3f}")
-        macro_f1_sum += f1
-        macro_count += 1
+def evaluate(gold_path, pred_path, workers=1, bootstrap=0, seed=0):
+    global _PRED_DICT
+    workers = max(1, workers)
+    if not pred_path.endswith(".jsonl") and not is_columnar(pred_path):
+        _PRED_DICT = load_pred(pred_path)
+        p_ranges = [(0, None)] * workers
+    else:
+        p_ranges = _ranges(pred_path, workers)
+    g_ranges = _ranges(gold_path, workers)
+    jobs = [(gold_path, g_ranges[i], pred_path, p_ranges[i], bootstrap, seed * 1000003 + i) for i in range(workers)]
 
-    macro_f1 = macro_f1_sum / max(1, macro_count)
-    print(f"\nMacro-F1: {macro_f1:.3f}")
+    if workers == 1:
+        parts = [_count_shard(jobs[0])]
+    else:
+        ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else mp.get_context()
+        with ctx.Pool(workers) as pool:
+            parts = pool.map(_count_shard, jobs)
 
-    pii_tp = pii_fp = pii_fn = 0
-    non_tp = non_fp = non_fn = 0
+    total = SpanCounter(bootstrap=bootstrap, seed=seed * 1000003 + workers)
+    gold_left, pred_left = {}, {}
+    for counter, g_left, p_left in parts:
+        total.merge(counter)
+        gold_left.update(g_left)
+        pred_left.update(p_left)
+    for uid, g_spans in gold_left.items():
+        total.add(g_spans, pred_left.get(uid, []))
+    _PRED_DICT = None
+    return summarize(total.finish())
 
-    for uid in gold.keys():
-        g_spans = gold.get(uid, [])
-        p_spans = pred.get(uid, [])
 
-        g_pii = set((s, e, "PII") for s, e, lab in g_spans if label_is_pii(lab))
-        g_non = set((s, e, "NON") for s, e, lab in g_spans if not label_is_pii(lab))
-        p_pii = set((s, e, "PII") for s, e, lab in p_spans if label_is_pii(lab))
-        p_non = set((s, e, "NON") for s, e, lab in p_spans if not label_is_pii(lab))
+def _ci(values, alpha):
+    import numpy as np
+    lo, hi = np.quantile(values, [alpha / 2, 1 - alpha / 2])
+    return [float(lo), float(hi)]
 
-        for span in p_pii:
-            if span in g_pii:
-                pii_tp += 1
-            else:
-                pii_fp += 1
-        for span in g_pii:
-            if span not in p_pii:
-                pii_fn += 1
-
-        for span in p_non:
-            if span in g_non:
-                non_tp += 1
-            else:
-                non_fp += 1
-        for span in g_non:
-            if span not in p_non:
-                non_fn += 1
-
-    p, r, f1 = compute_prf(pii_tp, pii_fp, pii_fn)
-    print(f"\nPII-only metrics: P={p:.3f} R={r:.3f} F1={f1:.3f}")
-    p2, r2, f12 = compute_prf(non_tp, non_fp, non_fn)
-    print(f"Non-PII metrics: P={p2:.3f} R={r2:.3f} F1={f12:.3f}")
+
+def _bootstrap_prf(totals):
+    import numpy as np
+    tp, fp, fn = totals[..., 0], totals[..., 1], totals[..., 2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prec = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        rec = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        f1 = np.where(prec + rec > 0, 2 * prec * rec / (prec + rec), 0.0)
+    return prec, rec, f1
+
+
+def summarize(counter: SpanCounter, alpha: float = 0.05):
+    report = {"n_utterances": counter.n, "per_label": {}}
+    labels = sorted(counter.gold_labels)
+    f1s = []
+    for lab in labels:
+        p, r, f1 = compute_prf(counter.tp[lab], counter.fp[lab], counter.fn[lab])
+        report["per_label"][lab] = {"precision": p, "recall": r, "f1": f1,
+                                    "tp": counter.tp[lab], "fp": counter.fp[lab], "fn": counter.fn[lab]}
+        f1s.append(f1)
+    report["macro_f1"] = sum(f1s) / max(1, len(f1s))
+    for key, cat in (("pii", "PII"), ("non_pii", "NON_PII")):
+        p, r, f1 = compute_prf(counter.tp[cat], counter.fp[cat], counter.fn[cat])
+        report[key] = {"precision": p, "recall": r, "f1": f1,
+                       "tp": counter.tp[cat], "fp": counter.fp[cat], "fn": counter.fn[cat]}
+
+    if counter.bootstrap:
+        prec, rec, f1 = _bootstrap_prf(counter.boot_totals)
+        report["bootstrap"] = {"replicates": counter.bootstrap, "alpha": alpha}
+        for lab in labels:
+            if lab in CAT_INDEX:
+                report["per_label"][lab]["f1_ci"] = _ci(f1[:, CAT_INDEX[lab]], alpha)
+        macro_idx = [CAT_INDEX[lab] for lab in labels if lab in CAT_INDEX]
+        if macro_idx:
+            report["macro_f1_ci"] = _ci(f1[:, macro_idx].mean(axis=1), alpha)
+        for key, cat in (("pii", "PII"), ("non_pii", "NON_PII")):
+            j = CAT_INDEX[cat]
+            report[key]["precision_ci"] = _ci(prec[:, j], alpha)
+            report[key]["recall_ci"] = _ci(rec[:, j], alpha)
+            report[key]["f1_ci"] = _ci(f1[:, j], alpha)
+    return report
+
+
+def _fmt_ci(stats, key):
+    ci = stats.get(key)
+    return f" [{ci[0]:.3f}, {ci[1]:.3f}]" if ci else ""
+
+
+def print_report(report):
+    print("Per-entity metrics:")
+    for lab, m in report["per_label"].items():
+        print(f"{lab:15s} P={m['precision']:.3f} R={m['recall']:.3f} F1={m['f1']:.3f}{_fmt_ci(m, 'f1_ci')}")
+    print(f"\nMacro-F1: {report['macro_f1']:.3f}{_fmt_ci(report, 'macro_f1_ci')}")
+    m = report["pii"]
+    print(f"\nPII-only metrics: P={m['precision']:.3f} R={m['recall']:.3f} F1={m['f1']:.3f}{_fmt_ci(m, 'f1_ci')}")
+    m = report["non_pii"]
+    print(f"Non-PII metrics: P={m['precision']:.3f} R={m['recall']:.3f} F1={m['f1']:.3f}{_fmt_ci(m, 'f1_ci')}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--gold", required=True)
+    ap.add_argument("--pred", required=True)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--bootstrap", type=int, default=0, help="number of bootstrap replicates (0 = off)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json_out", default=None)
+    args = ap.parse_args()
+
+    report = evaluate(args.gold, args.pred, workers=args.workers, bootstrap=args.bootstrap, seed=args.seed)
+    print_report(report)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import time
+import zlib
+import random
+import argparse
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from data_io import iter_records
+from labels import LABEL2ID, LABELS, label_is_pii
+from predict import bio_to_spans
+
+MODEL_FILE = "fast_tagger.npz"
+_WORD_RE = re.compile(r"\S+")
+
+
+def tokenize(text: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+    words, offsets = [], []
+    for m in _WORD_RE.finditer(text):
+        words.append(m.group().lower())
+        offsets.append((m.start(), m.end()))
+    return words, offsets
+
+
+def _transition_mask(labels: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Log-space BIO constraints: I-X may only follow B-X or I-X (and never start a sentence)."""
+    n = len(labels)
+    trans = np.zeros((n, n), dtype=np.float32)
+    start = np.zeros(n, dtype=np.float32)
+    for j, cur in enumerate(labels):
+        if not cur.startswith("I-"):
+            continue
+        start[j] = -np.inf
+        for i, prev in enumerate(labels):
+            if prev[2:] != cur[2:]:
+                trans[i, j] = -np.inf
+    return trans, start
+
+
+def _shape(word: str) -> str:
+    s = re.sub(r"[a-z]+", "a", word)
+    return re.sub(r"[0-9]+", "0", s)
+
+
+class FastTagger:
+    """Word-level BIO tagger: a linear softmax over hashed word, character n-gram and context features.
+
+    Labels are decoded with Viterbi under BIO constraints, so a multi-word span keeps one type.
+    Runs in well under a millisecond per utterance on CPU. `predict` also returns a confidence
+    (the lowest per-word max probability) so callers can route uncertain utterances elsewhere.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, labels: List[str] = LABELS):
+        self.weights = weights
+        self.bias = bias
+        self.labels = list(labels)
+        self.mask = weights.shape[0] - 1
+        self._word_features = lru_cache(maxsize=1 << 16)(self._word_features_uncached)
+        self._trans, self._start = _transition_mask(self.labels)
+
+    @classmethod
+    def empty(cls, bits: int = 18) -> "FastTagger":
+        return cls(np.zeros((1 << bits, len(LABELS)), dtype=np.float32), np.zeros(len(LABELS), dtype=np.float32))
+
+    @classmethod
+    def load(cls, model_dir: str) -> "FastTagger":
+        with np.load(os.path.join(model_dir, MODEL_FILE)) as z:
+            labels = json.loads(str(z["labels"]))
+            if labels != LABELS:
+                raise ValueError(f"{model_dir} was trained with a different label list")
+            return cls(z["weights"], z["bias"], labels)
+
+    def save(self, model_dir: str):
+        os.makedirs(model_dir, exist_ok=True)
+        np.savez(os.path.join(model_dir, MODEL_FILE), weights=self.weights, bias=self.bias,
+                 labels=np.array(json.dumps(self.labels)))
+
+    def _hash(self, feature: str) -> int:
+        return zlib.crc32(feature.encode("utf-8")) & self.mask
+
+    def _word_features_uncached(self, word: str) -> Tuple[int, ...]:
+        padded = f"<{word}>"
+        feats = [f"w:{word}", f"s:{_shape(word)}", f"p3:{word[:3]}", f"x3:{word[-3:]}"]
+        feats.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        return tuple(self._hash(f) for f in feats)
+
+    def features(self, words: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Flat feature ids for every word plus the start index of each word's slice."""
+        ids, starts = [], []
+        n = len(words)
+        for i, w in enumerate(words):
+            starts.append(len(ids))
+            ids.extend(self._word_features(w))
+            prev = words[i - 1] if i > 0 else "<s>"
+            nxt = words[i + 1] if i + 1 < n else "</s>"
+            prev2 = words[i - 2] if i > 1 else "<s>"
+            nxt2 = words[i + 2] if i + 2 < n else "</s>"
+            ids.append(self._hash(f"p:{prev}"))
+            ids.append(self._hash(f"n:{nxt}"))
+            ids.append(self._hash(f"pp:{prev2}"))
+            ids.append(self._hash(f"nn:{nxt2}"))
+            ids.append(self._hash(f"pw:{prev}|{w}"))
+            ids.append(self._hash(f"ps:{_shape(prev)}|{_shape(w)}"))
+        return np.asarray(ids, dtype=np.int64), np.asarray(starts, dtype=np.int64)
+
+    def scores(self, words: List[str]) -> np.ndarray:
+        ids, starts = self.features(words)
+        return np.add.reduceat(self.weights[ids], starts, axis=0) + self.bias
+
+    def predict_proba(self, text: str):
+        words, offsets = tokenize(text)
+        if not words:
+            return offsets, np.zeros((0, len(self.labels)), dtype=np.float32)
+        s = self.scores(words)
+        s -= s.max(axis=1, keepdims=True)
+        p = np.exp(s)
+        p /= p.sum(axis=1, keepdims=True)
+        return offsets, p
+
+    def decode(self, probs: np.ndarray) -> List[int]:
+        """Most likely label sequence under the BIO constraints (Viterbi over per-word log-probs)."""
+        logp = np.log(probs + 1e-9)
+        score = logp[0] + self._start
+        back = []
+        for t in range(1, len(logp)):
+            cand = score[:, None] + self._trans
+            back.append(cand.argmax(axis=0))
+            score = cand.max(axis=0) + logp[t]
+        best = [int(score.argmax())]
+        for ptr in reversed(back):
+            best.append(int(ptr[best[-1]]))
+        return best[::-1]
+
+    def predict(self, text: str) -> Tuple[List[Dict[str, Any]], float]:
+        offsets, probs = self.predict_proba(text)
+        if not offsets:
+            return [], 1.0
+        pred_ids = self.decode(probs)
+        confidence = float(probs.max(axis=1).min())
+        ents = [
+            {"start": int(s), "end": int(e), "label": lab, "pii": bool(label_is_pii(lab))}
+            for s, e, lab in bio_to_spans(text, offsets, pred_ids)
+        ]
+        return ents, confidence
+
+
+def _load_examples(path: str):
+    from dataset import align_labels
+
+    examples = []
+    for obj in iter_records(path):
+        words, offsets = tokenize(obj["text"])
+        if words:
+            examples.append((words, align_labels(obj["text"], obj.get("entities") or [], offsets, LABEL2ID)))
+    return examples
+
+
+def train_fast_tagger(path: str, bits: int = 18, epochs: int = 20, lr: float = 3.0, batch_size: int = 32,
+                      seed: int = 0) -> FastTagger:
+    """Mini-batch SGD on the softmax cross-entropy averaged over the words of each batch."""
+    tagger = FastTagger.empty(bits)
+    examples = _load_examples(path)
+    rng = random.Random(seed)
+    encoded = []
+    for words, labels in examples:
+        ids, starts = tagger.features(words)
+        encoded.append((ids, starts, np.asarray(labels, dtype=np.int64)))
+
+    for epoch in range(epochs):
+        rng.shuffle(encoded)
+        step_lr = lr / (1 + epoch)
+        total = 0.0
+        for b in range(0, len(encoded), batch_size):
+            batch = encoded[b:b + batch_size]
+            ids = np.concatenate([e[0] for e in batch])
+            offset, starts = 0, []
+            for e_ids, e_starts, _ in batch:
+                starts.append(e_starts + offset)
+                offset += len(e_ids)
+            starts = np.concatenate(starts)
+            y = np.concatenate([e[2] for e in batch])
+            counts = np.diff(np.append(starts, len(ids)))
+            word_of = np.repeat(np.arange(len(starts)), counts)
+
+            s = np.add.reduceat(tagger.weights[ids], starts, axis=0) + tagger.bias
+            s -= s.max(axis=1, keepdims=True)
+            p = np.exp(s)
+            p /= p.sum(axis=1, keepdims=True)
+            total -= float(np.log(p[np.arange(len(y)), y] + 1e-12).sum())
+
+            grad = p
+            grad[np.arange(len(y)), y] -= 1.0
+            grad /= len(y)
+            np.add.at(tagger.weights, ids, (-step_lr * grad[word_of]).astype(np.float32))
+            tagger.bias -= (step_lr * grad.sum(axis=0)).astype(np.float32)
+        n_words = sum(len(e[2]) for e in encoded)
+        print(f"Epoch {epoch + 1}/{epochs} loss per word: {total / max(1, n_words):.4f}")
+    return tagger
+
+
+def main():
+    from eval_span_f1 import SpanCounter, iter_gold, summarize
+
+    ap = argparse.ArgumentParser(description="Train the hashed n-gram first-tier tagger")
+    ap.add_argument("--train", default="data/train.jsonl")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--out_dir", default="out_fast")
+    ap.add_argument("--bits", type=int, default=18, help="log2 of the number of hashed feature buckets")
+    ap.add_argument("--epochs", type=int, default=20)
+    ap.add_argument("--lr", type=float, default=3.0)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    tagger = train_fast_tagger(args.train, bits=args.bits, epochs=args.epochs, lr=args.lr, seed=args.seed)
+    tagger.save(args.out_dir)
+    print(f"Saved fast tagger to {os.path.join(args.out_dir, MODEL_FILE)}")
+
+    texts = {obj["id"]: obj["text"] for obj in iter_records(args.dev, columns=["id", "text"])}
+    tagger = FastTagger.load(args.out_dir)
+    counter = SpanCounter()
+    times = []
+    for uid, gold in iter_gold(args.dev):
+        start = time.perf_counter()
+        ents, _ = tagger.predict(texts[uid])
+        times.append((time.perf_counter() - start) * 1000.0)
+        counter.add(gold, [(e["start"], e["end"], e["label"]) for e in ents])
+    report = summarize(counter.finish())
+    times.sort()
+    print(f"Dev PII P/R/F1: {report['pii']['precision']:.3f} / {report['pii']['recall']:.3f} / "
+          f"{report['pii']['f1']:.3f}  macro-F1: {report['macro_f1']:.3f}")
+    print(f"Latency per utterance: p50 {times[len(times) // 2]:.3f} ms, "
+          f"p95 {times[max(0, int(0.95 * len(times)) - 1)]:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
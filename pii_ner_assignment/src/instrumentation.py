@@ -0,0 +1,217 @@
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 100, 250, 1000)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+SEQ_LEN_BUCKETS = (8, 16, 24, 32, 48, 64, 96, 128, 192, 256, 512)
+
+STAGES = ("tokenize", "to_device", "forward", "argmax", "decode")
+
+
+def _fmt_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, c in zip(self.buckets, counts):
+                    cumulative += c
+                    lines.append(f"{self.name}_bucket{_fmt_labels(key, ('le', str(bound)))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, ('le', '+Inf'))} {n}")
+                lines.append(f"{self.name}_sum{_fmt_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_fmt_labels(key)} {n}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(key)} {v}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(tuple(sorted(labels.items())), None)
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Metrics:
+    """Thread-safe histograms and counters for the inference path, exported as Prometheus text."""
+
+    def __init__(self, prefix: str = "pii_ner"):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.stage_latency = self.histogram("stage_latency_ms", "Latency of one inference stage", LATENCY_BUCKETS_MS)
+        self.request_latency = self.histogram("request_latency_ms", "End-to-end latency of a predict call",
+                                              LATENCY_BUCKETS_MS)
+        self.batch_size = self.histogram("batch_size", "Utterances per forward pass", BATCH_SIZE_BUCKETS)
+        self.seq_len = self.histogram("sequence_length", "Padded tokens per row in a forward pass", SEQ_LEN_BUCKETS)
+        self.cache = self.counter("cache_lookups_total", "Result cache lookups by outcome")
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float]) -> Histogram:
+        return self._register(name, lambda full: Histogram(full, help, buckets))
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(name, lambda full: Counter(full, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._register(name, lambda full: Gauge(full, help))
+
+    def _register(self, name, factory):
+        full = f"{self.prefix}_{name}"
+        with self._lock:
+            if full not in self._metrics:
+                self._metrics[full] = factory(full)
+            return self._metrics[full]
+
+    @contextmanager
+    def time_stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_latency.observe((time.perf_counter() - start) * 1000.0, stage=stage)
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Atomically writes the text exposition (e.g. for node_exporter's textfile collector)."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True, name="pii-metrics").start()
+        return server
+
+
+def stage(metrics: Optional[Metrics], name: str):
+    return metrics.time_stage(name) if metrics is not None else nullcontext()
+
+
+class TraceSampler:
+    """Runs torch.profiler on a random sample of requests and dumps Chrome traces.
+
+    The profiler is process-wide, so only one request is traced at a time; a request
+    sampled while another trace is running is served untraced and counted in `skipped`.
+    """
+
+    def __init__(self, out_dir: str, sample_rate: float = 0.01, seed: Optional[int] = None):
+        self.out_dir = out_dir
+        self.sample_rate = sample_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tracing = threading.Lock()
+        self._n = 0
+        self.skipped = 0
+        os.makedirs(out_dir, exist_ok=True)
+
+    @contextmanager
+    def maybe_trace(self, name: str = "predict"):
+        with self._lock:
+            sampled = self._rng.random() < self.sample_rate
+        if not sampled:
+            yield
+            return
+        if not self._tracing.acquire(blocking=False):
+            with self._lock:
+                self.skipped += 1
+            yield
+            return
+
+        try:
+            from torch.profiler import ProfilerActivity, profile
+
+            with self._lock:
+                idx = self._n
+                self._n += 1
+            with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+                yield
+            prof.export_chrome_trace(os.path.join(self.out_dir, f"{name}_{os.getpid()}_{idx:06d}.json"))
+        finally:
+            self._tracing.release()
@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+
+def rank_env(rank: int, local_rank: int, world_size: int, local_world_size: int, master_addr: str,
+             master_port: int, threads: Optional[int] = None) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "RANK": str(rank),
+        "LOCAL_RANK": str(local_rank),
+        "WORLD_SIZE": str(world_size),
+        "LOCAL_WORLD_SIZE": str(local_world_size),
+        "MASTER_ADDR": master_addr,
+        "MASTER_PORT": str(master_port),
+    })
+    if threads:
+        env["OMP_NUM_THREADS"] = str(threads)
+    return env
+
+
+def launch(cmd: List[str], nproc: int = 1, nnodes: int = 1, node_rank: int = 0, master_addr: str = "127.0.0.1",
+           master_port: int = 29500, threads: Optional[int] = None) -> int:
+    """Starts this host's `nproc` ranks of a `nnodes * nproc` job and waits for them.
+
+    If any rank fails the others are terminated (they would otherwise block in the next
+    all-reduce). Returns the first non-zero exit code, or 0.
+    """
+    world_size = nnodes * nproc
+    if threads is None and "OMP_NUM_THREADS" not in os.environ:
+        threads = max(1, (os.cpu_count() or 1) // nproc)
+    procs = []
+    for local_rank in range(nproc):
+        env = rank_env(node_rank * nproc + local_rank, local_rank, world_size, nproc, master_addr, master_port,
+                       threads)
+        procs.append(subprocess.Popen([sys.executable] + cmd, env=env))
+
+    code = 0
+    try:
+        while procs:
+            for p in list(procs):
+                ret = p.poll()
+                if ret is None:
+                    continue
+                procs.remove(p)
+                if ret != 0 and code == 0:
+                    code = ret
+                    for other in procs:
+                        other.terminate()
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+        raise
+    return code
+
+
+def _read_stats(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run train.py as a gloo data-parallel job on one or more hosts",
+                                 usage="%(prog)s [options] src/train.py [train args ...]")
+    ap.add_argument("--nproc", type=int, default=2, help="processes on this host")
+    ap.add_argument("--nnodes", type=int, default=1, help="hosts in the job (run this launcher on each)")
+    ap.add_argument("--node_rank", type=int, default=0)
+    ap.add_argument("--master_addr", default="127.0.0.1", help="address of the node_rank 0 host")
+    ap.add_argument("--master_port", type=int, default=29500)
+    ap.add_argument("--threads", type=int, default=None,
+                    help="intra-op threads per process (default: cores / nproc, or $OMP_NUM_THREADS)")
+    ap.add_argument("--scaling", action="store_true",
+                    help="first run the same command as a single process, then report scaling efficiency")
+    ap.add_argument("script")
+    ap.add_argument("script_args", nargs=argparse.REMAINDER)
+    args = ap.parse_args()
+
+    cmd = [args.script] + args.script_args
+    if not args.scaling:
+        sys.exit(launch(cmd, args.nproc, args.nnodes, args.node_rank, args.master_addr, args.master_port,
+                        args.threads))
+
+    world_size = args.nnodes * args.nproc
+    with tempfile.TemporaryDirectory() as tmp:
+        base_stats = os.path.join(tmp, "baseline.json")
+        ddp_stats = os.path.join(tmp, "distributed.json")
+        if args.node_rank == 0:
+            # the baseline gets the whole host; later flags override the user's
+            print("Single-process baseline ...", flush=True)
+            code = launch(cmd + ["--out_dir", os.path.join(tmp, "baseline"), "--stats_out", base_stats], nproc=1,
+                          master_addr=args.master_addr, master_port=args.master_port,
+                          threads=args.threads or os.cpu_count())
+            if code:
+                sys.exit(code)
+        print(f"Distributed run on {world_size} processes ...", flush=True)
+        code = launch(cmd + ["--stats_out", ddp_stats], args.nproc, args.nnodes, args.node_rank, args.master_addr,
+                      args.master_port, args.threads)
+        if code or args.node_rank != 0:
+            sys.exit(code)
+
+        base, ddp = _read_stats(base_stats), _read_stats(ddp_stats)
+    speedup = ddp["examples_per_s"] / base["examples_per_s"]
+    print(f"1 process:  {base['examples_per_s']:8.1f} examples/s ({base['steps']} steps, "
+          f"batch {base['global_batch_size']})")
+    print(f"{world_size} processes: {ddp['examples_per_s']:8.1f} examples/s ({ddp['steps']} steps, "
+          f"global batch {ddp['global_batch_size']})")
+    print(f"Speedup {speedup:.2f}x, scaling efficiency {speedup / world_size:.0%}")
+
+
+if __name__ == "__main__":
+    main()
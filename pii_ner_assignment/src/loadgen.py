@@ -0,0 +1,169 @@
+import json
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional, Sequence
+
+from data_io import iter_records
+
+
+def poisson_arrivals(rate: float, n: int, seed: int = 0) -> List[float]:
+    """Arrival offsets (seconds) of n requests with exponential inter-arrival times."""
+    rng = random.Random(seed)
+    t, out = 0.0, []
+    for _ in range(n):
+        t += rng.expovariate(rate)
+        out.append(t)
+    return out
+
+
+def load_trace(path: str) -> List[float]:
+    """Arrival offsets from a trace: one number per line, or JSONL with a "t" (seconds) field."""
+    times = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            times.append(float(json.loads(line)["t"]) if line.startswith("{") else float(line))
+    t0 = min(times) if times else 0.0
+    return sorted(t - t0 for t in times)
+
+
+def _percentile(sorted_vals, q):
+    return sorted_vals[max(0, int(q * len(sorted_vals)) - 1)] if sorted_vals else 0.0
+
+
+async def run_load(recognizer, texts: Sequence[str], arrivals: Sequence[float], batching: bool = True,
+                   max_inflight: Optional[int] = None) -> Dict[str, Any]:
+    """Fires requests at the given offsets regardless of completions (open loop).
+
+    Latency is measured from the scheduled arrival, so it includes time spent waiting for a
+    worker or in the batcher. `max_inflight` caps outstanding requests; later arrivals queue.
+    """
+    loop = asyncio.get_running_loop()
+    gate = asyncio.Semaphore(max_inflight) if max_inflight else None
+    latencies = []
+    lag = 0.0
+
+    async def one(scheduled: float, text: str):
+        if gate is not None:
+            await gate.acquire()
+        try:
+            if batching:
+                await recognizer.predict_async(text)
+            else:
+                await recognizer.predict_batch_async([text])
+        finally:
+            if gate is not None:
+                gate.release()
+        latencies.append((loop.time() - scheduled) * 1000.0)
+
+    start = loop.time()
+    tasks = []
+    for i, offset in enumerate(arrivals):
+        scheduled = start + offset
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            lag = max(lag, -delay)
+        tasks.append(asyncio.create_task(one(scheduled, texts[i % len(texts)])))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+
+    latencies.sort()
+    offered = len(arrivals) / arrivals[-1] if arrivals and arrivals[-1] > 0 else float("inf")
+    return {
+        "requests": len(arrivals),
+        "offered_rps": offered,
+        "achieved_rps": len(arrivals) / elapsed,
+        "p50_ms": _percentile(latencies, 0.50),
+        "p95_ms": _percentile(latencies, 0.95),
+        "p99_ms": _percentile(latencies, 0.99),
+        "max_ms": latencies[-1] if latencies else 0.0,
+        "mean_ms": sum(latencies) / max(1, len(latencies)),
+        "max_generator_lag_ms": lag * 1000.0,
+    }
+
+
+def saturation_point(rows: List[Dict[str, Any]], slo_ms: float, min_ratio: float = 0.95) -> Optional[Dict[str, Any]]:
+    """Highest offered load that is still served at that rate with p95 within the SLO."""
+    ok = [r for r in rows if r["achieved_rps"] >= min_ratio * r["offered_rps"] and r["p95_ms"] <= slo_ms]
+    return max(ok, key=lambda r: r["offered_rps"]) if ok else None
+
+
+def main():
+    from recognizer import PIIRecognizer
+
+    ap = argparse.ArgumentParser(description="Open-loop load test of the in-process inference path")
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--rates", default="5,10,20,50,100", help="offered requests/s (Poisson arrivals)")
+    ap.add_argument("--trace", default=None, help="replay arrival offsets from a file instead of Poisson")
+    ap.add_argument("--speedups", default="1", help="with --trace: replay at these multiples of the recorded rate")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds of traffic per Poisson rate")
+    ap.add_argument("--concurrency", type=int, default=2, help="inference worker threads")
+    ap.add_argument("--max_inflight", type=int, default=None, help="cap on outstanding requests (default: none)")
+    ap.add_argument("--batch_size", type=int, default=None, help="max requests coalesced into one forward pass")
+    ap.add_argument("--batch_wait_ms", type=float, default=2.0)
+    ap.add_argument("--no_batching", action="store_true", help="one forward pass per request")
+    ap.add_argument("--slo_ms", type=float, default=50.0, help="p95 budget used to find the saturation point")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--no_tuning_profile", action="store_true", help="ignore the model's autotune.json")
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json_out", default=None)
+    ap.add_argument("--csv_out", default=None, help="latency-vs-throughput curve as CSV")
+    args = ap.parse_args()
+
+    texts = [obj["text"] for obj in iter_records(args.input, columns=["text"])]
+    random.Random(args.seed).shuffle(texts)
+
+    recognizer = PIIRecognizer(args.model_dir, device=args.device, max_length=args.max_length,
+                               max_batch_size=args.batch_size, max_workers=args.concurrency,
+                               batch_wait_ms=args.batch_wait_ms, use_tuning_profile=not args.no_tuning_profile)
+    recognizer.predict_batch(texts[:8])  # warm up
+
+    if args.trace:
+        base = load_trace(args.trace)
+        loads = [(f"x{s}", [t / float(s) for t in base]) for s in args.speedups.split(",") if s]
+    else:
+        loads = []
+        for i, rate in enumerate(float(r) for r in args.rates.split(",") if r):
+            n = max(1, int(rate * args.duration))
+            loads.append((f"{rate:g}/s", poisson_arrivals(rate, n, seed=args.seed + i)))
+
+    rows = []
+    print(f"{'load':>10s} {'offered':>8s} {'achieved':>8s} {'p50_ms':>8s} {'p95_ms':>8s} {'p99_ms':>8s} "
+          f"{'mean_ms':>8s}")
+    for name, arrivals in loads:
+        r = asyncio.run(run_load(recognizer, texts, arrivals, batching=not args.no_batching,
+                                 max_inflight=args.max_inflight))
+        r["load"] = name
+        rows.append(r)
+        print(f"{name:>10s} {r['offered_rps']:8.1f} {r['achieved_rps']:8.1f} {r['p50_ms']:8.2f} "
+              f"{r['p95_ms']:8.2f} {r['p99_ms']:8.2f} {r['mean_ms']:8.2f}", flush=True)
+    recognizer.close()
+
+    sat = saturation_point(rows, args.slo_ms)
+    if sat is None:
+        print(f"Saturated at every tested load (p95 <= {args.slo_ms:g} ms never met)")
+    else:
+        print(f"Saturation point: ~{sat['offered_rps']:.1f} req/s with p95 {sat['p95_ms']:.2f} ms "
+              f"(SLO {args.slo_ms:g} ms, concurrency {args.concurrency})")
+
+    if args.csv_out:
+        cols = ["load", "offered_rps", "achieved_rps", "p50_ms", "p95_ms", "p99_ms", "max_ms", "mean_ms"]
+        with open(args.csv_out, "w", encoding="utf-8") as f:
+            f.write(",".join(cols) + "\n")
+            for r in rows:
+                f.write(",".join(str(r[c]) for c in cols) + "\n")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"concurrency": args.concurrency, "batching": not args.no_batching, "slo_ms": args.slo_ms,
+                       "saturation": sat, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
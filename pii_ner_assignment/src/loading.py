@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import shutil
+import argparse
+from types import SimpleNamespace
+
+_IMPORT_TIME = time.perf_counter()
+
+SNAPSHOT_MODEL = "model.ts"
+SNAPSHOT_TOKENIZER = "tokenizer.json"
+SNAPSHOT_META = "snapshot.json"
+
+
+# everything that changes what a checkpoint predicts
+FINGERPRINT_FILES = ("model.safetensors", "pytorch_model.bin", SNAPSHOT_MODEL, "early_exit_heads.pt", "config.json",
+                     "preprocessing.json", "tokenizer.json", "vocab.txt", "tokenizer_config.json",
+                     "special_tokens_map.json")
+
+
+# files next to the weights that PIIRecognizer reads; a snapshot must carry all of them
+SIDECAR_FILES = ("config.json", "tokenizer_config.json", "special_tokens_map.json", "vocab.txt",
+                 "preprocessing.json", "thresholds.json", "early_exit.json", "early_exit_heads.pt")
+
+
+def file_digest(paths, h=None) -> str:
+    """sha256 over the names and contents of the given files that exist."""
+    import hashlib
+
+    h = h or hashlib.sha256()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        h.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+
+def model_fingerprint(model_dir: str) -> str:
+    return file_digest(os.path.join(model_dir, name) for name in FINGERPRINT_FILES)
+
+
+def time_since_start_ms() -> float:
+    """Milliseconds since the interpreter started (falls back to since this module was imported)."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        start_ticks = int(fields[19])
+        return (uptime - start_ticks / os.sysconf("SC_CLK_TCK")) * 1000.0
+    except (OSError, ValueError, IndexError):
+        return (time.perf_counter() - _IMPORT_TIME) * 1000.0
+
+
+def resolve_device(device=None) -> str:
+    if device is not None:
+        return device
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def is_snapshot(path: str) -> bool:
+    return os.path.exists(os.path.join(path, SNAPSHOT_META))
+
+
+class SnapshotTokenizer:
+    """Minimal stand-in for a HF fast tokenizer, backed directly by `tokenizers`."""
+
+    def __init__(self, path: str):
+        from tokenizers import Tokenizer
+
+        self._tok = Tokenizer.from_file(path)
+        self._tok.no_truncation()
+        self._tok.no_padding()
+        self.pad_token_id = self._tok.token_to_id("[PAD]") or 0
+
+    def __call__(self, text, return_offsets_mapping=False, truncation=True, max_length=None,
+                 return_tensors=None, add_special_tokens=True, padding=False):
+        single = isinstance(text, str)
+        texts = [text] if single else list(text)
+        encs = self._tok.encode_batch(texts, add_special_tokens=add_special_tokens)
+
+        input_ids, attention_mask, offsets = [], [], []
+        for enc in encs:
+            ids, offs = enc.ids, enc.offsets
+            if truncation and max_length is not None and len(ids) > max_length:
+                if add_special_tokens:
+                    ids = ids[: max_length - 1] + ids[-1:]
+                    offs = offs[: max_length - 1] + offs[-1:]
+                else:
+                    ids, offs = ids[:max_length], offs[:max_length]
+            input_ids.append(list(ids))
+            attention_mask.append([1] * len(ids))
+            offsets.append([tuple(o) for o in offs])
+
+        if padding or (return_tensors is not None and not single):
+            width = max(len(ids) for ids in input_ids)
+            for ids, am, offs in zip(input_ids, attention_mask, offsets):
+                n = width - len(ids)
+                ids.extend([self.pad_token_id] * n)
+                am.extend([0] * n)
+                offs.extend([(0, 0)] * n)
+
+        out = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if return_offsets_mapping:
+            out["offset_mapping"] = offsets
+        if return_tensors == "pt":
+            import torch
+            return {k: torch.tensor(v) for k, v in out.items()}
+        if single:
+            return {k: v[0] for k, v in out.items()}
+        return out
+
+
+class SnapshotModel:
+    """Wraps a traced TorchScript token classifier so it can be called like the HF model."""
+
+    def __init__(self, path: str = None, device: str = "cpu", module=None):
+        import torch
+
+        self.module = module if module is not None else torch.jit.load(path, map_location=device)
+        self.device = device
+
+    def to(self, device):
+        self.module.to(device)
+        self.device = device
+        return self
+
+    def eval(self):
+        self.module.eval()
+        return self
+
+    def __call__(self, input_ids, attention_mask):
+        out = self.module(input_ids, attention_mask)
+        return SimpleNamespace(logits=out[0] if isinstance(out, (tuple, list)) else out)
+
+
+def load_tokenizer(model_dir: str, model_name: str = None):
+    if model_name is None and is_snapshot(model_dir):
+        return SnapshotTokenizer(os.path.join(model_dir, SNAPSHOT_TOKENIZER))
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_dir if model_name is None else model_name)
+
+
+def load_model(model_dir: str, device: str = "cpu"):
+    if is_snapshot(model_dir):
+        model = SnapshotModel(os.path.join(model_dir, SNAPSHOT_MODEL), device=device)
+        return model.eval()
+
+    from transformers import AutoModelForTokenClassification
+
+    kwargs = {}
+    if os.path.exists(os.path.join(model_dir, "model.safetensors")):
+        # safetensors are memory-mapped; skipping random init lets the params alias the mapping
+        kwargs = {"use_safetensors": True, "low_cpu_mem_usage": True}
+    model = AutoModelForTokenClassification.from_pretrained(model_dir, **kwargs)
+    model.to(device)
+    model.eval()
+    return model
+
+
+def trace_model(model, tokenizer, text: str = "my phone number is nine eight seven six"):
+    """Traces and freezes an HF token classifier; the result accepts any batch/sequence shape."""
+    import torch
+
+    return_dict = model.config.return_dict
+    model.config.return_dict = False
+    enc = tokenizer(text, return_tensors="pt")
+    try:
+        with torch.no_grad():
+            traced = torch.jit.trace(model, (enc["input_ids"], enc["attention_mask"]), strict=False)
+            traced = torch.jit.freeze(traced)
+    finally:
+        model.config.return_dict = return_dict
+    return traced
+
+
+def build_snapshot(model_dir: str, snapshot_dir: str, max_length: int = 256):
+    import torch
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = load_model(model_dir, device="cpu")
+    traced = trace_model(model, tokenizer)
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    torch.jit.save(traced, os.path.join(snapshot_dir, SNAPSHOT_MODEL))
+    tokenizer.backend_tokenizer.save(os.path.join(snapshot_dir, SNAPSHOT_TOKENIZER))
+    for name in SIDECAR_FILES:
+        src = os.path.join(model_dir, name)
+        if os.path.exists(src):
+            shutil.copy(src, os.path.join(snapshot_dir, name))
+    with open(os.path.join(snapshot_dir, SNAPSHOT_META), "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.abspath(model_dir), "max_length": max_length,
+                   "torch": torch.__version__}, f, indent=2)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build a TorchScript + tokenizer snapshot for fast cold start")
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--snapshot_dir", default=None)
+    ap.add_argument("--max_length", type=int, default=256)
+    args = ap.parse_args()
+
+    snapshot_dir = args.snapshot_dir or os.path.join(args.model_dir, "snapshot")
+    build_snapshot(args.model_dir, snapshot_dir, max_length=args.max_length)
+    print(f"Wrote snapshot of {args.model_dir} to {snapshot_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import argparse
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from labels import LABELS, label_is_pii
+from loading import file_digest, model_fingerprint
+
+THRESHOLDS_FILE = "thresholds.json"
+CACHE_DIR = "logit_cache"
+POLICIES = ("token", "span_mean", "span_min")
+
+# type 0 is "O"; entity types in label order
+TYPES = ["O"] + [lab[2:] for lab in LABELS if lab.startswith("B-")]
+TYPE_INDEX = {t: i for i, t in enumerate(TYPES)}
+LABEL_TYPE = np.array([TYPE_INDEX[lab[2:]] if lab != "O" else 0 for lab in LABELS], dtype=np.int64)
+LABEL_IS_B = np.array([lab.startswith("B-") for lab in LABELS])
+TYPE_IS_PII = np.array([label_is_pii(t) for t in TYPES])
+_TYPE_MATRIX = np.eye(len(TYPES), dtype=np.float32)[LABEL_TYPE]  # (labels, types): sums B-X and I-X
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    x = logits.astype(np.float32)
+    x -= x.max(axis=-1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=-1, keepdims=True)
+    return x
+
+
+def token_confidence(probs: np.ndarray):
+    """Argmax label per token and the probability of that label's entity type (B + I)."""
+    pred = probs.argmax(axis=-1)
+    type_probs = probs @ _TYPE_MATRIX
+    conf = type_probs[np.arange(len(pred)), LABEL_TYPE[pred]]
+    return pred, conf
+
+
+def decode_spans(pred: np.ndarray, conf: np.ndarray, offsets: np.ndarray, row_splits: np.ndarray,
+                 policy: str = "token", thresholds: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """Vectorized `bio_to_spans` over many utterances at once, with per-type confidence thresholds.
+
+    `token` drops tokens whose type confidence is below the threshold before decoding;
+    `span_mean` / `span_min` decode first and drop spans whose mean / min confidence is below it.
+    Returns parallel arrays: utt, start, end, type, conf.
+    """
+    thresholds = np.zeros(len(TYPES)) if thresholds is None else thresholds
+    utt = np.repeat(np.arange(len(row_splits) - 1), np.diff(row_splits))
+    valid = (offsets[:, 0] != 0) | (offsets[:, 1] != 0)  # special tokens are skipped, not span breaks
+    typ = LABEL_TYPE[pred[valid]]
+    is_b = LABEL_IS_B[pred[valid]]
+    conf, offs, utt = conf[valid], offsets[valid], utt[valid]
+    if policy == "token":
+        typ = np.where(conf >= thresholds[typ], typ, 0)
+
+    prev = np.concatenate([[0], typ[:-1]])
+    new_utt = np.concatenate([[True], utt[1:] != utt[:-1]])
+    start = (typ > 0) & (is_b | (prev != typ) | new_utt)
+    idx = np.nonzero(typ > 0)[0]
+    if len(idx) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return {"utt": empty, "start": empty, "end": empty, "type": empty, "conf": np.zeros(0)}
+    sid = np.cumsum(start)[idx]
+    first = np.concatenate([[0], np.nonzero(np.diff(sid))[0] + 1])
+    last = np.concatenate([first[1:] - 1, [len(idx) - 1]])
+    span_conf = (np.add.reduceat(conf[idx], first) / (last - first + 1) if policy != "span_min"
+                 else np.minimum.reduceat(conf[idx], first))
+    spans = {
+        "utt": utt[idx[first]],
+        "start": offs[idx[first], 0].astype(np.int64),
+        "end": offs[idx[last], 1].astype(np.int64),
+        "type": typ[idx[first]],
+        "conf": span_conf,
+    }
+    if policy != "token":
+        keep = span_conf >= thresholds[spans["type"]]
+        spans = {k: v[keep] for k, v in spans.items()}
+    return spans
+
+
+def threshold_vector(thresholds: Dict[str, float]) -> np.ndarray:
+    vec = np.zeros(len(TYPES))
+    for t, v in thresholds.items():
+        vec[TYPE_INDEX[t]] = v
+    return vec
+
+
+def load_thresholds(model_dir: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(model_dir, THRESHOLDS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if config["policy"] not in POLICIES:
+        raise ValueError(f"{path}: unknown decode policy {config['policy']!r}")
+    config["vector"] = threshold_vector(config["thresholds"])
+    return config
+
+
+def threshold_spans(offsets, logits, config: Dict[str, Any]) -> List[tuple]:
+    """(start, end, type) spans of one utterance under a thresholds.json config (used by PIIRecognizer)."""
+    offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+    pred, conf = token_confidence(_softmax(np.asarray(logits)[:len(offsets)]))
+    s = decode_spans(pred, conf, offsets, np.array([0, len(offsets)]), config["policy"], config["vector"])
+    return [(int(a), int(b), TYPES[t]) for a, b, t in zip(s["start"], s["end"], s["type"])]
+
+
+# ---- cache -------------------------------------------------------------------------------
+
+
+def cache_dir_for(model_dir: str, data_path: str, max_length: int = 256, root: Optional[str] = None) -> str:
+    import hashlib
+
+    h = hashlib.sha256(model_fingerprint(model_dir).encode())
+    h.update(f"|{max_length}|".encode())
+    file_digest([data_path], h)
+    return os.path.join(root or os.path.join(model_dir, CACHE_DIR), h.hexdigest()[:16])
+
+
+def build_cache(model_dir: str, data_path: str, max_length: int = 256, batch_size: int = 32,
+                device: Optional[str] = None, root: Optional[str] = None) -> str:
+    """Runs the model over `data_path` once and stores float16 logits plus original-text offsets."""
+    out_dir = cache_dir_for(model_dir, data_path, max_length, root)
+    if os.path.exists(os.path.join(out_dir, "meta.json")):
+        return out_dir
+    import torch
+    from data_io import iter_text_batches
+    from normalizer import normalize
+    from recognizer import PIIRecognizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    ids, splits, n_tokens = [], [0], 0
+    with PIIRecognizer(model_dir, device=device, max_length=max_length, use_tuning_profile=False) as rec, \
+            open(os.path.join(out_dir, "logits.bin"), "wb") as f_logits, \
+            open(os.path.join(out_dir, "offsets.bin"), "wb") as f_offsets:
+        for batch_ids, texts in iter_text_batches(data_path, batch_size):
+            norms = [normalize(t) for t in texts] if rec.normalize else [None] * len(texts)
+            model_texts = [n.text for n in norms] if rec.normalize else texts
+            enc = rec.tokenizer(model_texts, return_offsets_mapping=True, truncation=True, max_length=max_length,
+                                padding=True, return_tensors="pt")
+            with torch.no_grad():
+                logits = rec.model(input_ids=enc["input_ids"].to(rec.device),
+                                   attention_mask=enc["attention_mask"].to(rec.device)).logits
+            logits = logits.float().cpu().numpy().astype(np.float16)
+            lengths = enc["attention_mask"].sum(dim=1).tolist()
+            for i, (n, norm) in enumerate(zip(lengths, norms)):
+                offs = enc["offset_mapping"][i, :n].numpy().astype(np.int32)
+                if norm is not None:
+                    real = (offs[:, 0] != 0) | (offs[:, 1] != 0)
+                    offs[real] = [norm.to_original(int(s), int(e)) for s, e in offs[real]]
+                f_logits.write(logits[i, :n].tobytes())
+                f_offsets.write(offs.tobytes())
+                n_tokens += n
+                splits.append(n_tokens)
+            ids.extend(batch_ids)
+    np.save(os.path.join(out_dir, "row_splits.npy"), np.asarray(splits, dtype=np.int64))
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"model_dir": os.path.abspath(model_dir), "data": os.path.abspath(data_path), "ids": ids,
+                   "tokens": n_tokens, "labels": LABELS, "max_length": max_length}, f)
+    return out_dir
+
+
+class LogitCache:
+    """Memory-mapped view of a cache written by `build_cache`."""
+
+    def __init__(self, cache_dir: str):
+        with open(os.path.join(cache_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["labels"] != LABELS:
+            raise ValueError(f"{cache_dir} was written with a different label list")
+        n = self.meta["tokens"]
+        self.ids = self.meta["ids"]
+        self.row_splits = np.load(os.path.join(cache_dir, "row_splits.npy"))
+        self.logits = np.memmap(os.path.join(cache_dir, "logits.bin"), dtype=np.float16, mode="r",
+                                shape=(n, len(LABELS)))
+        self.offsets = np.memmap(os.path.join(cache_dir, "offsets.bin"), dtype=np.int32, mode="r", shape=(n, 2))
+        self.pred, self.conf = token_confidence(_softmax(self.logits))
+
+    def spans(self, policy: str = "token", thresholds: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        return decode_spans(self.pred, self.conf, self.offsets, self.row_splits, policy, thresholds)
+
+
+# ---- scoring -----------------------------------------------------------------------------
+
+
+def _keys(utt, start, end, kind):
+    # 24 bits utterance, 4 bits type, 17 + 17 bits of character offsets
+    return (utt.astype(np.int64) << 38) | (kind.astype(np.int64) << 34) | (start << 17) | end
+
+
+def gold_spans(data_path: str, ids: Sequence[str]) -> Dict[str, np.ndarray]:
+    from eval_span_f1 import iter_gold
+
+    row = {uid: i for i, uid in enumerate(ids)}
+    cols = {"utt": [], "start": [], "end": [], "type": []}
+    for uid, spans in iter_gold(data_path):
+        for s, e, lab in spans:
+            if uid in row and lab in TYPE_INDEX:
+                cols["utt"].append(row[uid])
+                cols["start"].append(s)
+                cols["end"].append(e)
+                cols["type"].append(TYPE_INDEX[lab])
+    return {k: np.asarray(v, dtype=np.int64) for k, v in cols.items()}
+
+
+def count(pred: Dict[str, np.ndarray], gold: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Per-type tp/fp/fn (exact span + label, like eval_span_f1) plus PII / non-PII kind counts."""
+    out = {}
+    pk = np.unique(_keys(pred["utt"], pred["start"], pred["end"], pred["type"]))
+    gk = np.unique(_keys(gold["utt"], gold["start"], gold["end"], gold["type"]))
+    p_type, g_type = (pk >> 34) & 15, (gk >> 34) & 15
+    hit = np.isin(pk, gk, assume_unique=True)
+    k = len(TYPES)
+    out["tp"] = np.bincount(p_type[hit], minlength=k)
+    out["fp"] = np.bincount(p_type[~hit], minlength=k)
+    out["fn"] = np.bincount(g_type, minlength=k) - out["tp"]
+
+    # PII vs non-PII matching ignores which PII type was predicted, as in eval_span_f1
+    mask = ~np.int64(15 << 34)
+    pkind = np.unique((pk & mask) | (TYPE_IS_PII[p_type].astype(np.int64) << 34))
+    gkind = np.unique((gk & mask) | (TYPE_IS_PII[g_type].astype(np.int64) << 34))
+    p_pii, g_pii = (pkind >> 34) & 1, (gkind >> 34) & 1
+    khit = np.isin(pkind, gkind, assume_unique=True)
+    out["kind_tp"] = np.bincount(p_pii[khit], minlength=2)
+    out["kind_fp"] = np.bincount(p_pii[~khit], minlength=2)
+    out["kind_fn"] = np.bincount(g_pii, minlength=2) - out["kind_tp"]
+    return out
+
+
+def _prf(tp, fp, fn, beta: float = 1.0):
+    tp, fp, fn = (np.asarray(x, dtype=np.float64) for x in (tp, fp, fn))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        r = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        b2 = beta * beta
+        f = np.where(p + r > 0, (1 + b2) * p * r / (b2 * p + r), 0.0)
+    return p, r, f
+
+
+def summarize_counts(c: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    p, r, f = _prf(c["tp"], c["fp"], c["fn"])
+    present = (c["tp"] + c["fn"]) > 0
+    per_label = {TYPES[t]: {"precision": float(p[t]), "recall": float(r[t]), "f1": float(f[t])}
+                 for t in range(1, len(TYPES)) if present[t]}
+    kp, kr, kf = _prf(c["kind_tp"], c["kind_fp"], c["kind_fn"])
+    return {"per_label": per_label, "macro_f1": float(f[1:][present[1:]].mean()) if present[1:].any() else 0.0,
+            "pii": {"precision": float(kp[1]), "recall": float(kr[1]), "f1": float(kf[1])},
+            "non_pii": {"precision": float(kp[0]), "recall": float(kr[0]), "f1": float(kf[0])}}
+
+
+def sweep(cache: LogitCache, gold: Dict[str, np.ndarray], grid: np.ndarray, policies: Sequence[str] = POLICIES,
+          beta: float = 0.5, min_precision: Optional[float] = None) -> Dict[str, Any]:
+    """Best per-type threshold for every policy, then the policy with the best PII F-beta.
+
+    A span's correctness only depends on its own type, so each type is tuned independently:
+    one decode per grid value scores every type at once.
+    """
+    results = {}
+    for policy in policies:
+        tp, fp, fn = [], [], []
+        for t in grid:
+            c = count(cache.spans(policy, np.full(len(TYPES), t)), gold)
+            tp.append(c["tp"])
+            fp.append(c["fp"])
+            fn.append(c["fn"])
+        tp, fp, fn = np.array(tp), np.array(fp), np.array(fn)
+        chosen = {}
+        for t in range(1, len(TYPES)):
+            b = beta if TYPE_IS_PII[t] else 1.0
+            p, r, f = _prf(tp[:, t], fp[:, t], fn[:, t], beta=b)
+            score = f
+            if min_precision is not None and TYPE_IS_PII[t] and (p >= min_precision).any():
+                score = np.where(p >= min_precision, r, -1.0)
+            chosen[TYPES[t]] = float(grid[int(np.argmax(score))])  # lowest threshold among ties
+        c = count(cache.spans(policy, threshold_vector(chosen)), gold)
+        _, _, fb = _prf(c["kind_tp"][1], c["kind_fp"][1], c["kind_fn"][1], beta=beta)
+        results[policy] = {"thresholds": chosen, "pii_fbeta": float(fb), "metrics": summarize_counts(c)}
+    best = max(results, key=lambda p: results[p]["pii_fbeta"])
+    return {"policy": best, **results[best], "all": results}
+
+
+def _print_metrics(name: str, m: Dict[str, Any]):
+    print(f"{name:12s} PII P/R/F1 {m['pii']['precision']:.3f} / {m['pii']['recall']:.3f} / {m['pii']['f1']:.3f}  "
+          f"macro-F1 {m['macro_f1']:.3f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Cache dev logits once, then sweep per-label thresholds and decode policies")
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--policies", default=",".join(POLICIES))
+    ap.add_argument("--grid", type=int, default=100, help="thresholds 0, 1/N, ... (N-1)/N")
+    ap.add_argument("--beta", type=float, default=0.5, help="F-beta for PII labels (<1 favours precision)")
+    ap.add_argument("--min_precision", type=float, default=None,
+                    help="instead: highest PII-label recall whose precision reaches this")
+    ap.add_argument("--cache_root", default=None, help=f"default: <model_dir>/{CACHE_DIR}")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--write", action="store_true", help=f"save the chosen policy to <model_dir>/{THRESHOLDS_FILE}")
+    args = ap.parse_args()
+
+    start = time.perf_counter()
+    cache_dir = build_cache(args.model_dir, args.dev, args.max_length, device=args.device, root=args.cache_root)
+    cache = LogitCache(cache_dir)
+    gold = gold_spans(args.dev, cache.ids)
+    print(f"Logits for {len(cache.ids)} utterances in {cache_dir} ({time.perf_counter() - start:.1f}s)")
+
+    start = time.perf_counter()
+    grid = np.arange(args.grid) / args.grid
+    result = sweep(cache, gold, grid, [p for p in args.policies.split(",") if p], args.beta, args.min_precision)
+    print(f"Swept {len(grid)} thresholds x {len(result['all'])} policies in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    _print_metrics("argmax", summarize_counts(count(cache.spans("token"), gold)))
+    for policy, r in result["all"].items():
+        _print_metrics(policy, r["metrics"])
+    print(f"Best: {result['policy']} " + " ".join(f"{t}={v:.2f}" for t, v in result["thresholds"].items()))
+
+    if args.write:
+        config = {"policy": result["policy"], "thresholds": result["thresholds"], "dev": args.dev,
+                  "beta": args.beta, "min_precision": args.min_precision, "metrics": result["metrics"],
+                  "fingerprint": model_fingerprint(args.model_dir)}
+        with open(os.path.join(args.model_dir, THRESHOLDS_FILE), "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2)
+        print(f"Wrote {os.path.join(args.model_dir, THRESHOLDS_FILE)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,38 @@
-import json
 import time
+
+_START = time.perf_counter()
+
 import argparse
 import statistics
+from contextlib import contextmanager
+
+from bucketing import parse_buckets
+from data_io import iter_records
+from instrumentation import STAGES, Metrics
+from loading import time_since_start_ms
+from normalizer import normalize
+
+
+class StageSamples(Metrics):
+    """Metrics that also keep every stage duration the recognizer reports, for exact percentiles."""
+
+    def __init__(self):
+        super().__init__()
+        self.samples = {name: [] for name in STAGES}
+
+    @contextmanager
+    def time_stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - start) * 1000.0
+            self.stage_latency.observe(ms, stage=stage)
+            self.samples.setdefault(stage, []).append(ms)
 
-import torch
-from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+def percentile(sorted_ms, q):
+    return sorted_ms[max(0, int(q * len(sorted_ms)) - 1)]
 
 
 def main():
@@ -14,59 +42,96 @@ def main():
     ap.add_argument("--input", default="data/dev.jsonl")
     ap.add_argument("--max_length", type=int, default=256)
     ap.add_argument("--runs", type=int, default=50)
-    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--metrics_out", default=None, help="also write per-stage Prometheus histograms here")
+    ap.add_argument("--no_tuning_profile", action="store_true", help="ignore the model's autotune.json")
+    ap.add_argument("--no_thresholds", action="store_true", help="ignore the model's thresholds.json (plain argmax)")
+    ap.add_argument("--buckets", default=None, help="pad to fixed lengths, e.g. 16,32,64,128,256")
+    ap.add_argument("--bucket_mode", default="trace", choices=["trace", "compile", "pad"])
+    ap.add_argument("--early_exit_threshold", type=float, default=None,
+                    help="use the exit heads of an --early_exit checkpoint (1.0 = full depth)")
     args = ap.parse_args()
 
-    tokenizer = AutoTokenizer.from_pretrained(args.model_dir if args.model_name is None else args.model_name)
-    model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
-    model.to(args.device)
-    model.eval()
+    from recognizer import PIIRecognizer
+
+    load_start = time.perf_counter()
+    try:
+        recognizer = PIIRecognizer(
+            args.model_dir,
+            model_name=args.model_name,
+            device=args.device,
+            max_length=args.max_length,
+            max_batch_size=1,
+            use_tuning_profile=not args.no_tuning_profile,
+            use_thresholds=not args.no_thresholds,
+            buckets=parse_buckets(args.buckets) if args.buckets else None,
+            bucket_mode=args.bucket_mode,
+            early_exit_threshold=args.early_exit_threshold,
+        )
+    except ValueError as e:
+        ap.error(str(e))
+    load_ms = (time.perf_counter() - load_start) * 1000.0
+    profile = recognizer.tuning_profile
+    if profile:
+        print(f"Using autotune profile: backend={profile['backend']} threads={profile['num_threads']} "
+              f"interop={profile['num_interop_threads']}")
 
-    texts = []
-    with open(args.input, "r", encoding="utf-8") as f:
-        for line in f:
-            obj = json.loads(line)
-            texts.append(obj["text"])
+    texts = [obj["text"] for obj in iter_records(args.input, columns=["text"])]
 
     if not texts:
         print("No texts found in input file.")
+        recognizer.close()
         return
 
-    times_ms = []
+    recognizer.predict(texts[0])
+    first_prediction_ms = time_since_start_ms()
+    script_ms = (time.perf_counter() - _START) * 1000.0
 
-    # warmup
-    for _ in range(5):
-        t = texts[0]
-        enc = tokenizer(
-            t,
-            truncation=True,
-            max_length=args.max_length,
-            return_tensors="pt",
-        )
-        with torch.no_grad():
-            _ = model(input_ids=enc["input_ids"].to(args.device), attention_mask=enc["attention_mask"].to(args.device))
+    # warmup: one text per distinct input length (bucketed models warm every bucket when loaded)
+    warm_start = time.perf_counter()
+    by_length = {}
+    for t in texts:
+        model_text = normalize(t).text if recognizer.normalize else t
+        n = len(recognizer.tokenizer(model_text, truncation=True, max_length=recognizer.max_length)["input_ids"])
+        by_length.setdefault(n, t)
+    for t in by_length.values():
+        for _ in range(2):
+            recognizer.predict(t)
+    warmup_ms = (time.perf_counter() - warm_start) * 1000.0
 
+    # time the recognizer itself through its stage hooks, so the breakdown is the served path
+    metrics = StageSamples()
+    recognizer.metrics = metrics
+    if args.early_exit_threshold is not None:
+        recognizer.model.reset_stats()
+    total_ms = []
     for i in range(args.runs):
-        t = texts[i % len(texts)]
-        enc = tokenizer(
-            t,
-            truncation=True,
-            max_length=args.max_length,
-            return_tensors="pt",
-        )
         start = time.perf_counter()
-        with torch.no_grad():
-            _ = model(input_ids=enc["input_ids"].to(args.device), attention_mask=enc["attention_mask"].to(args.device))
-        end = time.perf_counter()
-        times_ms.append((end - start) * 1000.0)
+        recognizer.predict(texts[i % len(texts)])
+        total_ms.append((time.perf_counter() - start) * 1000.0)
+    recognizer.close()
 
-    p50 = statistics.median(times_ms)
-    times_sorted = sorted(times_ms)
-    p95 = times_sorted[int(0.95 * len(times_sorted)) - 1]
+    times_sorted = sorted(metrics.samples["forward"])
 
     print(f"Latency over {args.runs} runs (batch_size=1):")
-    print(f"  p50: {p50:.2f} ms")
-    print(f"  p95: {p95:.2f} ms")
+    print(f"  p50: {statistics.median(times_sorted):.2f} ms")
+    print(f"  p95: {percentile(times_sorted, 0.95):.2f} ms")
+    if args.early_exit_threshold is not None:
+        print(f"  average layers executed per utterance: {recognizer.model.avg_layers():.2f} / "
+              f"{recognizer.model.num_layers}")
+    print("Per-stage breakdown (p50 / p95 ms):")
+    for name in STAGES:
+        ms = sorted(metrics.samples[name])
+        print(f"  {name:10s} {statistics.median(ms):8.3f} / {percentile(ms, 0.95):8.3f}")
+    ms = sorted(total_ms)
+    print(f"  {'total':10s} {statistics.median(ms):8.3f} / {percentile(ms, 0.95):8.3f}")
+    if args.metrics_out:
+        metrics.write_prometheus(args.metrics_out)
+    print("Cold start:")
+    print(f"  load: {load_ms:.1f} ms")
+    print(f"  warmup: {warmup_ms:.1f} ms")
+    print(f"  time to first prediction: {first_prediction_ms:.1f} ms since process start "
+          f"({script_ms:.1f} ms since script start)")
 
 
 if __name__ == "__main__":
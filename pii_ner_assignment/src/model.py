@@ -10,3 +10,11 @@ def create_model(model_name: str):
         label2id=LABEL2ID,
     )
     return model
+
+
+def create_early_exit_model(model_name: str, exit_layers=None, distill_alpha: float = 0.5,
+                            temperature: float = 2.0):
+    from early_exit import EarlyExitTokenClassifier
+
+    return EarlyExitTokenClassifier(create_model(model_name), exit_layers, distill_alpha=distill_alpha,
+                                    temperature=temperature)
@@ -0,0 +1,174 @@
+import os
+import re
+import json
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+PREPROCESSING_FILE = "preprocessing.json"
+NORMALIZER_NAME = "spoken_v1"
+
+DIGIT_WORDS = {
+    "zero": "0", "oh": "0", "o": "0",
+    "one": "1", "won": "1",
+    "two": "2", "to": "2", "too": "2",
+    "three": "3",
+    "four": "4", "for": "4",
+    "five": "5",
+    "six": "6",
+    "seven": "7",
+    "eight": "8", "ate": "8",
+    "nine": "9",
+}
+REPEAT_WORDS = {"double": 2, "triple": 3}
+MIN_DIGIT_RUN = 3  # shorter runs are more likely "to"/"for"/"oh" used as words
+
+_WORD_RE = re.compile(r"\S+")
+
+
+class Normalized:
+    """Normalized text plus, for every character, the span of the original text it came from."""
+
+    def __init__(self, original: str, text: str, starts: List[int], ends: List[int]):
+        self.original = original
+        self.text = text
+        self.starts = starts
+        self.ends = ends
+
+    def to_original(self, start: int, end: int) -> Tuple[int, int]:
+        return self.starts[start], self.ends[end - 1]
+
+    def to_normalized(self, start: int, end: int) -> Optional[Tuple[int, int]]:
+        """Smallest normalized span covering every source character overlapping [start, end)."""
+        s = bisect_right(self.ends, start)
+        e = bisect_left(self.starts, end)
+        return (s, e) if s < e else None
+
+
+def _digit_runs(words) -> Dict[int, int]:
+    """Maps the first word index of each collapsible digit run to its end (exclusive)."""
+    runs = {}
+    i = 0
+    while i < len(words):
+        j, digits = i, 0
+        while j < len(words):
+            w = words[j][0]
+            if w in DIGIT_WORDS:
+                j, digits = j + 1, digits + 1
+            elif w in REPEAT_WORDS and j + 1 < len(words) and words[j + 1][0] in DIGIT_WORDS:
+                j, digits = j + 2, digits + 1
+            else:
+                break
+        if digits >= MIN_DIGIT_RUN:
+            runs[i] = j
+            i = j
+        else:
+            i = max(j, i + 1)
+    return runs
+
+
+def _email_spans(words, taken) -> Dict[int, int]:
+    """`name [dot name]* at domain dot tld [dot tld]*` -> first word index: end (exclusive)."""
+    spans = {}
+    for i, (w, _, _) in enumerate(words):
+        if w != "at" or i == 0 or i + 3 >= len(words) or i in taken:
+            continue
+        if words[i - 1][0] in ("at", "dot") or words[i + 1][0] in ("at", "dot"):
+            continue
+        end = i + 2
+        while end + 1 < len(words) and words[end][0] == "dot" and words[end + 1][0] not in ("at", "dot"):
+            end += 2
+        if end == i + 2 or (end < len(words) and words[end][0] == "at"):
+            continue  # no dot in the domain, or the "domain" is the name part of a later email
+        start = i - 1
+        while start >= 2 and words[start - 1][0] == "dot" and words[start - 2][0] not in ("at", "dot"):
+            start -= 2
+        if any(k in taken for k in range(start, end)):
+            continue
+        spans[start] = end
+        taken.update(range(start, end))
+    return spans
+
+
+def normalize(text: str) -> Normalized:
+    """Collapses spoken digit runs ("double"/"triple" included) and spoken emails.
+
+    "ate ate nine one" -> "8891", "alex dot patel at outlook dot org" -> "alex.patel@outlook.org".
+    Everything else is copied unchanged.
+    """
+    words = [(m.group().lower(), m.start(), m.end()) for m in _WORD_RE.finditer(text)]
+    runs = _digit_runs(words)
+    taken = {k for s, e in runs.items() for k in range(s, e)}
+    emails = _email_spans(words, set(taken))
+
+    out, starts, ends = [], [], []
+
+    def emit(chars: str, s: int, e: int):
+        for c in chars:
+            out.append(c)
+            starts.append(s)
+            ends.append(e)
+
+    pos, i = 0, 0
+    while i < len(words):
+        w, s, e = words[i]
+        for k in range(pos, s):
+            emit(text[k], k, k + 1)
+        if i in runs:
+            j = i
+            while j < runs[i]:
+                w, s, e = words[j]
+                if w in REPEAT_WORDS:
+                    _, _, e = words[j + 1]
+                    emit(DIGIT_WORDS[words[j + 1][0]] * REPEAT_WORDS[w], s, e)
+                    j += 2
+                else:
+                    emit(DIGIT_WORDS[w], s, e)
+                    j += 1
+            i = j
+        elif i in emails:
+            for j in range(i, emails[i]):
+                w, s, e = words[j]
+                if w == "dot" or w == "at":
+                    emit("." if w == "dot" else "@", s, e)
+                else:
+                    for k in range(s, e):
+                        emit(text[k], k, k + 1)
+            i = emails[i]
+        else:
+            for k in range(s, e):
+                emit(text[k], k, k + 1)
+            i += 1
+        pos = e
+    for k in range(pos, len(text)):
+        emit(text[k], k, k + 1)
+    return Normalized(text, "".join(out), starts, ends)
+
+
+def normalize_entities(norm: Normalized, entities) -> List[dict]:
+    """Moves gold entity spans from the original onto the normalized text."""
+    moved = []
+    for ent in entities:
+        span = norm.to_normalized(ent["start"], ent["end"])
+        if span is not None:
+            moved.append({**ent, "start": span[0], "end": span[1]})
+    return moved
+
+
+def load_preprocessing(model_dir: str) -> Dict[str, object]:
+    path = os.path.join(model_dir, PREPROCESSING_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_preprocessing(model_dir: str, normalizer: Optional[str] = NORMALIZER_NAME):
+    with open(os.path.join(model_dir, PREPROCESSING_FILE), "w", encoding="utf-8") as f:
+        json.dump({"normalizer": normalizer}, f, indent=2)
+
+
+def uses_normalizer(model_dir: str) -> bool:
+    normalizer = load_preprocessing(model_dir).get("normalizer")
+    if normalizer not in (None, NORMALIZER_NAME):
+        raise ValueError(f"{model_dir} was trained with unknown normalizer {normalizer!r}")
+    return normalizer == NORMALIZER_NAME
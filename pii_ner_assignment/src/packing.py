@@ -0,0 +1,165 @@
+import time
+import inspect
+import argparse
+from typing import List, Sequence, Tuple
+
+from data_io import iter_records
+
+DEFAULT_PACK_TOKENS = 128
+
+
+def check_packable(model):
+    """Packing needs the eager HF model: it passes position_ids and a per-row block mask."""
+    forward = getattr(model, "forward", None)
+    if forward is None or "position_ids" not in inspect.signature(forward).parameters:
+        raise ValueError(f"{type(model).__name__} does not accept position_ids; sequence packing needs "
+                         "an eager transformers checkpoint (not a snapshot, bucketed or traced model)")
+
+
+def pack(lengths: Sequence[int], max_tokens: int) -> List[List[int]]:
+    """First-fit decreasing: groups utterance indices into rows of at most `max_tokens` tokens.
+
+    An utterance longer than `max_tokens` gets a row of its own.
+    """
+    rows, room = [], []
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        n = lengths[i]
+        for r, free in enumerate(room):
+            if n <= free:
+                rows[r].append(i)
+                room[r] -= n
+                break
+        else:
+            rows.append([i])
+            room.append(max_tokens - n)
+    return rows
+
+
+def _legacy_masks() -> bool:
+    import transformers
+
+    return int(transformers.__version__.split(".")[0]) < 5
+
+
+def build_packed_batch(encoded: List[List[int]], rows: List[List[int]], pad_token_id: int, dtype=None):
+    """Concatenates each row's utterances (with their own [CLS]/[SEP]) and builds the inputs.
+
+    Returns input_ids, position_ids (restarting at 0 per utterance), a block-diagonal
+    attention mask and, per utterance, its (row, start, length) inside the packed batch.
+    """
+    import torch
+
+    width = max(sum(len(encoded[i]) for i in row) for row in rows)
+    input_ids = torch.full((len(rows), width), pad_token_id, dtype=torch.long)
+    position_ids = torch.zeros((len(rows), width), dtype=torch.long)
+    block = torch.zeros((len(rows), width, width), dtype=torch.bool)
+    segments = [None] * len(encoded)
+    for r, row in enumerate(rows):
+        start = 0
+        for i in row:
+            n = len(encoded[i])
+            input_ids[r, start:start + n] = torch.tensor(encoded[i], dtype=torch.long)
+            position_ids[r, start:start + n] = torch.arange(n)
+            block[r, start:start + n, start:start + n] = True
+            segments[i] = (r, start, n)
+            start += n
+        # padding attends only to itself so no softmax row is fully masked
+        idx = torch.arange(start, width)
+        block[r, idx, idx] = True
+
+    if _legacy_masks():
+        mask = block.long()  # 3D masks are expanded by get_extended_attention_mask
+    else:
+        dtype = dtype or torch.float32
+        mask = torch.zeros(block.shape, dtype=dtype).masked_fill_(~block, torch.finfo(dtype).min)[:, None]
+    return input_ids, position_ids, mask, segments
+
+
+def packed_logits(model, encoded: List[List[int]], pad_token_id: int, max_tokens: int = DEFAULT_PACK_TOKENS,
+                  device: str = "cpu"):
+    """Runs every utterance in one packed forward pass and returns one logits tensor per utterance."""
+    if not encoded:
+        return []
+    rows = pack([len(ids) for ids in encoded], max_tokens)
+    dtype = next(model.parameters()).dtype
+    input_ids, position_ids, mask, segments = build_packed_batch(encoded, rows, pad_token_id, dtype=dtype)
+    out = model(input_ids=input_ids.to(device), attention_mask=mask.to(device), position_ids=position_ids.to(device))
+    return [out.logits[r, s:s + n] for r, s, n in segments]
+
+
+def _padded_predictions(model, tokenizer, texts, batch_size, max_length, device):
+    import torch
+
+    preds, tokens = [], 0
+    with torch.no_grad():
+        for i in range(0, len(texts), batch_size):
+            enc = tokenizer(texts[i:i + batch_size], truncation=True, max_length=max_length, padding=True,
+                            return_tensors="pt")
+            tokens += enc["input_ids"].numel()
+            out = model(input_ids=enc["input_ids"].to(device), attention_mask=enc["attention_mask"].to(device))
+            for row, m in zip(out.logits.argmax(-1), enc["attention_mask"].bool()):
+                preds.append(row[m.to(row.device)].tolist())
+    return preds, tokens
+
+
+def _packed_predictions(model, tokenizer, texts, batch_size, max_length, max_tokens, device, pad_token_id):
+    import torch
+
+    preds, tokens = [], 0
+    with torch.no_grad():
+        for i in range(0, len(texts), batch_size):
+            encoded = tokenizer(texts[i:i + batch_size], truncation=True, max_length=max_length)["input_ids"]
+            rows = pack([len(e) for e in encoded], max_tokens)
+            tokens += len(rows) * max(sum(len(encoded[j]) for j in row) for row in rows)
+            for logits in packed_logits(model, encoded, pad_token_id, max_tokens, device):
+                preds.append(logits.argmax(-1).tolist())
+    return preds, tokens
+
+
+def _timed(fn, repeats) -> Tuple[list, int, float]:
+    fn()  # warm up
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        preds, tokens = fn()
+        best = min(best, time.perf_counter() - start)
+    return preds, tokens, best
+
+
+def main():
+    from loading import load_model, load_tokenizer, resolve_device
+
+    ap = argparse.ArgumentParser(description="Compare padded batching with sequence packing")
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--batch_size", type=int, default=32, help="utterances per forward pass in both modes")
+    ap.add_argument("--max_tokens", type=int, default=DEFAULT_PACK_TOKENS, help="token budget of a packed row")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--repeats", type=int, default=3)
+    ap.add_argument("--device", default=None)
+    args = ap.parse_args()
+
+    device = resolve_device(args.device)
+    tokenizer = load_tokenizer(args.model_dir)
+    model = load_model(args.model_dir, device=device)
+    check_packable(model)
+    texts = [obj["text"] for obj in iter_records(args.input, columns=["text"])]
+
+    padded, padded_tokens, padded_s = _timed(
+        lambda: _padded_predictions(model, tokenizer, texts, args.batch_size, args.max_length, device), args.repeats)
+    packed, packed_tokens, packed_s = _timed(
+        lambda: _packed_predictions(model, tokenizer, texts, args.batch_size, args.max_length, args.max_tokens,
+                                    device, tokenizer.pad_token_id), args.repeats)
+
+    same = sum(a == b for a, b in zip(padded, packed))
+    real = sum(len(p) for p in padded)
+    print(f"{len(texts)} utterances, {real} real tokens, batch_size={args.batch_size}, max_tokens={args.max_tokens}")
+    print(f"  padded: {len(texts) / padded_s:8.1f} utt/s  {padded_tokens:7d} tokens computed "
+          f"({100 * real / max(1, padded_tokens):.0f}% real)")
+    print(f"  packed: {len(texts) / packed_s:8.1f} utt/s  {packed_tokens:7d} tokens computed "
+          f"({100 * real / max(1, packed_tokens):.0f}% real)")
+    print(f"  speedup: {padded_s / packed_s:.2f}x, identical predictions: {same}/{len(texts)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
-import json
+import time
+
+_START = time.perf_counter()
+
 import argparse
-import torch
-from transformers import AutoTokenizer, AutoModelForTokenClassification
-from labels import ID2LABEL, label_is_pii
+from data_io import iter_text_batches, write_predictions
+from labels import ID2LABEL
+from loading import time_since_start_ms
 import os
 
 
@@ -52,58 +55,81 @@ def main():
     ap.add_argument("--input", default="data/dev.jsonl")
     ap.add_argument("--output", default="out/dev_pred.json")
     ap.add_argument("--max_length", type=int, default=256)
-    ap.add_argument(
-        "--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--batch_size", type=int, default=None, help="default: autotune profile, else 1")
+    ap.add_argument("--num_threads", type=int, default=None)
+    ap.add_argument("--backend", default=None, choices=["eager", "torchscript", "dynamic_int8"])
+    ap.add_argument("--no_tuning_profile", action="store_true", help="ignore the model's autotune.json")
+    ap.add_argument("--no_thresholds", action="store_true", help="ignore the model's thresholds.json (plain argmax)")
+    ap.add_argument("--buckets", default=None, help="pad to fixed lengths, e.g. 16,32,64,128,256")
+    ap.add_argument("--bucket_mode", default="trace", choices=["trace", "compile", "pad"])
+    ap.add_argument("--cache_size", type=int, default=0, help="LRU result cache entries (0 = off)")
+    ap.add_argument("--metrics_out", default=None, help="write Prometheus text metrics to this file")
+    ap.add_argument("--metrics_port", type=int, default=None, help="serve /metrics on this port while running")
+    ap.add_argument("--profile_rate", type=float, default=0.0, help="fraction of batches traced with torch.profiler")
+    ap.add_argument("--profile_dir", default="traces")
+    ap.add_argument("--pack_tokens", type=int, default=None,
+                    help="pack each batch into rows of this many tokens instead of padding")
+    ap.add_argument("--early_exit_threshold", type=float, default=None,
+                    help="use the exit heads of an --early_exit checkpoint; lower = faster (1.0 = full depth)")
     args = ap.parse_args()
 
-    tokenizer = AutoTokenizer.from_pretrained(
-        args.model_dir if args.model_name is None else args.model_name)
-    model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
-    model.to(args.device)
-    model.eval()
-
+    from bucketing import parse_buckets
+    from instrumentation import Metrics, TraceSampler
+    from recognizer import PIIRecognizer
+
+    metrics = Metrics() if (args.metrics_out or args.metrics_port) else None
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    sampler = TraceSampler(args.profile_dir, args.profile_rate) if args.profile_rate > 0 else None
+    recognizer = PIIRecognizer(
+        args.model_dir,
+        model_name=args.model_name,
+        device=args.device,
+        max_length=args.max_length,
+        max_batch_size=args.batch_size,
+        num_threads=args.num_threads,
+        backend=args.backend,
+        use_tuning_profile=not args.no_tuning_profile,
+        use_thresholds=not args.no_thresholds,
+        buckets=parse_buckets(args.buckets) if args.buckets else None,
+        bucket_mode=args.bucket_mode,
+        metrics=metrics,
+        trace_sampler=sampler,
+        cache_size=args.cache_size,
+        early_exit_threshold=args.early_exit_threshold,
+        pack_tokens=args.pack_tokens,
+    )
+
+    batch_size = args.batch_size or (recognizer.max_batch_size if recognizer.tuning_profile else 1)
     results = {}
+    first_prediction_ms = script_ms = None
+
+    def flush(batch):
+        nonlocal first_prediction_ms, script_ms
+        ents = recognizer.predict_batch([text for _, text in batch])
+        for (uid, _), e in zip(batch, ents):
+            results[uid] = e
+        if first_prediction_ms is None:
+            first_prediction_ms = time_since_start_ms()
+            script_ms = (time.perf_counter() - _START) * 1000.0
 
-    with open(args.input, "r", encoding="utf-8") as f:
-        for line in f:
-            obj = json.loads(line)
-            text = obj["text"]
-            uid = obj["id"]
-
-            enc = tokenizer(
-                text,
-                return_offsets_mapping=True,
-                truncation=True,
-                max_length=args.max_length,
-                return_tensors="pt",
-            )
-            offsets = enc["offset_mapping"][0].tolist()
-            input_ids = enc["input_ids"].to(args.device)
-            attention_mask = enc["attention_mask"].to(args.device)
-
-            with torch.no_grad():
-                out = model(input_ids=input_ids, attention_mask=attention_mask)
-                logits = out.logits[0]
-                pred_ids = logits.argmax(dim=-1).cpu().tolist()
-
-            spans = bio_to_spans(text, offsets, pred_ids)
-            ents = []
-            for s, e, lab in spans:
-                ents.append(
-                    {
-                        "start": int(s),
-                        "end": int(e),
-                        "label": lab,
-                        "pii": bool(label_is_pii(lab)),
-                    }
-                )
-            results[uid] = ents
+    for ids, texts in iter_text_batches(args.input, batch_size):
+        flush(list(zip(ids, texts)))
+    recognizer.close()
 
     os.makedirs(os.path.dirname(args.output), exist_ok=True)
-    with open(args.output, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    write_predictions(args.output, results.items())
 
     print(f"Wrote predictions for {len(results)} utterances to {args.output}")
+    if args.early_exit_threshold is not None:
+        print(f"Average layers executed per utterance: {recognizer.model.avg_layers():.2f} / {recognizer.model.num_layers}")
+    if args.metrics_out:
+        metrics.write_prometheus(args.metrics_out)
+        print(f"Wrote metrics to {args.metrics_out}")
+    if first_prediction_ms is not None:
+        print(f"Time to first prediction: {first_prediction_ms:.1f} ms since process start "
+              f"({script_ms:.1f} ms since script start)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,326 @@
+import time
+import asyncio
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from autotune import load_tuning_profile
+from backends import apply_backend
+from bucketing import BucketedModel
+from instrumentation import Metrics, TraceSampler, stage
+from labels import label_is_pii
+from loading import is_snapshot, load_model, load_tokenizer, resolve_device
+from logit_cache import load_thresholds, threshold_spans
+from normalizer import normalize, uses_normalizer
+from predict import bio_to_spans
+
+
+class PIIRecognizer:
+    """Loads a token-classification checkpoint once and serves span predictions.
+
+    Instances can be shared across threads. `num_threads` / `num_interop_threads`
+    set torch's process-wide thread pools, so configure them once per process.
+    Settings left as None come from the host's `autotune.json` profile when present.
+    `early_exit_threshold` enables the exit heads of a checkpoint trained with --early_exit;
+    lower values stop earlier (faster, less accurate), 1.0 always runs every layer.
+    `pack_tokens` packs each batch into rows of that many tokens instead of padding it.
+    Spoken-form normalization follows the checkpoint's preprocessing.json unless
+    `normalize_text` is given; returned spans always index the caller's original text.
+    Per-label confidence thresholds from the checkpoint's thresholds.json (logit_cache.py)
+    are applied unless `use_thresholds` is False. A `tokenizer` shared with other
+    recognizers must come with the `tokenizer_lock` they use too.
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        model_name: Optional[str] = None,
+        device: Optional[str] = None,
+        max_length: int = 256,
+        max_batch_size: Optional[int] = None,
+        num_threads: Optional[int] = None,
+        num_interop_threads: Optional[int] = None,
+        backend: Optional[str] = None,
+        use_tuning_profile: bool = True,
+        buckets: Optional[Sequence[int]] = None,
+        bucket_mode: str = "trace",
+        max_workers: int = 2,
+        batch_wait_ms: float = 2.0,
+        tokenizer=None,
+        tokenizer_lock: Optional[threading.Lock] = None,
+        model=None,
+        metrics: Optional[Metrics] = None,
+        trace_sampler: Optional[TraceSampler] = None,
+        cache_size: int = 0,
+        early_exit_threshold: Optional[float] = None,
+        pack_tokens: Optional[int] = None,
+        normalize_text: Optional[bool] = None,
+        use_thresholds: bool = True,
+    ):
+        import torch
+
+        profile = load_tuning_profile(model_dir) if use_tuning_profile else None
+        if profile:
+            num_threads = profile["num_threads"] if num_threads is None else num_threads
+            num_interop_threads = (profile["num_interop_threads"] if num_interop_threads is None
+                                   else num_interop_threads)
+            max_batch_size = profile["batch_size"] if max_batch_size is None else max_batch_size
+            backend = profile["backend"] if backend is None else backend
+        self.tuning_profile = profile
+
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        if num_interop_threads is not None:
+            try:
+                torch.set_num_interop_threads(num_interop_threads)
+            except RuntimeError:
+                pass  # already set (or parallel work already started) in this process
+
+        self.model_dir = model_dir
+        self.device = resolve_device(device)
+        self.max_length = max_length
+        self.max_batch_size = max_batch_size or 32
+        self.batch_wait_ms = batch_wait_ms
+        self.tokenizer = tokenizer if tokenizer is not None else load_tokenizer(model_dir, model_name)
+        self.model = model if model is not None else load_model(model_dir, device=self.device)
+        self.backend = backend or "eager"
+        if early_exit_threshold is not None:
+            from early_exit import has_early_exit, load_early_exit
+
+            if not has_early_exit(model_dir):
+                raise ValueError(f"{model_dir} was not trained with --early_exit")
+            if is_snapshot(model_dir):
+                raise ValueError(f"{model_dir} is a traced snapshot; early exit needs the eager checkpoint")
+            if buckets:
+                raise ValueError("early exit runs the eager model layer by layer and can't be bucketed")
+            # the exit decision is data dependent, so traced/quantized backends don't apply
+            self.backend = "eager"
+            self.model = load_early_exit(model_dir, self.model, threshold=early_exit_threshold)
+        if self.backend != "eager" and self.device == "cpu":
+            self.model = apply_backend(self.model, self.backend, self.tokenizer)
+        if buckets:
+            # never pad past the largest bucket the caller compiled for
+            self.max_length = min(self.max_length, max(buckets))
+            self.model = BucketedModel(self.model, buckets, pad_token_id=self.tokenizer.pad_token_id,
+                                       mode=bucket_mode, device=self.device)
+            self.model.warmup(sorted({1, self.max_batch_size}))
+        if pack_tokens:
+            from packing import check_packable
+
+            check_packable(self.model)
+        self.pack_tokens = pack_tokens
+        # checkpoints trained with --normalize record it in preprocessing.json
+        self.normalize = uses_normalizer(model_dir) if normalize_text is None else normalize_text
+        self.thresholds = load_thresholds(model_dir) if use_thresholds else None
+        self.metrics = metrics
+        self.trace_sampler = trace_sampler
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # HF fast tokenizers are not safe to call concurrently; the forward pass is.
+        self._tokenizer_lock = tokenizer_lock if tokenizer_lock is not None else threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pii-recognizer")
+        self._batchers = weakref.WeakKeyDictionary()
+        self._batchers_lock = threading.Lock()
+
+    def predict(self, text: str) -> List[Dict[str, Any]]:
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts: List[str], max_length: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+        """`max_length` truncates this call below the instance's limit; truncated results are not cached."""
+        start = time.perf_counter()
+        max_length = self.max_length if max_length is None else min(max_length, self.max_length)
+        results = [None] * len(texts)
+        todo = []
+        for i, text in enumerate(texts):
+            cached = self._cache_get(text)
+            if cached is None:
+                todo.append(i)
+            else:
+                results[i] = cached
+
+        for j in range(0, len(todo), self.max_batch_size):
+            idx = todo[j:j + self.max_batch_size]
+            chunk = [texts[i] for i in idx]
+            if self.trace_sampler is not None:
+                with self.trace_sampler.maybe_trace():
+                    ents = self._predict_chunk(chunk, max_length)
+            else:
+                ents = self._predict_chunk(chunk, max_length)
+            for i, e in zip(idx, ents):
+                results[i] = e
+                if max_length == self.max_length:
+                    self._cache_put(texts[i], e)
+
+        if self.metrics is not None:
+            self.metrics.request_latency.observe((time.perf_counter() - start) * 1000.0)
+        return results
+
+    def _cache_get(self, text):
+        if not self.cache_size:
+            return None
+        with self._cache_lock:
+            hit = self._cache.get(text)
+            if hit is not None:
+                self._cache.move_to_end(text)
+        if self.metrics is not None:
+            self.metrics.cache.inc(outcome="hit" if hit is not None else "miss")
+        # every hit gets its own dicts, so a caller editing its result can't change the next one
+        return None if hit is None else [dict(e) for e in hit]
+
+    def _cache_put(self, text, ents):
+        if not self.cache_size:
+            return
+        frozen = tuple(tuple(e.items()) for e in ents)
+        with self._cache_lock:
+            self._cache[text] = frozen
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _predict_chunk(self, texts: List[str], max_length: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+        import torch
+
+        if not texts:
+            return []
+        m = self.metrics
+        max_length = max_length or self.max_length
+        with stage(m, "tokenize"):
+            norms = [normalize(t) for t in texts] if self.normalize else [None] * len(texts)
+            model_texts = [n.text for n in norms] if self.normalize else texts
+            with self._tokenizer_lock:
+                if self.pack_tokens:
+                    enc = self.tokenizer(model_texts, return_offsets_mapping=True, truncation=True,
+                                         max_length=max_length)
+                else:
+                    enc = self.tokenizer(
+                        model_texts,
+                        return_offsets_mapping=True,
+                        truncation=True,
+                        max_length=max_length,
+                        padding=True,
+                        return_tensors="pt",
+                    )
+        if self.pack_tokens:
+            return self._predict_packed(enc, model_texts, norms)
+        with stage(m, "to_device"):
+            offsets = enc["offset_mapping"].tolist()
+            input_ids = enc["input_ids"].to(self.device)
+            attention_mask = enc["attention_mask"].to(self.device)
+        if m is not None:
+            m.batch_size.observe(len(texts))
+            m.seq_len.observe(input_ids.shape[1])
+
+        with torch.no_grad():
+            with stage(m, "forward"):
+                out = self.model(input_ids=input_ids, attention_mask=attention_mask)
+                if m is not None and self.device.startswith("cuda"):
+                    torch.cuda.synchronize()
+            with stage(m, "argmax"):
+                if self.thresholds is not None:
+                    pred_ids = out.logits.float().cpu().numpy()
+                else:
+                    pred_ids = out.logits.argmax(dim=-1).cpu().tolist()
+
+        with stage(m, "decode"):
+            return [self._to_entities(text, offs, ids, norm, self.thresholds)
+                    for text, offs, ids, norm in zip(model_texts, offsets, pred_ids, norms)]
+
+    def _predict_packed(self, enc, model_texts: List[str], norms) -> List[List[Dict[str, Any]]]:
+        import torch
+        from packing import packed_logits
+
+        m = self.metrics
+        if m is not None:
+            m.batch_size.observe(len(model_texts))
+        with torch.no_grad():
+            with stage(m, "forward"):
+                logits = packed_logits(self.model, enc["input_ids"], self.tokenizer.pad_token_id,
+                                       self.pack_tokens, self.device)
+            with stage(m, "argmax"):
+                if self.thresholds is not None:
+                    pred_ids = [l.float().cpu().numpy() for l in logits]
+                else:
+                    pred_ids = [l.argmax(dim=-1).cpu().tolist() for l in logits]
+
+        with stage(m, "decode"):
+            return [self._to_entities(text, offs, ids, norm, self.thresholds)
+                    for text, offs, ids, norm in zip(model_texts, enc["offset_mapping"], pred_ids, norms)]
+
+    @staticmethod
+    def _to_entities(text, offsets, pred_ids, norm=None, thresholds=None) -> List[Dict[str, Any]]:
+        # with thresholds, pred_ids holds the utterance's raw logits
+        if thresholds is not None:
+            spans = threshold_spans(offsets, pred_ids, thresholds)
+        else:
+            spans = bio_to_spans(text, offsets, pred_ids)
+        if norm is not None:
+            spans = [(*norm.to_original(s, e), lab) for s, e, lab in spans]
+        return [
+            {"start": int(s), "end": int(e), "label": lab, "pii": bool(label_is_pii(lab))}
+            for s, e, lab in spans
+        ]
+
+    async def predict_async(self, text: str) -> List[Dict[str, Any]]:
+        """Awaitable predict; concurrent awaits on one loop are coalesced into batches."""
+        loop = asyncio.get_running_loop()
+        with self._batchers_lock:
+            batcher = self._batchers.get(loop)
+            if batcher is None:
+                batcher = _AsyncBatcher(self, loop)
+                self._batchers[loop] = batcher
+        return await batcher.submit(text)
+
+    async def predict_batch_async(self, texts: List[str]) -> List[List[Dict[str, Any]]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.predict_batch, list(texts))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _AsyncBatcher:
+    def __init__(self, recognizer: PIIRecognizer, loop: asyncio.AbstractEventLoop):
+        self.recognizer = recognizer
+        self.loop = loop
+        self.pending = []
+        self.timer = None
+
+    def submit(self, text: str) -> asyncio.Future:
+        fut = self.loop.create_future()
+        self.pending.append((text, fut))
+        if len(self.pending) >= self.recognizer.max_batch_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = self.loop.call_later(self.recognizer.batch_wait_ms / 1000.0, self._flush)
+        return fut
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        texts = [t for t, _ in batch]
+        job = self.loop.run_in_executor(self.recognizer._executor, self.recognizer.predict_batch, texts)
+        job.add_done_callback(lambda j: self._resolve(batch, j))
+
+    @staticmethod
+    def _resolve(batch, job):
+        exc = asyncio.CancelledError() if job.cancelled() else job.exception()
+        for i, (_, fut) in enumerate(batch):
+            if fut.done():
+                continue
+            if exc is not None:
+                fut.set_exception(exc)
+            else:
+                fut.set_result(job.result()[i])
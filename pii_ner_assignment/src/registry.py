@@ -0,0 +1,317 @@
+import gc
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from data_io import iter_records, write_predictions
+from instrumentation import Metrics
+
+TOKENIZER_FILES = ("tokenizer.json", "vocab.txt", "tokenizer_config.json", "special_tokens_map.json")
+
+
+def tokenizer_fingerprint(model_dir: str) -> Optional[str]:
+    """Hash of the tokenizer files, so checkpoints fine-tuned from one base share one tokenizer."""
+    h = hashlib.sha256()
+    found = False
+    for name in TOKENIZER_FILES:
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+            found = True
+            h.update(name.encode())
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+    return h.hexdigest() if found else None
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def model_nbytes(model) -> int:
+    """Bytes held by the tensors of a model, looking through the repo's wrappers (snapshot, buckets)."""
+    if not callable(getattr(model, "parameters", None)):
+        for attr in ("module", "base"):
+            inner = getattr(model, attr, None)
+            if inner is not None:
+                return model_nbytes(inner)
+        return 0
+    tensors = {}
+    for t in list(model.parameters()) + list(model.buffers()):
+        tensors[t.data_ptr()] = t.numel() * t.element_size()
+    return sum(tensors.values())
+
+
+class ModelRegistry:
+    """Loads checkpoints by name on first use and keeps the loaded ones under a memory budget.
+
+    Least recently used models are evicted when a load pushes the total over `memory_budget_mb`
+    (a single model larger than the budget is still served). Checkpoints with identical
+    tokenizer files share one tokenizer instance and the lock that serializes calls to it.
+    Loads run outside the registry lock: other models keep serving, and concurrent requests
+    for a model that is loading wait for that one load. `predict*` and `using(name)` hold a
+    lease on the recognizer: one evicted while leased is closed when its last lease ends, and
+    closing never happens under the registry lock. Load / evict events are kept in `events`,
+    passed to `on_event` and, with `metrics`, exported as counters and a per-model memory gauge.
+    """
+
+    def __init__(self, models: Dict[str, str], memory_budget_mb: float = 2048.0, metrics: Optional[Metrics] = None,
+                 on_event: Optional[Callable[[Dict[str, Any]], None]] = None, **recognizer_kwargs):
+        self.models = dict(models)
+        self.memory_budget_mb = memory_budget_mb
+        self.recognizer_kwargs = recognizer_kwargs
+        self.on_event = on_event
+        self.events = deque(maxlen=1000)
+        self._loaded = OrderedDict()  # name -> (recognizer, mb)
+        self._loading = {}  # name -> Event set when its in-flight load finishes
+        self._leases = {}  # recognizer -> callers currently using it
+        self._retired = set()  # evicted while leased; closed by the last release
+        self._tokenizers = weakref.WeakValueDictionary()  # fingerprint -> tokenizer
+        self._tokenizer_locks = weakref.WeakKeyDictionary()  # tokenizer -> lock shared by its recognizers
+        self._tokenizers_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.metrics = metrics
+        if metrics is not None:
+            self._event_counter = metrics.counter("registry_events_total", "Model registry load/evict events")
+            self._memory_gauge = metrics.gauge("registry_model_memory_mb", "Memory held by each loaded model")
+
+    @classmethod
+    def from_spec(cls, spec: str, **kwargs) -> "ModelRegistry":
+        """`name=dir,name=dir`, a JSON file mapping names to dirs, or a directory of checkpoints."""
+        if os.path.isfile(spec):
+            with open(spec, "r", encoding="utf-8") as f:
+                return cls(json.load(f), **kwargs)
+        if os.path.isdir(spec):
+            models = {d: os.path.join(spec, d) for d in sorted(os.listdir(spec))
+                      if os.path.exists(os.path.join(spec, d, "config.json"))}
+            return cls(models, **kwargs)
+        models = {}
+        for item in spec.split(","):
+            name, _, path = item.partition("=")
+            models[name] = path or name
+        return cls(models, **kwargs)
+
+    def register(self, name: str, model_dir: str):
+        with self._lock:
+            self.models[name] = model_dir
+
+    def _event(self, event: str, name: str, **extra):
+        record = {"event": event, "model": name, "time": time.time(), **extra}
+        self.events.append(record)
+        if self.metrics is not None:
+            self._event_counter.inc(event=event, model=name)
+        if self.on_event is not None:
+            self.on_event(record)
+
+    def _tokenizer_for(self, model_dir: str):
+        """(tokenizer, its lock, whether it was shared) for a checkpoint."""
+        from loading import load_tokenizer
+
+        key = tokenizer_fingerprint(model_dir)
+        with self._tokenizers_lock:
+            tok = self._tokenizers.get(key) if key is not None else None
+            shared = tok is not None
+            if tok is None:
+                tok = load_tokenizer(model_dir)
+                if key is not None:
+                    self._tokenizers[key] = tok
+                self._tokenizer_locks[tok] = threading.Lock()
+            return tok, self._tokenizer_locks[tok], shared
+
+    def get(self, name: str):
+        """The loaded recognizer for `name`.
+
+        Eviction may close it at any time; hold `using(name)` instead when calls on it could
+        overlap an eviction.
+        """
+        while True:
+            with self._lock:
+                hit = self._loaded.get(name)
+                if hit is not None:
+                    self._loaded.move_to_end(name)
+                    return hit[0]
+                if name not in self.models:
+                    raise KeyError(f"unknown model {name!r}; registered: {sorted(self.models)}")
+                pending = self._loading.get(name)
+                if pending is None:
+                    pending = self._loading[name] = threading.Event()
+                    model_dir = self.models[name]
+                    break
+            # another thread is loading it; if that load fails, the next pass retries
+            pending.wait()
+
+        from recognizer import PIIRecognizer
+
+        try:
+            start = time.perf_counter()
+            rss_before = _rss_bytes()
+            tokenizer, tokenizer_lock, shared = self._tokenizer_for(model_dir)
+            recognizer = PIIRecognizer(model_dir, tokenizer=tokenizer, tokenizer_lock=tokenizer_lock,
+                                       **self.recognizer_kwargs)
+            nbytes = model_nbytes(recognizer.model) or max(0, _rss_bytes() - rss_before)
+            mb = nbytes / (1024 * 1024)
+            with self._lock:
+                self._loaded[name] = (recognizer, mb)
+                if self.metrics is not None:
+                    self._memory_gauge.set(round(mb, 3), model=name)
+                self._event("load", name, mb=mb, ms=(time.perf_counter() - start) * 1000.0,
+                            shared_tokenizer=shared)
+                victims = self._evict_over_budget(keep=name)
+            self._close(victims)
+            return recognizer
+        finally:
+            with self._lock:
+                del self._loading[name]
+            pending.set()
+
+    def _evict_over_budget(self, keep: str) -> list:
+        """Unloads least recently used models; call under the lock and `_close` the result after it."""
+        victims = []
+        while self.loaded_mb() > self.memory_budget_mb and len(self._loaded) > 1:
+            victims.extend(self._unload(next(n for n in self._loaded if n != keep)))
+        if self.loaded_mb() > self.memory_budget_mb:
+            self._event("over_budget", keep, mb=self.loaded_mb())
+        return victims
+
+    def _unload(self, name: str) -> list:
+        """Drops a loaded model; returns it unless it is leased, in which case its last release closes it."""
+        recognizer, mb = self._loaded.pop(name)
+        if self.metrics is not None:
+            self._memory_gauge.remove(model=name)
+        self._event("evict", name, mb=mb)
+        if recognizer in self._leases:
+            self._retired.add(recognizer)
+            return []
+        return [recognizer]
+
+    @staticmethod
+    def _close(recognizers: list):
+        # outside the registry lock: close() waits for the recognizer's in-flight async batches
+        for recognizer in recognizers:
+            recognizer.close()
+        if recognizers:
+            recognizers.clear()
+            gc.collect()
+
+    def evict(self, name: str):
+        with self._lock:
+            victims = self._unload(name) if name in self._loaded else []
+        self._close(victims)
+
+    def _acquire(self, name: str):
+        while True:
+            recognizer = self.get(name)
+            with self._lock:
+                hit = self._loaded.get(name)
+                if hit is not None and hit[0] is recognizer:  # not evicted since get()
+                    self._leases[recognizer] = self._leases.get(recognizer, 0) + 1
+                    return recognizer
+
+    def _release(self, recognizer):
+        with self._lock:
+            left = self._leases.pop(recognizer) - 1
+            if left:
+                self._leases[recognizer] = left
+                return
+            if recognizer not in self._retired:
+                return
+            self._retired.discard(recognizer)
+        self._close([recognizer])
+
+    @contextmanager
+    def using(self, name: str):
+        """The recognizer for `name`, kept open for the duration even if it is evicted meanwhile."""
+        recognizer = self._acquire(name)
+        try:
+            yield recognizer
+        finally:
+            self._release(recognizer)
+
+    def loaded_mb(self) -> float:
+        return sum(mb for _, mb in self._loaded.values())
+
+    def predict(self, name: str, text: str) -> List[Dict[str, Any]]:
+        with self.using(name) as recognizer:
+            return recognizer.predict(text)
+
+    def predict_batch(self, name: str, texts: List[str]) -> List[List[Dict[str, Any]]]:
+        with self.using(name) as recognizer:
+            return recognizer.predict_batch(texts)
+
+    async def predict_async(self, name: str, text: str) -> List[Dict[str, Any]]:
+        # the lease keeps the recognizer's executor open across the await
+        with self.using(name) as recognizer:
+            return await recognizer.predict_async(text)
+
+    def memory_report(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            loaded = {n: mb for n, (_, mb) in self._loaded.items()}
+        return [{"model": n, "dir": d, "loaded": n in loaded, "mb": loaded.get(n, 0.0)}
+                for n, d in self.models.items()]
+
+    def close(self):
+        with self._lock:
+            victims = [recognizer for recognizer, _ in self._loaded.values() if recognizer not in self._leases]
+            self._retired.update(recognizer for recognizer, _ in self._loaded.values() if recognizer in self._leases)
+            self._loaded.clear()
+        self._close(victims)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve several checkpoints by name under a memory budget")
+    ap.add_argument("--models", required=True,
+                    help="name=dir,name=dir | JSON file {name: dir} | directory containing checkpoints")
+    ap.add_argument("--default_model", default=None, help="for input lines without a \"model\" field")
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--output", default=None)
+    ap.add_argument("--budget_mb", type=float, default=2048.0)
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--metrics_out", default=None)
+    args = ap.parse_args()
+
+    def log(e):
+        extra = " ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}"
+                         for k, v in e.items() if k not in ("event", "model", "time"))
+        print(f"[registry] {e['event']:11s} {e['model']} {extra}")
+
+    metrics = Metrics() if args.metrics_out else None
+    registry = ModelRegistry.from_spec(args.models, memory_budget_mb=args.budget_mb, metrics=metrics, on_event=log,
+                                       device=args.device, max_length=args.max_length)
+    default = args.default_model or next(iter(registry.models))
+
+    results = {}
+    for obj in iter_records(args.input):
+        results[obj["id"]] = registry.predict(obj.get("model") or default, obj["text"])
+
+    print(f"{'model':20s} {'loaded':>6s} {'mb':>9s}")
+    for r in registry.memory_report():
+        print(f"{r['model']:20s} {str(r['loaded']):>6s} {r['mb']:9.1f}")
+    print(f"Loaded total: {registry.loaded_mb():.1f} / {args.budget_mb:.0f} MiB")
+    registry.close()
+
+    if args.output:
+        write_predictions(args.output, results.items())
+    if metrics is not None:
+        metrics.write_prometheus(args.metrics_out)
+
+
+if __name__ == "__main__":
+    main()
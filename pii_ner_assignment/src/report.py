@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+from typing import Any, Dict, List, Optional
+
+from autotune import host_fingerprint
+from data_io import iter_records, write_predictions
+from loading import FINGERPRINT_FILES, file_digest, model_fingerprint
+
+CACHE_DIR = "report_cache"
+# files that change predictions without being part of the checkpoint itself
+DECODE_FILES = ("thresholds.json", "autotune.json")
+
+
+def _key(*parts: str) -> str:
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+
+def _load_json(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_json(path: str, obj: Dict[str, Any]):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _count_params(model) -> int:
+    if not callable(getattr(model, "parameters", None)):
+        for attr in ("module", "base"):
+            inner = getattr(model, attr, None)
+            if inner is not None:
+                return _count_params(inner)
+        return 0
+    return sum(p.numel() for p in model.parameters())
+
+
+def _percentile(sorted_vals, q):
+    return sorted_vals[max(0, int(q * len(sorted_vals)) - 1)] if sorted_vals else 0.0
+
+
+class ReportCard:
+    """Predictions, span metrics, latency and size of one checkpoint, cached on disk.
+
+    Predictions and metrics are keyed by the checkpoint fingerprint (weights, tokenizer,
+    preprocessing), its decode files (thresholds.json, autotune.json) and the data file's
+    hash; latency additionally by host, device and run count. The model is only loaded
+    when something is missing.
+    """
+
+    def __init__(self, model_dir: str, cache_root: Optional[str] = None, device: str = "cpu", max_length: int = 256):
+        self.model_dir = model_dir
+        self.cache_dir = cache_root or os.path.join(model_dir, CACHE_DIR)
+        self.device = device
+        self.max_length = max_length
+        self.fingerprint = model_fingerprint(model_dir)
+        self.decode_digest = file_digest(os.path.join(model_dir, name) for name in DECODE_FILES)
+        self._recognizer = None
+
+    @property
+    def recognizer(self):
+        if self._recognizer is None:
+            from recognizer import PIIRecognizer
+
+            self._recognizer = PIIRecognizer(self.model_dir, device=self.device, max_length=self.max_length)
+        return self._recognizer
+
+    def close(self):
+        if self._recognizer is not None:
+            self._recognizer.close()
+            self._recognizer = None
+
+    def _data_key(self, data_path: str) -> str:
+        return _key(self.fingerprint, self.decode_digest, file_digest([data_path]), str(self.max_length))
+
+    def predictions(self, data_path: str, batch_size: int = 32) -> str:
+        """Path of the cached JSONL predictions for `data_path`, computing them on a miss."""
+        path = os.path.join(self.cache_dir, f"{self._data_key(data_path)}.pred.jsonl")
+        if os.path.exists(path):
+            return path
+        os.makedirs(self.cache_dir, exist_ok=True)
+        results = []
+        records = [(obj["id"], obj["text"]) for obj in iter_records(data_path, columns=["id", "text"])]
+        for i in range(0, len(records), batch_size):
+            chunk = records[i:i + batch_size]
+            results.extend(zip([uid for uid, _ in chunk], self.recognizer.predict_batch([t for _, t in chunk])))
+        write_predictions(path + ".tmp.jsonl", results)
+        os.replace(path + ".tmp.jsonl", path)
+        return path
+
+    def metrics(self, data_path: str) -> Dict[str, Any]:
+        path = os.path.join(self.cache_dir, f"{self._data_key(data_path)}.metrics.json")
+        cached = _load_json(path)
+        if cached is not None:
+            return cached
+        from eval_span_f1 import evaluate
+
+        report = evaluate(data_path, self.predictions(data_path))
+        _save_json(path, report)
+        return report
+
+    def latency(self, data_path: str, runs: int = 50, warmup: int = 5) -> Dict[str, Any]:
+        """End-to-end `PIIRecognizer.predict` latency at batch size 1."""
+        key = _key(self._data_key(data_path), host_fingerprint(), self.device, str(runs))
+        path = os.path.join(self.cache_dir, f"{key}.latency.json")
+        cached = _load_json(path)
+        if cached is not None:
+            return cached
+        texts = [obj["text"] for obj in iter_records(data_path, columns=["text"])]
+        rec = self.recognizer
+        for t in texts[:warmup]:
+            rec.predict(t)
+        times = []
+        for i in range(runs):
+            start = time.perf_counter()
+            rec.predict(texts[i % len(texts)])
+            times.append((time.perf_counter() - start) * 1000.0)
+        times.sort()
+        result = {"runs": runs, "host": host_fingerprint(), "device": self.device,
+                  "p50_ms": _percentile(times, 0.50), "p95_ms": _percentile(times, 0.95),
+                  "p99_ms": _percentile(times, 0.99), "mean_ms": sum(times) / max(1, len(times))}
+        _save_json(path, result)
+        return result
+
+    def size(self) -> Dict[str, Any]:
+        path = os.path.join(self.cache_dir, f"{_key(self.fingerprint)}.size.json")
+        cached = _load_json(path)
+        if cached is not None:
+            return cached
+        from registry import model_nbytes
+
+        disk = sum(os.path.getsize(os.path.join(self.model_dir, name)) for name in FINGERPRINT_FILES
+                   if os.path.exists(os.path.join(self.model_dir, name)))
+        model = self.recognizer.model
+        result = {"params": _count_params(model), "memory_mb": model_nbytes(model) / 2**20,
+                  "disk_mb": disk / 2**20}
+        _save_json(path, result)
+        return result
+
+    def report(self, data_path: str, runs: int = 50) -> Dict[str, Any]:
+        card = {"model_dir": self.model_dir, "fingerprint": self.fingerprint[:16], "data": data_path}
+        card.update(self.size())
+        card["metrics"] = self.metrics(data_path)
+        card["predictions"] = self.predictions(data_path)
+        if runs:
+            card["latency"] = self.latency(data_path, runs)
+        return card
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def report_cards(model_dirs: List[str], data_path: str, runs: int = 50, device: str = "cpu",
+                 cache_root: Optional[str] = None) -> List[Dict[str, Any]]:
+    cards = []
+    for model_dir in model_dirs:
+        start = time.perf_counter()
+        with ReportCard(model_dir, cache_root=cache_root, device=device) as rc:
+            card = rc.report(data_path, runs)
+        card["report_s"] = time.perf_counter() - start
+        cards.append(card)
+    return cards
+
+
+def print_cards(cards: List[Dict[str, Any]]):
+    print(f"{'model':32s} {'params':>8s} {'disk_mb':>8s} {'PII_P':>6s} {'PII_R':>6s} {'PII_F1':>6s} "
+          f"{'macro':>6s} {'p50_ms':>7s} {'p95_ms':>7s} {'secs':>6s}")
+    for c in cards:
+        m, lat = c["metrics"], c.get("latency", {})
+        print(f"{c['model_dir'][-32:]:32s} {c['params'] / 1e6:7.1f}M {c['disk_mb']:8.1f} "
+              f"{m['pii']['precision']:6.3f} {m['pii']['recall']:6.3f} {m['pii']['f1']:6.3f} {m['macro_f1']:6.3f} "
+              f"{lat.get('p50_ms', float('nan')):7.2f} {lat.get('p95_ms', float('nan')):7.2f} {c['report_s']:6.1f}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Report card (quality, latency, size) for one or more checkpoints")
+    ap.add_argument("model_dirs", nargs="+")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--runs", type=int, default=50, help="batch-size-1 latency runs (0 = skip)")
+    ap.add_argument("--device", default="cpu")
+    ap.add_argument("--cache_root", default=None, help=f"default: <model_dir>/{CACHE_DIR}")
+    ap.add_argument("--per_label", action="store_true", help="also print per-entity metrics")
+    ap.add_argument("--json_out", default=None)
+    args = ap.parse_args(argv)
+
+    cards = report_cards(args.model_dirs, args.dev, runs=args.runs, device=args.device, cache_root=args.cache_root)
+    print_cards(cards)
+    if args.per_label:
+        from eval_span_f1 import print_report
+
+        for c in cards:
+            print(f"\n== {c['model_dir']}")
+            print_report(c["metrics"])
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(cards, f, indent=2)
+    return cards
+
+
+if __name__ == "__main__":
+    main()
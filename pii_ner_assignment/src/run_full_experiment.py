@@ -20,6 +20,9 @@ import subprocess
 from skopt import forest_minimize
 from skopt.space import Real, Categorical
 
+from data_io import iter_records, write_predictions
+from report import ReportCard
+
 # -----------------------------------------------------
 # Very small, CPU-friendly experiment
 # -----------------------------------------------------
@@ -46,6 +49,7 @@ BEST_CONFIG = os.path.join(ROOT, "best_config.json")
 BEST_PRED = os.path.join(ROOT, "best_dev_pred.json")
 
 FINAL_SUBMISSION = "final_submission.json"
+CHECKPOINT_EVERY = 100  # steps; re-running the script after preemption resumes each trial
 
 # -----------------------------------------------------
 # Hyperparameter Search Space
@@ -68,11 +72,20 @@ def run(cmd):
     return r.stdout + r.stderr
 
 
-def extract_f1(text):
-    for line in text.split("\n"):
-        if "Macro-F1" in line:
-            return float(line.split(":")[1])
-    return 0.0
+def train(out_dir, args):
+    """Runs train.py unless out_dir already holds a finished run; a preempted run resumes."""
+    if os.path.exists(os.path.join(out_dir, "train_stats.json")):
+        print(f"\n[SKIP] {out_dir} already trained\n")
+        return
+    run(
+        f"python src/train.py {args} --out_dir {out_dir} "
+        f"--checkpoint_every {CHECKPOINT_EVERY} --keep_checkpoints 1 --resume"
+    )
+
+
+def copy_predictions(cached, dest):
+    """Writes cached JSONL predictions in the format `dest`'s extension asks for."""
+    write_predictions(dest, ((r["id"], r["entities"]) for r in iter_records(cached)))
 
 
 def objective_factory(model_name, best):
@@ -86,32 +99,19 @@ def objective_factory(model_name, best):
         os.makedirs(out_dir, exist_ok=True)
 
         # TRAIN
-        run(
-            f"python src/train.py "
+        train(
+            out_dir,
             f"--model_name {model_name} "
             f"--train {TRAIN} --dev {DEV} "
-            f"--out_dir {out_dir} "
             f"--batch_size {batch_size} --epochs {epochs} "
             f"--lr {lr} --max_length 256 --device cpu"
         )
 
-        # PREDICT
+        # PREDICT + EVAL (in-process, cached by weights and data hash)
         pred_file = os.path.join(out_dir, "dev_pred.json")
-        run(
-            f"python src/predict.py "
-            f"--model_dir {out_dir} "
-            f"--input {DEV} "
-            f"--output {pred_file} "
-            f"--device cpu"
-        )
-
-        # EVAL
-        out = run(
-            f"python src/eval_span_f1.py "
-            f"--gold {DEV} "
-            f"--pred {pred_file}"
-        )
-        f1 = extract_f1(out)
+        with ReportCard(out_dir) as rc:
+            f1 = rc.metrics(DEV)["macro_f1"]
+            copy_predictions(rc.predictions(DEV), pred_file)
 
         print(f"→ F1 = {f1:.3f}")
 
@@ -175,44 +175,22 @@ def main():
     )
     os.makedirs(final_out, exist_ok=True)
 
-    run(
-        f"python src/train.py "
+    train(
+        final_out,
         f"--model_name {best['model']} "
         f"--train {TRAIN} --dev {DEV} "
-        f"--out_dir {final_out} "
         f"--batch_size {best['batch_size']} "
         f"--epochs {best['epochs']} "
         f"--lr {best['lr']} "
         f"--max_length 256 --device cpu"
     )
 
-    # FINAL TEST PREDICTIONS
+    # FINAL TEST PREDICTIONS + LATENCY
     final_test_file = os.path.join(final_out, "test_pred.json")
-    run(
-        f"python src/predict.py "
-        f"--model_dir {final_out} "
-        f"--input {TEST} "
-        f"--output {final_test_file} "
-        f"--device cpu"
-    )
-
-    # LATENCY
-    out = run(
-        f"python src/measure_latency.py "
-        f"--model_dir {final_out} "
-        f"--input {DEV} "
-        f"--runs 50 --device cpu"
-    )
-
-    latency = {
-        "p50": None,
-        "p95": None
-    }
-    for line in out.split("\n"):
-        if "p50:" in line:
-            latency["p50"] = float(line.split(":")[1].replace("ms", ""))
-        if "p95:" in line:
-            latency["p95"] = float(line.split(":")[1].replace("ms", ""))
+    with ReportCard(final_out) as rc:
+        copy_predictions(rc.predictions(TEST), final_test_file)
+        lat = rc.latency(DEV, runs=50)
+    latency = {"p50": lat["p50_ms"], "p95": lat["p95_ms"]}
 
     # FINAL SUBMISSION
     payload = {
@@ -0,0 +1,150 @@
+import random
+import argparse
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from data_io import RecordWriter, iter_records
+from dataset import align_labels, write_sample_weights
+from labels import LABEL2ID, LABELS
+
+
+def fast_tagger_scores(path: str, records: Sequence[dict], epochs: int = 2, seed: int = 0) -> Dict[str, np.ndarray]:
+    """Per-utterance mean word loss and worst-word margin from a briefly trained FastTagger.
+
+    Few epochs on purpose: early in training the loss still separates hard examples from
+    ones the model already gets for free.
+    """
+    from fast_tagger import tokenize, train_fast_tagger
+
+    tagger = train_fast_tagger(path, epochs=epochs, seed=seed)
+    loss = np.zeros(len(records), dtype=np.float64)
+    margin = np.ones(len(records), dtype=np.float64)
+    for i, obj in enumerate(records):
+        words, offsets = tokenize(obj["text"])
+        if not words:
+            continue
+        y = np.asarray(align_labels(obj["text"], obj.get("entities") or [], offsets, LABEL2ID))
+        _, probs = tagger.predict_proba(obj["text"])
+        loss[i], margin[i] = _loss_margin(probs, y)
+    return {"loss": loss, "margin": margin}
+
+
+def model_scores(model_dir: str, path: str, batch_size: int = 32, max_length: int = 256,
+                 device: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """The same scores from a (briefly trained) transformer checkpoint, over its subword tokens."""
+    import torch
+    from dataset import PIIDataset, collate_batch
+    from loading import load_model, load_tokenizer, resolve_device
+    from normalizer import uses_normalizer
+
+    device = resolve_device(device)
+    tokenizer = load_tokenizer(model_dir)
+    model = load_model(model_dir, device=device)
+    ds = PIIDataset(path, tokenizer, LABELS, max_length=max_length, normalize=uses_normalizer(model_dir))
+    loss = np.zeros(len(ds), dtype=np.float64)
+    margin = np.ones(len(ds), dtype=np.float64)
+    with torch.inference_mode():
+        for b in range(0, len(ds), batch_size):
+            batch = collate_batch(ds.items[b:b + batch_size], pad_token_id=tokenizer.pad_token_id)
+            logits = model(input_ids=torch.tensor(batch["input_ids"], device=device),
+                           attention_mask=torch.tensor(batch["attention_mask"], device=device)).logits
+            probs = torch.softmax(logits.float(), dim=-1).cpu().numpy()
+            for j, labels in enumerate(batch["labels"]):
+                y = np.asarray(labels)
+                keep = y != -100
+                loss[b + j], margin[b + j] = _loss_margin(probs[j][keep], y[keep])
+    return {"loss": loss, "margin": margin}
+
+
+def _loss_margin(probs: np.ndarray, y: np.ndarray):
+    if len(y) == 0:
+        return 0.0, 1.0
+    rows = np.arange(len(y))
+    p_gold = probs[rows, y]
+    other = probs.copy()
+    other[rows, y] = -1.0
+    return float(-np.log(p_gold + 1e-12).mean()), float((p_gold - other.max(axis=1)).min())
+
+
+def select(hardness: np.ndarray, fraction: float, hard_share: float = 0.5, skip_hardest: float = 0.0,
+           clusters: Optional[Sequence[int]] = None, seed: int = 0) -> List[int]:
+    """Indices of the kept utterances: the hardest ones plus a diverse random fill.
+
+    `hardness` is higher for harder utterances. The top `skip_hardest` fraction is never
+    taken by the scored share (at that extreme the loss mostly flags label noise). The random
+    fill takes at most one utterance per near-duplicate cluster before repeating any.
+    """
+    n = len(hardness)
+    k = min(n, int(round(fraction * n)))
+    order = np.argsort(-hardness, kind="stable")
+    skip = int(round(skip_hardest * n))
+    hard = [int(i) for i in order[skip:skip + int(round(hard_share * k))]]
+    chosen = set(hard)
+
+    rng = random.Random(seed)
+    rest = [i for i in range(n) if i not in chosen]
+    rng.shuffle(rest)
+    if clusters is not None:
+        covered = {clusters[i] for i in chosen}
+        first, repeats = [], []
+        for i in rest:
+            (repeats if clusters[i] in covered else first).append(i)
+            covered.add(clusters[i])
+        rest = first + repeats
+    return sorted(hard + rest[:k - len(hard)])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Score training utterances with a proxy model and keep the most useful")
+    ap.add_argument("--train", default="data/train.jsonl")
+    ap.add_argument("--proxy", default="fast", help="'fast' (hashed n-gram tagger) or a model dir")
+    ap.add_argument("--proxy_epochs", type=int, default=2, help="with --proxy fast")
+    ap.add_argument("--score", choices=["loss", "margin"], default="loss")
+    ap.add_argument("--fraction", type=float, default=0.5, help="share of the training set to keep")
+    ap.add_argument("--hard_share", type=float, default=0.5, help="share of the kept set taken by score")
+    ap.add_argument("--prefer", choices=["hard", "easy"], default="hard",
+                    help="take the highest- or lowest-scoring utterances first (easy tends to win on small data)")
+    ap.add_argument("--skip_hardest", type=float, default=0.0, help="ignore this top share as likely label noise")
+    ap.add_argument("--no_diversity", action="store_true", help="plain random fill, ignoring near-duplicate clusters")
+    ap.add_argument("--out", default=None, help="write the kept utterances here")
+    ap.add_argument("--weights_out", default=None, help="or write weights (1 kept / --floor_weight dropped)")
+    ap.add_argument("--floor_weight", type=float, default=0.0)
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    if not args.out and not args.weights_out:
+        ap.error("give --out and/or --weights_out")
+
+    records = list(iter_records(args.train))
+    if args.proxy == "fast":
+        scores = fast_tagger_scores(args.train, records, epochs=args.proxy_epochs, seed=args.seed)
+    else:
+        scores = model_scores(args.proxy, args.train, device=args.device)
+    hardness = scores["loss"] if args.score == "loss" else -scores["margin"]
+    if args.prefer == "easy":
+        hardness = -hardness
+
+    clusters = None
+    if not args.no_diversity:
+        from dedup import MinHashIndex
+
+        clusters = [c for _, c, _ in MinHashIndex().cluster(records)]
+    keep = select(hardness, args.fraction, args.hard_share, args.skip_hardest, clusters, seed=args.seed)
+    print(f"Keeping {len(keep)}/{len(records)} utterances (mean {args.score} kept "
+          f"{scores[args.score][keep].mean():.3f} vs all {scores[args.score].mean():.3f})")
+
+    if args.out:
+        with RecordWriter(args.out) as w:
+            for i in keep:
+                w.write(records[i])
+        print(f"Wrote {w.count} utterances to {args.out}")
+    if args.weights_out:
+        kept = set(keep)
+        write_sample_weights(args.weights_out, ((r["id"], 1.0 if i in kept else args.floor_weight)
+                                                for i, r in enumerate(records)))
+        print(f"Wrote weights to {args.weights_out}")
+
+
+if __name__ == "__main__":
+    main()
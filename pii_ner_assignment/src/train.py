@@ -1,19 +1,41 @@
 import os
+import sys
+import json
+import math
+import time
 import argparse
+import itertools
+import tempfile
 import torch
-from torch.utils.data import DataLoader
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import ConcatDataset, DataLoader, DistributedSampler, RandomSampler, WeightedRandomSampler
 from tqdm import tqdm
 from transformers import AutoTokenizer, get_linear_schedule_with_warmup
 
-from dataset import PIIDataset, collate_batch
+from checkpointing import (CHECKPOINT_DIR, AsyncCheckpointer, latest_checkpoint, load_checkpoint, rng_state,
+                           set_rng_state)
+from dataset import (PIIDataset, ResumableSampler, ShardedTokenDataset, collate_batch, load_sample_weights,
+                     vocab_hash)
 from labels import LABELS
-from model import create_model
+from model import create_early_exit_model, create_model
+from early_exit import has_early_exit, load_early_exit
+from normalizer import NORMALIZER_NAME, save_preprocessing, uses_normalizer
+from warm_start import (compare_to_parent, continued_schedule, load_training_state, sample_replay,
+                        save_training_state)
 
 
 def parse_args():
     ap = argparse.ArgumentParser()
     ap.add_argument("--model_name", default="distilbert-base-uncased")
     ap.add_argument("--train", default="data/train.jsonl")
+    ap.add_argument("--train_shards", default=None,
+                    help="directory of pre-tokenized shards (improved_data_generation.py --tokenizer)")
+    ap.add_argument("--shuffle_buffer", type=int, default=10000)
+    ap.add_argument("--sample_weights", default=None,
+                    help="per-id sampling weights (dedup.py / select_data.py); an epoch draws sum(weights) examples")
+    ap.add_argument("--num_workers", type=int, default=0)
+    ap.add_argument("--seed", type=int, default=42)
     ap.add_argument("--dev", default="data/dev.jsonl")
     ap.add_argument("--out_dir", default="out")
     ap.add_argument("--batch_size", type=int, default=8)
@@ -21,56 +43,279 @@ def parse_args():
     ap.add_argument("--lr", type=float, default=5e-5)
     ap.add_argument("--max_length", type=int, default=256)
     ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    ap.add_argument("--init_from", default=None,
+                    help="warm-start from an existing output dir (weights, optimizer state, preprocessing)")
+    ap.add_argument("--replay", default=None, help="with --init_from: old training data to replay from")
+    ap.add_argument("--replay_ratio", type=float, default=1.0,
+                    help="replayed old examples per new example in --train")
+    ap.add_argument("--max_precision_drop", type=float, default=0.01,
+                    help="with --init_from: allowed dev PII precision drop vs. the parent")
+    ap.add_argument("--normalize", action="store_true",
+                    help="collapse spoken digits / emails before tokenizing (recorded in preprocessing.json)")
+    ap.add_argument("--early_exit", action="store_true",
+                    help="train extra classifier heads on intermediate layers (see early_exit.py)")
+    ap.add_argument("--exit_layers", default=None, help="comma-separated layers with an exit head (default: all)")
+    ap.add_argument("--distill_alpha", type=float, default=0.5,
+                    help="weight of self-distillation vs. gold labels in the exit-head losses")
+    ap.add_argument("--distill_temperature", type=float, default=2.0)
+    ap.add_argument("--max_steps", type=int, default=None, help="stop after this many optimizer steps")
+    ap.add_argument("--stats_out", default=None,
+                    help="where to write throughput stats (default: <out_dir>/train_stats.json)")
+    ap.add_argument("--checkpoint_every", type=int, default=0,
+                    help=f"write a resumable checkpoint to <out_dir>/{CHECKPOINT_DIR} every N steps (0 = off)")
+    ap.add_argument("--keep_checkpoints", type=int, default=3, help="newest checkpoints to keep")
+    ap.add_argument("--resume", nargs="?", const="latest", default=None,
+                    help="continue from the newest checkpoint in --out_dir (or this checkpoint file/dir); "
+                         "starts from scratch when there is none")
     return ap.parse_args()
 
 
+def _all_reduce(value: float, op=None) -> float:
+    if not dist.is_initialized():
+        return value
+    t = torch.tensor([value], dtype=torch.float64)
+    dist.all_reduce(t, op=op or dist.ReduceOp.SUM)
+    return t.item()
+
+
+def _all_gather(obj) -> list:
+    if not dist.is_initialized():
+        return [obj]
+    out = [None] * dist.get_world_size()
+    dist.all_gather_object(out, obj)
+    return out
+
+
+def _find_checkpoint(resume: str, out_dir: str):
+    if resume == "latest":
+        return latest_checkpoint(os.path.join(out_dir, CHECKPOINT_DIR))
+    return latest_checkpoint(resume) if os.path.isdir(resume) else resume
+
+
 def main():
     args = parse_args()
+    # set by launch.py (or torchrun); one process per rank, gradients all-reduced over gloo
+    rank = int(os.environ.get("RANK", 0))
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size > 1:
+        dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    is_main = rank == 0
+    torch.manual_seed(args.seed)
     os.makedirs(args.out_dir, exist_ok=True)
 
-    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
-    train_ds = PIIDataset(args.train, tokenizer, LABELS, max_length=args.max_length, is_train=True)
+    if args.init_from:
+        # the child must see inputs exactly as the parent did
+        args.normalize = args.normalize or uses_normalizer(args.init_from)
+        args.early_exit = args.early_exit or has_early_exit(args.init_from)
+    tokenizer = AutoTokenizer.from_pretrained(args.init_from or args.model_name)
+    if args.train_shards and args.normalize:
+        raise ValueError("--normalize applies to --train JSONL; token shards are already tokenized")
+    if args.train_shards:
+        train_ds = ShardedTokenDataset(args.train_shards, shuffle_buffer=args.shuffle_buffer, seed=args.seed,
+                                       rank=rank, world_size=world_size)
+        if train_ds.meta["label_list"] != LABELS:
+            raise ValueError(f"{args.train_shards} was written with a different label list")
+        # shards written before the vocab hash was recorded can only be checked by pad id
+        expected = train_ds.meta.get("vocab_hash")
+        if (vocab_hash(tokenizer) != expected if expected else
+                train_ds.meta["pad_token_id"] != tokenizer.pad_token_id):
+            raise ValueError(f"{args.train_shards} was tokenized with {train_ds.meta['tokenizer']}, whose vocab "
+                             f"differs from {args.init_from or args.model_name}'s; re-run "
+                             f"improved_data_generation.py --tokenizer {args.init_from or args.model_name}")
+    else:
+        train_ds = PIIDataset(args.train, tokenizer, LABELS, max_length=args.max_length, is_train=True,
+                              normalize=args.normalize)
+        if args.init_from and args.replay:
+            # every rank draws the same seeded sample into its own scratch file, which is read
+            # into memory right away; nothing is left in out_dir
+            with tempfile.TemporaryDirectory(prefix="pii-replay-") as tmp:
+                replay_path = os.path.join(tmp, "replay.jsonl")
+                n_replay = sample_replay(args.replay, int(round(args.replay_ratio * len(train_ds))), replay_path,
+                                         seed=args.seed)
+                replay_ds = PIIDataset(replay_path, tokenizer, LABELS, max_length=args.max_length, is_train=True,
+                                       normalize=args.normalize)
+            if is_main:
+                print(f"Fine-tuning on {len(train_ds)} new + {n_replay} replayed examples")
+            train_ds = ConcatDataset([train_ds, replay_ds])
 
+    # every epoch's order is fixed by (seed, epoch) so a checkpoint can resume mid-epoch
+    sampler = None
+    generator = torch.Generator()
+    if args.sample_weights:
+        if args.train_shards or world_size > 1:
+            raise ValueError("--sample_weights needs --train JSONL and a single process")
+        weights = load_sample_weights(args.sample_weights)
+        parts = train_ds.datasets if isinstance(train_ds, ConcatDataset) else [train_ds]
+        # ids missing from the file (e.g. replayed examples) keep weight 1
+        per_item = [weights.get(item["id"], 1.0) for part in parts for item in part.items]
+        sampler = WeightedRandomSampler(per_item, num_samples=max(1, int(round(sum(per_item)))),
+                                        replacement=True, generator=generator)
+    elif world_size > 1 and not args.train_shards:
+        sampler, generator = DistributedSampler(train_ds, num_replicas=world_size, rank=rank, shuffle=True,
+                                                seed=args.seed), None
+    elif not args.train_shards:
+        sampler = RandomSampler(train_ds, generator=generator)
+    n_epoch = sampler.num_samples if isinstance(sampler, WeightedRandomSampler) else len(train_ds)
+    if sampler is not None:
+        sampler = ResumableSampler(sampler, generator, seed=args.seed)
     train_dl = DataLoader(
         train_ds,
         batch_size=args.batch_size,
-        shuffle=True,
+        sampler=sampler,
+        num_workers=args.num_workers,
         collate_fn=lambda b: collate_batch(b, pad_token_id=tokenizer.pad_token_id),
+        # each epoch's iterator draws a seed; keep that off the global RNG that dropout uses
+        generator=torch.Generator().manual_seed(args.seed),
     )
+    if args.train_shards:
+        # every DataLoader worker ends an epoch on its own partial batch, and ranks hold different
+        # shards but must run the same number of all-reduces: stop each epoch at the shortest rank
+        epoch_batches = [int(_all_reduce(train_ds.local_batches(e, args.batch_size, args.num_workers),
+                                         dist.ReduceOp.MIN)) for e in range(args.epochs)]
+    else:
+        epoch_batches = [math.ceil(n_epoch / (args.batch_size * world_size))] * args.epochs
 
-    model = create_model(args.model_name)
+    if args.init_from:
+        model = create_model(args.init_from)
+        if args.early_exit:
+            model = load_early_exit(args.init_from, model)
+            model.distill_alpha, model.temperature = args.distill_alpha, args.distill_temperature
+    elif args.early_exit:
+        exit_layers = [int(x) for x in args.exit_layers.split(",")] if args.exit_layers else None
+        model = create_early_exit_model(args.model_name, exit_layers, distill_alpha=args.distill_alpha,
+                                        temperature=args.distill_temperature)
+    else:
+        model = create_model(args.model_name)
     model.to(args.device)
     model.train()
+    # DDP broadcasts rank 0's weights on construction, so every rank starts identical
+    ddp = DistributedDataParallel(model) if world_size > 1 else model
 
     optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr)
-    total_steps = len(train_dl) * args.epochs
-    scheduler = get_linear_schedule_with_warmup(
-        optimizer, num_warmup_steps=int(0.1 * total_steps), num_training_steps=total_steps
-    )
+    state = load_training_state(args.init_from) if args.init_from else None
+    if state is not None:
+        try:
+            optimizer.load_state_dict(state["optimizer"])
+        except ValueError as e:
+            print(f"Not restoring optimizer state from {args.init_from}: {e}")
+            state = None
+        for group in optimizer.param_groups:
+            group["lr"] = group["initial_lr"] = args.lr
+    total_steps = sum(epoch_batches)
+    if args.max_steps:
+        total_steps = min(total_steps, args.max_steps)
+    # a parent stopped mid-schedule continues its decay over this run's steps instead of re-warming
+    scheduler = continued_schedule(optimizer, state, total_steps) if state is not None else None
+    if scheduler is None:
+        scheduler = get_linear_schedule_with_warmup(
+            optimizer, num_warmup_steps=int(0.1 * total_steps), num_training_steps=total_steps
+        )
+    step = 0
+    examples = 0
+    start_epoch, skip, resume_loss = 0, 0, 0.0
+    ckpt_path = _find_checkpoint(args.resume, args.out_dir) if args.resume else None
+    if args.resume and ckpt_path is None and is_main:
+        print(f"No checkpoint to resume from in {args.out_dir}; starting from scratch")
+    if ckpt_path is not None:
+        ckpt = load_checkpoint(ckpt_path)
+        for key, value in (("world_size", world_size), ("batch_size", args.batch_size), ("total_steps", total_steps)):
+            if ckpt[key] != value:
+                raise ValueError(f"{ckpt_path} was written with {key}={ckpt[key]}, this run has {value}")
+        model.load_state_dict(ckpt["model"])
+        optimizer.load_state_dict(ckpt["optimizer"])
+        scheduler.load_state_dict(ckpt["scheduler"])
+        step = ckpt["step"]
+        start_epoch, skip = ckpt["epoch"], ckpt["batch_in_epoch"]
+        resume_loss = ckpt["ranks"][rank]["running_loss"]
+        set_rng_state(ckpt["ranks"][rank]["rng"])
+        if is_main:
+            print(f"Resuming from {ckpt_path} (step {step}/{total_steps}, epoch {start_epoch + 1}, batch {skip})")
+        del ckpt
+    checkpointer = None
+    if args.checkpoint_every and is_main:
+        checkpointer = AsyncCheckpointer(os.path.join(args.out_dir, CHECKPOINT_DIR), keep=args.keep_checkpoints)
+    started = time.perf_counter()
 
-    for epoch in range(args.epochs):
-        running_loss = 0.0
-        for batch in tqdm(train_dl, desc=f"Epoch {epoch+1}/{args.epochs}"):
+    for epoch in range(start_epoch, args.epochs):
+        if step >= total_steps:
+            break
+        if epoch != start_epoch:
+            skip, resume_loss = 0, 0.0
+        if args.train_shards:
+            train_ds.set_epoch(epoch, skip, args.batch_size)
+        else:
+            sampler.set_epoch(epoch, skip * args.batch_size)
+        epoch_steps = max(0, min(epoch_batches[epoch] - skip, total_steps - step))
+        running_loss = resume_loss
+        n_batches = skip
+        for batch in tqdm(itertools.islice(train_dl, epoch_steps), initial=skip, total=skip + epoch_steps,
+                          desc=f"Epoch {epoch+1}/{args.epochs}", disable=not is_main):
             input_ids = torch.tensor(batch["input_ids"], device=args.device)
             attention_mask = torch.tensor(batch["attention_mask"], device=args.device)
             labels = torch.tensor(batch["labels"], device=args.device)
 
-            outputs = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
+            outputs = ddp(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
             loss = outputs.loss
 
             optimizer.zero_grad()
             loss.backward()
             optimizer.step()
             scheduler.step()
+            step += 1
+            n_batches += 1
+            examples += len(batch["input_ids"])
 
             running_loss += loss.item()
 
-        avg_loss = running_loss / max(1, len(train_dl))
-        print(f"Epoch {epoch+1} average loss: {avg_loss:.4f}")
+            if args.checkpoint_every and step % args.checkpoint_every == 0 and step < total_steps:
+                # every rank has its own dropout RNG and loss sum
+                ranks = _all_gather({"rng": rng_state(), "running_loss": running_loss})
+                if checkpointer is not None:
+                    checkpointer.save(step, {
+                        "model": model.state_dict(), "optimizer": optimizer.state_dict(),
+                        "scheduler": scheduler.state_dict(), "step": step, "epoch": epoch,
+                        "batch_in_epoch": n_batches, "ranks": ranks,
+                        "total_steps": total_steps, "batch_size": args.batch_size, "world_size": world_size,
+                        "args": vars(args),
+                    })
+
+        avg_loss = _all_reduce(running_loss / max(1, n_batches)) / world_size
+        if is_main:
+            print(f"Epoch {epoch+1} average loss: {avg_loss:.4f}")
+
+    seconds = time.perf_counter() - started
+    examples = int(_all_reduce(examples))
+    if checkpointer is not None:
+        checkpointer.close()
+        if checkpointer.written:
+            print(f"Wrote {checkpointer.written} checkpoint(s): "
+                  f"{1000 * checkpointer.snapshot_s / checkpointer.written:.0f} ms each on the training thread, "
+                  f"{1000 * checkpointer.write_s / checkpointer.written:.0f} ms in the background")
+    if is_main:
+        model.save_pretrained(args.out_dir)
+        tokenizer.save_pretrained(args.out_dir)
+        save_preprocessing(args.out_dir, NORMALIZER_NAME if args.normalize else None)
+        save_training_state(args.out_dir, optimizer, scheduler, step, total_steps)
+        stats = {"world_size": world_size, "steps": step, "examples": examples, "seconds": seconds,
+                 "examples_per_s": examples / seconds if seconds > 0 else 0.0,
+                 "global_batch_size": args.batch_size * world_size}
+        with open(args.stats_out or os.path.join(args.out_dir, "train_stats.json"), "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2)
+        print(f"Saved model + tokenizer to {args.out_dir} "
+              f"({examples} examples in {seconds:.1f}s, {stats['examples_per_s']:.1f}/s on {world_size} process(es))")
+    if dist.is_initialized():
+        dist.barrier()
+        dist.destroy_process_group()
 
-    model.save_pretrained(args.out_dir)
-    tokenizer.save_pretrained(args.out_dir)
-    print(f"Saved model + tokenizer to {args.out_dir}")
+    if args.init_from and is_main:
+        result = compare_to_parent(args.init_from, args.out_dir, args.dev, args.max_precision_drop,
+                                   device=args.device, extra={"new_data": args.train, "replay": args.replay})
+        p, c = result["parent_metrics"], result["metrics"]
+        print(f"Dev PII precision: parent {p['pii_precision']:.3f} -> {c['pii_precision']:.3f} "
+              f"(recall {p['pii_recall']:.3f} -> {c['pii_recall']:.3f})")
+        if not result["passed"]:
+            print(f"PII precision dropped by more than {args.max_precision_drop}; see {args.out_dir}/lineage.json")
+            sys.exit(1)
 
 
 if __name__ == "__main__":
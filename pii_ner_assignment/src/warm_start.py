@@ -0,0 +1,99 @@
+import os
+import json
+import random
+from typing import Any, Dict, Optional
+
+from data_io import iter_records
+
+TRAINING_STATE = "training_state.pt"
+LINEAGE_FILE = "lineage.json"
+
+
+def sample_replay(path: str, n: int, out_path: str, seed: int = 0) -> int:
+    """Reservoir-samples n records of an old training file into out_path (JSONL); returns how many were kept."""
+    rng = random.Random(seed)
+    reservoir = []
+    seen = 0
+    for obj in iter_records(path):
+        seen += 1
+        if len(reservoir) < n:
+            reservoir.append(obj)
+        else:
+            j = rng.randrange(seen)
+            if j < n:
+                reservoir[j] = obj
+    with open(out_path, "w", encoding="utf-8") as f:
+        for obj in reservoir:
+            f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    return len(reservoir)
+
+
+def save_training_state(out_dir: str, optimizer, scheduler, step: int, total_steps: int):
+    import torch
+
+    torch.save({"optimizer": optimizer.state_dict(), "scheduler": scheduler.state_dict(),
+                "step": step, "total_steps": total_steps}, os.path.join(out_dir, TRAINING_STATE))
+
+
+def load_training_state(model_dir: str) -> Optional[Dict[str, Any]]:
+    import torch
+
+    path = os.path.join(model_dir, TRAINING_STATE)
+    if not os.path.exists(path):
+        return None
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def continued_schedule(optimizer, state: Dict[str, Any], total_steps: int):
+    """A LambdaLR that picks up the parent's linear decay where it stopped and stretches the rest over total_steps.
+
+    The parent's scheduler state is not restored: its step counts refer to the parent's own
+    schedule, and applied to this run's optimizer they give the wrong rate (or 0 once past
+    the parent's end). Returns None when the parent finished its schedule or never got past
+    warmup, so the caller warms up from scratch.
+    """
+    from torch.optim.lr_scheduler import LambdaLR
+
+    parent_total, parent_step = state["total_steps"], state["step"]
+    warmup = int(0.1 * parent_total)
+    if not warmup <= parent_step < parent_total:
+        return None
+    start = (parent_total - parent_step) / max(1, parent_total - warmup)
+    return LambdaLR(optimizer, lambda step: start * max(0.0, 1.0 - step / max(1, total_steps)))
+
+
+def pii_metrics(model_dir: str, dev_path: str, device: Optional[str] = None) -> Dict[str, float]:
+    from eval_span_f1 import SpanCounter, summarize
+    from recognizer import PIIRecognizer
+
+    counter = SpanCounter()
+    with PIIRecognizer(model_dir, device=device, use_tuning_profile=False, use_thresholds=False) as recognizer:
+        records = list(iter_records(dev_path))
+        for i in range(0, len(records), 32):
+            chunk = records[i:i + 32]
+            preds = recognizer.predict_batch([r["text"] for r in chunk])
+            for r, ents in zip(chunk, preds):
+                counter.add([(e["start"], e["end"], e["label"]) for e in r.get("entities") or []],
+                            [(e["start"], e["end"], e["label"]) for e in ents])
+    report = summarize(counter.finish())
+    return {"pii_precision": report["pii"]["precision"], "pii_recall": report["pii"]["recall"],
+            "pii_f1": report["pii"]["f1"], "macro_f1": report["macro_f1"]}
+
+
+def compare_to_parent(parent_dir: str, child_dir: str, dev_path: str, max_precision_drop: float = 0.01,
+                      device: Optional[str] = None, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Scores parent and child on dev and records the result in the child's lineage.json."""
+    parent = pii_metrics(parent_dir, dev_path, device)
+    child = pii_metrics(child_dir, dev_path, device)
+    result = {
+        "parent": os.path.abspath(parent_dir),
+        "dev": dev_path,
+        "parent_metrics": parent,
+        "metrics": child,
+        "max_precision_drop": max_precision_drop,
+        "passed": child["pii_precision"] >= parent["pii_precision"] - max_precision_drop,
+        **(extra or {}),
+    }
+    with open(os.path.join(child_dir, LINEAGE_FILE), "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    return result
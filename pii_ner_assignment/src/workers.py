@@ -0,0 +1,240 @@
+import gc
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import traceback
+import multiprocessing as mp
+from typing import Any, Dict, List, Optional
+
+from data_io import iter_records, write_predictions
+
+
+def memory_usage(pid: int) -> Dict[str, float]:
+    """RSS / PSS plus unique (private) vs shared memory of a process, in MiB, from smaps_rollup."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1]) / 1024.0
+    return {
+        "pid": pid,
+        "rss_mb": fields.get("Rss", 0.0),
+        "pss_mb": fields.get("Pss", 0.0),
+        "unique_mb": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0),
+        "shared_mb": fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0),
+    }
+
+
+def _serve(recognizer, num_threads, requests, results):
+    import torch
+
+    torch.set_num_threads(num_threads)
+    results.put(("ready", os.getpid(), None))
+    while True:
+        job = requests.get()
+        if job is None:
+            break
+        job_id, texts = job
+        try:
+            results.put((job_id, recognizer.predict_batch(texts), None))
+        except Exception as e:  # report to the caller instead of silently losing the worker
+            results.put((job_id, None, repr(e)))
+
+
+def _load_and_serve(model_dir, recognizer_kwargs, num_threads, requests, results):
+    from recognizer import PIIRecognizer
+
+    try:
+        recognizer = PIIRecognizer(model_dir, **recognizer_kwargs)
+    except Exception:  # the parent is waiting for "ready"; tell it why it won't come
+        results.put(("failed", os.getpid(), traceback.format_exc()))
+        return
+    _serve(recognizer, num_threads, requests, results)
+
+
+class WorkerPool:
+    """N inference processes serving one checkpoint.
+
+    With `share=True` the parent loads the model and tokenizer once and forks the workers,
+    so the weights are shared copy-on-write (safetensors checkpoints are memory-mapped as
+    well); the parent never runs inference, which keeps torch's thread pools fork-safe.
+    With `share=False` every worker is spawned and loads its own copy, for comparison.
+    A worker that fails to load, dies or is not ready within `startup_timeout` seconds
+    makes the constructor raise RuntimeError with the worker's error.
+    """
+
+    def __init__(self, model_dir: str, n_workers: int = 2, share: bool = True, num_threads: Optional[int] = None,
+                 startup_timeout: float = 300.0, **recognizer_kwargs):
+        self.model_dir = model_dir
+        self.n_workers = n_workers
+        self.share = share
+        self.num_threads = num_threads or max(1, (os.cpu_count() or 1) // n_workers)
+        self.recognizer = None
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+        recognizer_kwargs.setdefault("use_tuning_profile", False)
+        if share:
+            from recognizer import PIIRecognizer
+
+            ctx = mp.get_context("fork")
+            self.recognizer = PIIRecognizer(model_dir, **recognizer_kwargs)
+            # keep the collector from writing to (and so un-sharing) every inherited object
+            gc.collect()
+            gc.freeze()
+        else:
+            ctx = mp.get_context("spawn")
+        self.requests = ctx.Queue()
+        self.results = ctx.Queue()
+        self.procs = []
+        for _ in range(n_workers):
+            if share:
+                p = ctx.Process(target=_serve, args=(self.recognizer, self.num_threads, self.requests, self.results),
+                                daemon=True)
+            else:
+                p = ctx.Process(target=_load_and_serve, args=(model_dir, recognizer_kwargs, self.num_threads,
+                                                              self.requests, self.results), daemon=True)
+            p.start()
+            self.procs.append(p)
+        try:
+            self._wait_ready(startup_timeout)
+        except BaseException:
+            self._terminate()
+            raise
+        finally:
+            if share:
+                gc.unfreeze()
+
+    def _get_result(self, deadline: Optional[float], during: str):
+        """Next message from the workers; raises instead of blocking if one died or `deadline` passed."""
+        while True:
+            wait = 1.0 if deadline is None else min(1.0, max(0.0, deadline - time.monotonic()))
+            try:
+                return self.results.get(timeout=wait)
+            except queue.Empty:
+                dead = [p for p in self.procs if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(f"worker {dead[0].pid} exited with code {dead[0].exitcode} {during}")
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise RuntimeError(f"timed out {during}")
+
+    def _wait_ready(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        for ready in range(self.n_workers):
+            tag, pid, err = self._get_result(deadline, f"during startup ({ready} of {self.n_workers} ready)")
+            if tag != "ready":
+                raise RuntimeError(f"worker {pid} failed to start:\n{err}")
+
+    def _terminate(self):
+        for p in self.procs:
+            if p.is_alive():
+                p.terminate()
+            p.join(timeout=10)
+        if self.recognizer is not None:
+            self.recognizer.close()
+
+    def predict_batch(self, texts: List[str], chunk_size: int = 8,
+                      timeout: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+        """Raises RuntimeError if a chunk failed, a worker died or `timeout` seconds passed."""
+        with self._lock:
+            pending = {}
+            for i in range(0, len(texts), chunk_size):
+                pending[self._next_id] = i
+                self.requests.put((self._next_id, texts[i:i + chunk_size]))
+                self._next_id += 1
+            deadline = None if timeout is None else time.monotonic() + timeout
+            out = [None] * len(texts)
+            errors = []
+            # collect every chunk, failed or not, so nothing of this call is left for the next one
+            while pending:
+                job_id, ents, err = self._get_result(deadline, "while serving a request")
+                start = pending.pop(job_id, None)
+                if start is None:
+                    continue  # a late answer to a call that raised on a dead worker or timeout
+                if err is not None:
+                    errors.append(err)
+                else:
+                    out[start:start + len(ents)] = ents
+            if errors:
+                raise RuntimeError(f"worker failed: {errors[0]}")
+            return out
+
+    def memory_report(self) -> List[Dict[str, float]]:
+        return [memory_usage(p.pid) for p in self.procs]
+
+    def close(self):
+        for _ in self.procs:
+            self.requests.put(None)
+        for p in self.procs:
+            p.join(timeout=10)
+        if self.recognizer is not None:
+            self.recognizer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _available_mb() -> Optional[float]:
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run N inference workers and report unique vs shared memory")
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--output", default=None, help="optional JSON predictions, same format as predict.py")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--num_threads", type=int, default=None, help="torch threads per worker")
+    ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--no_share", action="store_true", help="load a separate copy in every worker")
+    ap.add_argument("--json_out", default=None)
+    args = ap.parse_args()
+
+    records = [(obj["id"], obj["text"]) for obj in iter_records(args.input, columns=["id", "text"])]
+
+    load_start = time.perf_counter()
+    with WorkerPool(args.model_dir, args.workers, share=not args.no_share, num_threads=args.num_threads,
+                    device="cpu", max_length=args.max_length) as pool:
+        load_s = time.perf_counter() - load_start
+        start = time.perf_counter()
+        ents = pool.predict_batch([t for _, t in records])
+        elapsed = time.perf_counter() - start
+        report = pool.memory_report()
+
+    mode = "copy per worker" if args.no_share else "shared (fork after load)"
+    print(f"{args.workers} workers, {mode}: started in {load_s:.1f} s, "
+          f"{len(records) / max(elapsed, 1e-9):.1f} utt/s")
+    print(f"{'pid':>8s} {'rss_mb':>9s} {'pss_mb':>9s} {'unique_mb':>10s} {'shared_mb':>10s}")
+    for r in report:
+        print(f"{r['pid']:8d} {r['rss_mb']:9.1f} {r['pss_mb']:9.1f} {r['unique_mb']:10.1f} {r['shared_mb']:10.1f}")
+    unique = max(r["unique_mb"] for r in report)
+    total_pss = sum(r["pss_mb"] for r in report)
+    print(f"Total PSS across workers: {total_pss:.1f} MiB; marginal cost per extra worker ~{unique:.1f} MiB")
+    available = _available_mb()
+    if available is not None and unique > 0:
+        print(f"MemAvailable {available:.0f} MiB -> room for ~{int(available // unique)} more workers")
+
+    if args.output:
+        write_predictions(args.output, ((uid, e) for (uid, _), e in zip(records, ents)))
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"workers": args.workers, "shared": not args.no_share, "memory": report,
+                       "throughput": len(records) / max(elapsed, 1e-9)}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
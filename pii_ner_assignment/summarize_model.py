@@ -1,22 +1,13 @@
-import json
-import subprocess
+"""Report card for one or more model dirs; see src/report.py.
 
-BEST_DIR = "tune_logs/nreimers_MiniLM-L6-H384-uncased_lr3.455735963606937e-05_bs8"
-DEV = "data/dev.jsonl"
-PRED = BEST_DIR + "/dev_pred.json"
+    python summarize_model.py tune_logs/<run_a> tune_logs/<run_b> --dev data/dev.jsonl
+"""
+import os
+import sys
 
-# Run eval
-eval_out = subprocess.run(
-    f"python src/eval_span_f1.py --gold {DEV} --pred {PRED}",
-    shell=True, capture_output=True, text=True
-).stdout
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
 
-# Run latency
-lat_out = subprocess.run(
-    f"python src/measure_latency.py --model_dir {BEST_DIR} --input {DEV} --runs 50 --device cpu",
-    shell=True, capture_output=True, text=True
-).stdout
+from report import main  # noqa: E402
 
-print("\n===== FULL METRICS =====")
-print(eval_out)
-print(lat_out)
+if __name__ == "__main__":
+    main()
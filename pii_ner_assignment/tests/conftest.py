@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+DEV = os.path.join(ROOT, "data", "dev.jsonl")
+sys.path.insert(0, SRC)
+
+
+def _write_tiny_bert(out_dir: str, num_layers: int = 3):
+    """A randomly initialized BERT token classifier with a vocab built from the dev texts."""
+    import torch
+    from transformers import BertConfig, BertForTokenClassification, BertTokenizerFast
+
+    from data_io import iter_records
+    from labels import ID2LABEL, LABEL2ID
+
+    words = set()
+    for obj in iter_records(DEV, columns=["text"]):
+        words.update(obj["text"].lower().split())
+    chars = {c for w in words for c in w}
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(chars) + sorted(f"##{c}" for c in chars)
+    vocab += sorted(words - set(vocab))
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = BertTokenizerFast(vocab={tok: i for i, tok in enumerate(vocab)}, do_lower_case=True)
+    tokenizer.save_pretrained(out_dir)
+
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=num_layers, num_attention_heads=2,
+                        intermediate_size=64, max_position_embeddings=512, num_labels=len(LABEL2ID),
+                        id2label=ID2LABEL, label2id=LABEL2ID)
+    model = BertForTokenClassification(config).eval()
+    # random init predicts "O" almost everywhere; sharpen the head so spans actually appear
+    with torch.no_grad():
+        model.classifier.weight.mul_(30.0)
+    return model, tokenizer
+
+
+@pytest.fixture(scope="session")
+def model_dir(tmp_path_factory):
+    out = str(tmp_path_factory.mktemp("tiny_bert"))
+    model, _ = _write_tiny_bert(out)
+    model.save_pretrained(out)
+    return out
+
+
+@pytest.fixture(scope="session")
+def dev_texts():
+    from data_io import iter_records
+
+    return [obj["text"] for obj in iter_records(DEV, columns=["text"])]
@@ -0,0 +1,62 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from checkpointing import CHECKPOINT_DIR, checkpoint_path, list_checkpoints
+from conftest import DEV, ROOT, SRC
+
+
+def _train(model_dir, train_path, out_dir, *extra):
+    cmd = [sys.executable, os.path.join(SRC, "train.py"), "--model_name", model_dir, "--train", train_path,
+           "--out_dir", out_dir, "--batch_size", "4", "--epochs", "2", "--device", "cpu", "--seed", "7", *extra]
+    r = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    assert r.returncode == 0, r.stderr[-2000:]
+    return r.stdout
+
+
+def _weights(out_dir):
+    from safetensors.torch import load_file
+
+    return load_file(os.path.join(out_dir, "model.safetensors"))
+
+
+@pytest.fixture(scope="module")
+def train_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("data") / "train.jsonl")
+    with open(DEV, "r", encoding="utf-8") as src, open(path, "w", encoding="utf-8") as dst:
+        for _, line in zip(range(40), src):
+            dst.write(line)
+    return path
+
+
+def test_resume_gives_identical_weights(model_dir, train_path, tmp_path):
+    full = str(tmp_path / "full")
+    _train(model_dir, train_path, full, "--checkpoint_every", "5", "--keep_checkpoints", "10")
+    assert len(list_checkpoints(os.path.join(full, CHECKPOINT_DIR))) == 3  # steps 5, 10, 15 of 20
+
+    # a run "preempted" after step 15: mid-way through the second epoch
+    resumed = str(tmp_path / "resumed")
+    os.makedirs(os.path.join(resumed, CHECKPOINT_DIR))
+    shutil.copy(checkpoint_path(os.path.join(full, CHECKPOINT_DIR), 15),
+                checkpoint_path(os.path.join(resumed, CHECKPOINT_DIR), 15))
+    out = _train(model_dir, train_path, resumed, "--resume")
+    assert "Resuming from" in out
+
+    a, b = _weights(full), _weights(resumed)
+    assert a.keys() == b.keys()
+    assert all(bool((a[k] == b[k]).all()) for k in a)
+
+
+def test_retention_keeps_newest(model_dir, train_path, tmp_path):
+    out_dir = str(tmp_path / "out")
+    _train(model_dir, train_path, out_dir, "--checkpoint_every", "4", "--keep_checkpoints", "2")
+    names = [os.path.basename(p) for p in list_checkpoints(os.path.join(out_dir, CHECKPOINT_DIR))]
+    assert names == ["step_00000012.pt", "step_00000016.pt"]
+
+
+def test_resume_without_checkpoint_starts_fresh(model_dir, train_path, tmp_path):
+    out = _train(model_dir, train_path, str(tmp_path / "out"), "--resume", "--max_steps", "2")
+    assert "starting from scratch" in out
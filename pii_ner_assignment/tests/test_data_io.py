@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import DEV, ROOT, SRC
+from data_io import iter_records, iter_spans, write_predictions
+
+
+def _predict(model_dir, output):
+    cmd = [sys.executable, os.path.join(SRC, "predict.py"), "--model_dir", model_dir, "--input", DEV,
+           "--output", output, "--device", "cpu", "--no_tuning_profile"]
+    r = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    assert r.returncode == 0, r.stderr[-2000:]
+
+
+@pytest.fixture(scope="module")
+def json_predictions(model_dir, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("pred") / "pred.json")
+    _predict(model_dir, path)
+    return {r["id"]: r["entities"] for r in iter_records(path)}
+
+
+@pytest.mark.parametrize("ext", [".parquet", ".arrow"])
+def test_columnar_predictions_match_json(model_dir, json_predictions, tmp_path, ext):
+    pytest.importorskip("pyarrow")
+    columnar = str(tmp_path / f"pred{ext}")
+    _predict(model_dir, columnar)
+
+    expected = json_predictions
+    got = {r["id"]: r["entities"] for r in iter_records(columnar)}
+    assert any(expected.values())
+    assert all("pii" in e for ents in expected.values() for e in ents)
+    assert got == expected
+    assert dict(iter_spans(columnar)) == {uid: [(e["start"], e["end"], e["label"]) for e in ents]
+                                          for uid, ents in expected.items()}
+
+
+def test_pii_is_derived_from_the_label_when_missing(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "pred.parquet")
+    write_predictions(path, [("a", [{"start": 0, "end": 4, "label": "PHONE"}, {"start": 5, "end": 9, "label": "CITY"}])])
+    assert [e["pii"] for e in next(iter_records(path))["entities"]] == [True, False]
@@ -0,0 +1,89 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+from conftest import _write_tiny_bert
+from early_exit import EarlyExitTokenClassifier
+from recognizer import PIIRecognizer
+
+THRESHOLD = 0.9
+
+
+@pytest.fixture(scope="module")
+def ee_dir(tmp_path_factory):
+    out = str(tmp_path_factory.mktemp("tiny_ee"))
+    model, _ = _write_tiny_bert(out)
+    ee = EarlyExitTokenClassifier(model, [1, 2])
+    torch.manual_seed(1)
+    with torch.no_grad():
+        for head in ee.heads.values():
+            head.weight.mul_(100.0)  # confident enough that some batches exit at layer 1
+    ee.save_pretrained(out)
+    return out
+
+
+@pytest.fixture(scope="module")
+def recognizer(ee_dir):
+    with PIIRecognizer(ee_dir, device="cpu", use_tuning_profile=False, max_batch_size=4,
+                       early_exit_threshold=THRESHOLD) as rec:
+        yield rec
+
+
+def test_early_path_matches_full_model_without_exits(recognizer, dev_texts):
+    ee = recognizer.model
+    enc = recognizer.tokenizer(dev_texts[:8], padding=True, return_tensors="pt")
+    threshold, ee.threshold = ee.threshold, 1.01  # no head is ever confident enough
+    try:
+        with torch.no_grad():
+            early = ee._forward_early(enc["input_ids"], enc["attention_mask"])
+            full = ee.model(input_ids=enc["input_ids"], attention_mask=enc["attention_mask"]).logits
+    finally:
+        ee.threshold = threshold
+    assert early.exit_layer.tolist() == [ee.num_layers] * len(enc["input_ids"])
+    assert torch.allclose(early.logits, full, atol=1e-5)
+
+
+def test_labels_do_not_depend_on_batch_mates(recognizer, dev_texts):
+    texts = dev_texts[:60]
+    alone = {t: recognizer.predict(t) for t in texts}
+    rng = random.Random(0)
+    chunks = [rng.sample(texts, rng.randint(1, 4)) for _ in range(120)]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(recognizer.predict_batch, chunks))
+    for chunk, ents in zip(chunks, results):
+        assert ents == [alone[t] for t in chunk]
+
+
+def test_concurrent_stats_are_exact(recognizer, dev_texts):
+    ee = recognizer.model
+    batches = [recognizer.tokenizer(dev_texts[i:i + 3], padding=True, return_tensors="pt") for i in range(0, 60, 3)]
+
+    def run(enc):
+        with torch.no_grad():
+            return ee(input_ids=enc["input_ids"], attention_mask=enc["attention_mask"]).exit_layer.tolist()
+
+    ee.reset_stats()
+    serial = [run(enc) for enc in batches]
+    assert len({l for layers in serial for l in layers}) > 1, "the fixture should exit at different layers"
+    ee.reset_stats()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        layers = list(pool.map(run, batches * 5))
+    assert layers == serial * 5
+    assert ee.rows == sum(len(l) for l in layers)
+    assert ee.layers_executed == sum(sum(l) for l in layers)
+
+
+def test_mixed_batch_exits_per_row(recognizer, dev_texts):
+    ee = recognizer.model
+    enc = recognizer.tokenizer(dev_texts[:60], padding=True, return_tensors="pt")
+    with torch.no_grad():
+        batched = ee(input_ids=enc["input_ids"], attention_mask=enc["attention_mask"])
+    assert len(set(batched.exit_layer.tolist())) > 1, "the fixture should exit at different layers"
+    for i in range(len(enc["input_ids"])):
+        n = int(enc["attention_mask"][i].sum())
+        with torch.no_grad():
+            alone = ee(input_ids=enc["input_ids"][i:i + 1, :n], attention_mask=enc["attention_mask"][i:i + 1, :n])
+        assert int(batched.exit_layer[i]) == int(alone.exit_layer[0])
+        assert torch.allclose(batched.logits[i, :n], alone.logits[0], atol=1e-4)
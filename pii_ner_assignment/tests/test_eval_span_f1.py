@@ -0,0 +1,88 @@
+import json
+import random
+from collections import defaultdict
+
+import pytest
+
+from conftest import DEV
+from data_io import iter_records, write_predictions
+from eval_span_f1 import compute_prf, evaluate
+from labels import LABELS, label_is_pii
+
+TYPES = sorted({lab.split("-", 1)[1] for lab in LABELS if lab != "O"})
+
+
+def baseline(gold, pred):
+    """The original in-memory evaluator: per-label, PII and non-PII span P/R/F1."""
+    labels = {lab for spans in gold.values() for _, _, lab in spans}
+    tp, fp, fn = defaultdict(int), defaultdict(int), defaultdict(int)
+    for uid, g in gold.items():
+        g, p = set(g), set(pred.get(uid, []))
+        for span in p:
+            (tp if span in g else fp)[span[2]] += 1
+        for span in g - p:
+            fn[span[2]] += 1
+        for kind, is_pii in (("PII", True), ("NON", False)):
+            gk = {(s, e) for s, e, lab in g if label_is_pii(lab) == is_pii}
+            pk = {(s, e) for s, e, lab in p if label_is_pii(lab) == is_pii}
+            tp[kind] += len(gk & pk)
+            fp[kind] += len(pk - gk)
+            fn[kind] += len(gk - pk)
+    f1s = [compute_prf(tp[lab], fp[lab], fn[lab])[2] for lab in sorted(labels)]
+    return {"macro_f1": sum(f1s) / max(1, len(f1s)),
+            "per_label": {lab: compute_prf(tp[lab], fp[lab], fn[lab]) for lab in labels},
+            "pii": compute_prf(tp["PII"], fp["PII"], fn["PII"]),
+            "non_pii": compute_prf(tp["NON"], fp["NON"], fn["NON"])}
+
+
+def perturb(spans, rng):
+    out = []
+    for s, e, lab in spans:
+        r = rng.random()
+        if r < 0.15:
+            continue  # missed
+        if r < 0.3:
+            s += rng.choice([-1, 1])  # boundary error
+        elif r < 0.4:
+            lab = rng.choice(TYPES)  # wrong type, maybe crossing PII / non-PII
+        out.append((s, e, lab))
+    if rng.random() < 0.2:
+        out.append((0, 3, rng.choice(TYPES)))  # spurious
+    return out
+
+
+@pytest.fixture(scope="module")
+def gold_and_pred():
+    rng = random.Random(0)
+    gold = {obj["id"]: [(e["start"], e["end"], e["label"]) for e in obj.get("entities") or []]
+            for obj in iter_records(DEV)}
+    pred = {uid: perturb(spans, rng) for uid, spans in gold.items()}
+    # an utterance the model never answered
+    pred.pop(next(iter(pred)))
+    return gold, pred
+
+
+@pytest.mark.parametrize("ext,workers", [(".json", 1), (".jsonl", 1), (".jsonl", 3)])
+def test_streaming_evaluator_matches_baseline(tmp_path, gold_and_pred, ext, workers):
+    gold, pred = gold_and_pred
+    path = str(tmp_path / f"pred{ext}")
+    write_predictions(path, ((uid, [{"start": s, "end": e, "label": lab} for s, e, lab in spans])
+                             for uid, spans in pred.items()))
+    report = evaluate(DEV, path, workers=workers)
+    expected = baseline(gold, pred)
+
+    assert report["macro_f1"] == pytest.approx(expected["macro_f1"])
+    for key in ("pii", "non_pii"):
+        m = report[key]
+        assert (m["precision"], m["recall"], m["f1"]) == pytest.approx(expected[key])
+    assert set(report["per_label"]) == set(expected["per_label"])
+    for lab, m in report["per_label"].items():
+        assert (m["precision"], m["recall"], m["f1"]) == pytest.approx(expected["per_label"][lab])
+
+
+def test_legacy_json_is_a_single_object(tmp_path, gold_and_pred):
+    _, pred = gold_and_pred
+    path = str(tmp_path / "pred.json")
+    write_predictions(path, ((uid, []) for uid in pred))
+    with open(path, "r", encoding="utf-8") as f:
+        assert set(json.load(f)) == set(pred)
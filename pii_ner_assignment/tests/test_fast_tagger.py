@@ -0,0 +1,31 @@
+import math
+
+import numpy as np
+
+from conftest import DEV
+from data_io import iter_records
+from dataset import align_labels
+from fast_tagger import tokenize, train_fast_tagger
+from labels import LABEL2ID, LABELS
+
+
+def _loss_per_word(tagger, records):
+    total, n = 0.0, 0
+    for obj in records:
+        words, offsets = tokenize(obj["text"])
+        if not words:
+            continue
+        y = np.asarray(align_labels(obj["text"], obj.get("entities") or [], offsets, LABEL2ID))
+        _, probs = tagger.predict_proba(obj["text"])
+        total -= float(np.log(probs[np.arange(len(y)), y] + 1e-12).sum())
+        n += len(y)
+    return total / n
+
+
+def test_default_training_converges():
+    records = list(iter_records(DEV))
+    one = _loss_per_word(train_fast_tagger(DEV, bits=14, epochs=1), records)
+    five = _loss_per_word(train_fast_tagger(DEV, bits=14, epochs=5), records)
+    # a uniform guess costs ln(#labels) per word; a diverging step size lands far above it
+    assert one < math.log(len(LABELS))
+    assert five < one
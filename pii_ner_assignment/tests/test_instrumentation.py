@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+import threading
+
+from conftest import DEV, ROOT, SRC, _write_tiny_bert
+from early_exit import EarlyExitTokenClassifier
+from instrumentation import STAGES, TraceSampler
+
+
+def _measure_latency(model_dir, *extra):
+    cmd = [sys.executable, os.path.join(SRC, "measure_latency.py"), "--model_dir", model_dir, "--input", DEV,
+           "--device", "cpu", "--no_tuning_profile", *extra]
+    return subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+
+
+def test_trace_sampler_runs_one_profiler_at_a_time(tmp_path):
+    sampler = TraceSampler(str(tmp_path), sample_rate=1.0, seed=0)
+    inside, release = threading.Event(), threading.Event()
+
+    def traced():
+        with sampler.maybe_trace():
+            inside.set()
+            release.wait()
+
+    t = threading.Thread(target=traced)
+    t.start()
+    inside.wait()
+    with sampler.maybe_trace():  # would start a second profiler session
+        pass
+    release.set()
+    t.join()
+
+    assert sampler.skipped == 1
+    assert len(os.listdir(tmp_path)) == 1
+    with sampler.maybe_trace():
+        pass
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_measure_latency_reads_the_recognizer_stage_metrics(model_dir, tmp_path):
+    prom = str(tmp_path / "metrics.prom")
+    r = _measure_latency(model_dir, "--runs", "7", "--metrics_out", prom)
+    assert r.returncode == 0, r.stderr[-2000:]
+    with open(prom, "r", encoding="utf-8") as f:
+        text = f.read()
+    for name in STAGES:
+        assert f'pii_ner_stage_latency_ms_count{{stage="{name}"}} 7' in text
+    assert "pii_ner_request_latency_ms_count 7" in text
+
+
+def test_measure_latency_rejects_what_the_recognizer_rejects(tmp_path):
+    out = str(tmp_path / "tiny_ee")
+    model, _ = _write_tiny_bert(out)
+    EarlyExitTokenClassifier(model, [1, 2]).save_pretrained(out)
+    r = _measure_latency(out, "--runs", "2", "--early_exit_threshold", "0.9", "--buckets", "16,32")
+    assert r.returncode != 0
+    assert "can't be bucketed" in r.stderr
@@ -0,0 +1,52 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from recognizer import PIIRecognizer
+
+
+@pytest.fixture(scope="module")
+def recognizer(model_dir):
+    with PIIRecognizer(model_dir, device="cpu", use_tuning_profile=False, max_batch_size=8) as rec:
+        yield rec
+
+
+def test_batch_matches_single(recognizer, dev_texts):
+    texts = dev_texts[:40]
+    assert recognizer.predict_batch(texts) == [recognizer.predict(t) for t in texts]
+
+
+def test_concurrent_predict_batch_matches_serial(recognizer, dev_texts):
+    texts = dev_texts[:60]
+    serial = {t: recognizer.predict(t) for t in texts}
+    rng = random.Random(0)
+    chunks = [rng.sample(texts, rng.randint(1, 6)) for _ in range(120)]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(recognizer.predict_batch, chunks))
+    mismatches = [(t, got) for chunk, res in zip(chunks, results) for t, got in zip(chunk, res) if got != serial[t]]
+    assert not mismatches
+
+
+def test_predict_async_matches_serial(recognizer, dev_texts):
+    import asyncio
+
+    texts = dev_texts[:30]
+
+    async def run():
+        return await asyncio.gather(*(recognizer.predict_async(t) for t in texts))
+
+    assert asyncio.run(run()) == [recognizer.predict(t) for t in texts]
+
+
+def test_cache_hits_are_independent_copies(model_dir, dev_texts):
+    with PIIRecognizer(model_dir, device="cpu", use_tuning_profile=False, cache_size=16) as rec:
+        text = next(t for t in dev_texts if rec.predict(t))
+        first = rec.predict(text)
+        expected = [dict(e) for e in first]
+        first[0]["label"] = "EDITED"
+        first.clear()
+        hit = rec.predict(text)
+        assert hit == expected
+        hit.append({"start": 0, "end": 1, "label": "EDITED", "pii": False})
+        assert rec.predict(text) == expected
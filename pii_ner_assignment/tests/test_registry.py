@@ -0,0 +1,92 @@
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import recognizer as recognizer_module
+from registry import ModelRegistry
+
+
+@pytest.fixture
+def registry(model_dir, tmp_path):
+    copy = str(tmp_path / "copy")
+    shutil.copytree(model_dir, copy)
+    with ModelRegistry({"a": model_dir, "b": copy}, device="cpu", use_tuning_profile=False) as reg:
+        yield reg
+
+
+def test_shared_tokenizer_shares_its_lock(registry):
+    a, b = registry.get("a"), registry.get("b")
+    assert a.tokenizer is b.tokenizer
+    assert a._tokenizer_lock is b._tokenizer_lock
+    assert [e["shared_tokenizer"] for e in registry.events if e["event"] == "load"] == [False, True]
+
+
+def test_concurrent_gets_load_once(registry):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        got = list(pool.map(lambda _: registry.get("a"), range(16)))
+    assert all(r is got[0] for r in got)
+    assert [e["model"] for e in registry.events if e["event"] == "load"] == ["a"]
+
+
+def test_loading_does_not_block_loaded_models(registry, monkeypatch):
+    registry.get("b")
+    started = threading.Event()
+    real = recognizer_module.PIIRecognizer
+
+    def slow(model_dir_, **kwargs):
+        started.set()
+        time.sleep(1.0)
+        return real(model_dir_, **kwargs)
+
+    monkeypatch.setattr(recognizer_module, "PIIRecognizer", slow)
+    loader = threading.Thread(target=registry.get, args=("a",))
+    loader.start()
+    started.wait()
+    t0 = time.perf_counter()
+    registry.predict("b", "my number is four two")
+    assert time.perf_counter() - t0 < 0.5
+    loader.join()
+    assert "a" in dict(registry._loaded)
+
+
+def test_evicting_a_model_in_use_waits_for_its_callers(registry, dev_texts, monkeypatch):
+    a = registry.get("a")
+    started, release = threading.Event(), threading.Event()
+    real = a.predict_batch
+
+    def slow(texts, *args, **kwargs):
+        started.set()
+        release.wait()
+        return real(texts, *args, **kwargs)
+
+    monkeypatch.setattr(a, "predict_batch", slow)
+    results = []
+    caller = threading.Thread(target=lambda: results.append(registry.predict_batch("a", dev_texts[:4])))
+    caller.start()
+    started.wait()
+
+    try:
+        t0 = time.perf_counter()
+        registry.evict("a")
+        registry.get("b")  # neither eviction nor other models wait for the busy caller
+        assert time.perf_counter() - t0 < 0.5
+        assert not a._executor._shutdown
+    finally:
+        release.set()
+        caller.join()
+    assert len(results[0]) == 4
+    assert a._executor._shutdown  # closed by the last lease
+
+
+def test_async_caller_keeps_an_evicted_recognizer_open(registry, dev_texts):
+    import asyncio
+
+    async def run():
+        with registry.using("a") as rec:
+            registry.evict("a")
+            return await rec.predict_async(dev_texts[0])
+
+    assert asyncio.run(run()) == registry.predict("a", dev_texts[0])
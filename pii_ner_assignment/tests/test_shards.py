@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, SRC, _write_tiny_bert
+from dataset import SHARD_META, ShardedTokenDataset
+
+sys.path.insert(0, os.path.dirname(ROOT))
+from improved_data_generation import write_token_splits  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def shard_dir(model_dir, tmp_path_factory):
+    out = str(tmp_path_factory.mktemp("gen"))
+    write_token_splits([("train", 300, True)], out, seed=0, workers=1, tokenizer_name=model_dir, shard_size=100)
+    return os.path.join(out, "train_tokens")
+
+
+def _train(model_dir, shard_dir, out_dir, *extra):
+    cmd = [sys.executable, os.path.join(SRC, "train.py"), "--model_name", model_dir, "--train_shards", shard_dir,
+           "--out_dir", out_dir, "--batch_size", "16", "--device", "cpu", *extra]
+    return subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_every_row_is_trained(model_dir, shard_dir, tmp_path, num_workers):
+    # 3 shards of 100 rows: one stream gives ceil(300 / 16) = 19 batches, two workers 13 + 7
+    ds = ShardedTokenDataset(shard_dir)
+    assert ds.local_batches(0, 16, num_workers) == (19 if num_workers == 0 else 20)
+    r = _train(model_dir, shard_dir, str(tmp_path / "out"), "--epochs", "2", "--num_workers", str(num_workers))
+    assert r.returncode == 0, r.stderr[-2000:]
+    with open(tmp_path / "out" / "train_stats.json", "r", encoding="utf-8") as f:
+        assert json.load(f)["examples"] == 2 * 300
+
+
+def test_rejects_shards_from_another_vocab(model_dir, shard_dir, tmp_path):
+    from transformers import AutoTokenizer, BertTokenizerFast
+
+    with open(os.path.join(shard_dir, SHARD_META), "r", encoding="utf-8") as f:
+        assert json.load(f)["vocab_hash"]
+    other = str(tmp_path / "other")
+    model, _ = _write_tiny_bert(other)
+    model.save_pretrained(other)
+    # same size and pad id, different ids for everything past the specials
+    words = sorted((t for t in AutoTokenizer.from_pretrained(model_dir).get_vocab() if not t.startswith("[")),
+                   reverse=True)
+    vocab = {tok: i for i, tok in enumerate(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words)}
+    BertTokenizerFast(vocab=vocab).save_pretrained(other)
+
+    r = _train(other, shard_dir, str(tmp_path / "out"), "--max_steps", "1")
+    assert r.returncode != 0
+    assert "whose vocab differs" in r.stderr
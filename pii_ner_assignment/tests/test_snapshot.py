@@ -0,0 +1,32 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from loading import build_snapshot
+from logit_cache import THRESHOLDS_FILE
+from normalizer import save_preprocessing
+from recognizer import PIIRecognizer
+
+
+@pytest.fixture(scope="module")
+def normalized_dir(model_dir, tmp_path_factory):
+    """The tiny checkpoint marked as trained on normalized text, with per-label thresholds."""
+    out = str(tmp_path_factory.mktemp("normalized"))
+    shutil.copytree(model_dir, out, dirs_exist_ok=True)
+    save_preprocessing(out)
+    with open(os.path.join(out, THRESHOLDS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"policy": "span_mean", "thresholds": {"PHONE": 0.3, "EMAIL": 0.2, "PERSON_NAME": 0.25}}, f)
+    return out
+
+
+def test_snapshot_predicts_like_its_checkpoint(normalized_dir, dev_texts, tmp_path):
+    snapshot = str(tmp_path / "snapshot")
+    build_snapshot(normalized_dir, snapshot)
+    texts = dev_texts[:40] + ["call me at nine eight seven six five four three two one zero",
+                              "mail alex dot patel at outlook dot org"]
+    with PIIRecognizer(normalized_dir, device="cpu", use_tuning_profile=False) as original, \
+            PIIRecognizer(snapshot, device="cpu", use_tuning_profile=False) as snap:
+        assert snap.normalize and snap.thresholds is not None
+        assert snap.predict_batch(texts) == original.predict_batch(texts)
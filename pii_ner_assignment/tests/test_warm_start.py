@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import torch
+
+from conftest import DEV, ROOT, SRC
+from warm_start import LINEAGE_FILE, continued_schedule
+
+
+def _lrs(scheduler, optimizer, steps):
+    out = []
+    for _ in range(steps):
+        out.append(optimizer.param_groups[0]["lr"])
+        optimizer.step()
+        scheduler.step()
+    return out
+
+
+def test_continued_schedule_picks_up_the_parent_decay():
+    optimizer = torch.optim.AdamW([torch.nn.Parameter(torch.zeros(1))], lr=1e-3)
+    # parent: 100 steps, 10 warmup, stopped at step 55, i.e. half-way down its decay
+    scheduler = continued_schedule(optimizer, {"step": 55, "total_steps": 100}, total_steps=10)
+    lrs = _lrs(scheduler, optimizer, 10)
+    assert lrs[0] == pytest.approx(5e-4)
+    assert all(a > b > 0 for a, b in zip(lrs, lrs[1:]))
+
+
+@pytest.mark.parametrize("step", [0, 5, 100])
+def test_continued_schedule_rewarms_after_a_finished_or_warming_parent(step):
+    optimizer = torch.optim.AdamW([torch.nn.Parameter(torch.zeros(1))], lr=1e-3)
+    assert continued_schedule(optimizer, {"step": step, "total_steps": 100}, total_steps=10) is None
+
+
+def test_warm_start_keeps_replay_out_of_out_dir(model_dir, tmp_path):
+    out_dir = str(tmp_path / "child")
+    cmd = [sys.executable, os.path.join(SRC, "train.py"), "--init_from", model_dir, "--train", DEV,
+           "--replay", DEV, "--replay_ratio", "0.5", "--dev", DEV, "--max_steps", "2", "--batch_size", "4",
+           "--device", "cpu", "--max_precision_drop", "1.0", "--out_dir", out_dir]
+    r = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    assert r.returncode == 0, r.stderr[-2000:]
+    assert "replayed examples" in r.stdout
+    assert os.path.exists(os.path.join(out_dir, LINEAGE_FILE))
+    assert not os.path.exists(os.path.join(out_dir, "replay.jsonl"))
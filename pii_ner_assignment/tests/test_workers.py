@@ -0,0 +1,65 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from conftest import ROOT, SRC
+from recognizer import PIIRecognizer
+from workers import WorkerPool
+
+# share=True forks the process that loaded the model; run it in a fresh interpreter so the
+# fork never inherits thread pools that other tests already started in this one
+SHARED_POOL = textwrap.dedent("""
+    import json, sys
+    sys.path.insert(0, {src!r})
+    from workers import WorkerPool
+
+    texts = json.load(sys.stdin)
+    with WorkerPool({model_dir!r}, n_workers=2, share=True, num_threads=1, device="cpu") as pool:
+        first = pool.predict_batch(texts, chunk_size=4)
+        try:
+            pool.predict_batch(texts[:8] + [None] + texts[8:16], chunk_size=4)  # one chunk fails
+            failed = None
+        except RuntimeError as e:
+            failed = str(e)
+        again = pool.predict_batch(texts, chunk_size=4)
+        memory = pool.memory_report()
+    json.dump({{"first": first, "failed": failed, "again": again, "memory": memory}}, sys.stdout)
+""")
+
+
+def test_shared_pool_matches_recognizer_and_survives_a_failed_chunk(model_dir, dev_texts):
+    texts = dev_texts[:40]
+    script = SHARED_POOL.format(src=SRC, model_dir=model_dir)
+    r = subprocess.run([sys.executable, "-c", script], input=json.dumps(texts), cwd=ROOT, capture_output=True,
+                       text=True, timeout=300)
+    assert r.returncode == 0, r.stderr[-2000:]
+    out = json.loads(r.stdout)
+
+    with PIIRecognizer(model_dir, device="cpu", use_tuning_profile=False) as rec:
+        expected = rec.predict_batch(texts)
+    assert out["first"] == expected
+    assert out["failed"] and out["failed"].startswith("worker failed")
+    # the failed call's other chunks were drained, not handed to this one
+    assert out["again"] == expected
+    assert len(out["memory"]) == 2 and all(m["shared_mb"] > 0 for m in out["memory"])
+
+
+def test_worker_that_fails_to_load_raises(tmp_path):
+    missing = str(tmp_path / "no_such_model")
+    with pytest.raises(RuntimeError, match="failed to start") as info:
+        WorkerPool(missing, n_workers=1, share=False, num_threads=1, device="cpu")
+    assert "no_such_model" in str(info.value)
+
+
+def test_dead_worker_raises_instead_of_blocking(model_dir, dev_texts):
+    with WorkerPool(model_dir, n_workers=1, share=False, num_threads=1, device="cpu") as pool:
+        assert len(pool.predict_batch(dev_texts[:4])) == 4
+        os.kill(pool.procs[0].pid, signal.SIGKILL)
+        pool.procs[0].join(timeout=10)
+        with pytest.raises(RuntimeError, match="exited with code"):
+            pool.predict_batch(dev_texts[:4], timeout=30)